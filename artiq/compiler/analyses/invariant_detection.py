@@ -1,6 +1,6 @@
 """
 :class:`InvariantDetection` determines which attributes can be safely
-marked kernel invariant.
+marked kernel invariant, and which attributes are written to.
 """
 
 from pythonparser import diagnostic
@@ -10,13 +10,21 @@ class InvariantDetection:
     def __init__(self, engine):
         self.engine = engine
 
-    def process(self, functions):
+    def process(self, functions, remarks=True):
+        """
+        Collect the attributes of instances that ``functions`` store to
+        into :attr:`attr_written`, as ``(type, attr)`` pairs. If ``remarks``
+        is true, also suggest marking the other attributes kernel invariant.
+        """
         self.attr_locs = dict()
         self.attr_written = set()
 
         for func in functions:
             self.process_function(func)
 
+        if not remarks:
+            return
+
         for key in self.attr_locs:
             if key not in self.attr_written:
                 typ, attr = key
@@ -6,7 +6,7 @@ annotated as ``@kernel`` when they are referenced.
 """
 
 import typing
-import os, re, linecache, inspect, textwrap, types as pytypes, numpy
+import os, re, linecache, inspect, textwrap, hashlib, types as pytypes, numpy
 from collections import OrderedDict, defaultdict
 
 from pythonparser import ast, algorithm, source, diagnostic, parse_buffer
@@ -27,6 +27,44 @@ except ImportError:
     _ArrayFunctionDispatcher = None    
 
 
+# Numeric arrays and lists with at least this many elements are embedded
+# into kernels as a single binary constant. The threshold does not change
+# the semantics: like the literals quoted for smaller lists and arrays, every
+# evaluation of a reference to the host value gives a fresh copy of the
+# constant, and modifying it in a kernel affects neither the host value nor
+# the other references.
+QUOTE_BLOB_THRESHOLD = 64
+
+_blob_elt_types = {
+    int: builtins.TInt,
+    float: builtins.TFloat,
+    numpy.int32: builtins.TInt32,
+    numpy.int64: builtins.TInt64,
+    numpy.float64: builtins.TFloat,
+}
+
+# Syntax trees of the embedded functions parsed in this process, keyed by
+# the filename and first line of the function and stored with the source
+# they were parsed from. Library kernels (e.g. driver methods) are quoted
+# by most kernels, and parsing them again for each compilation is a large
+# part of the time spent stitching.
+_function_syntax_cache = {}
+
+
+def _copy_syntax_tree(node):
+    # Later stages transform syntax trees in place; the locations are shared.
+    if isinstance(node, list):
+        return [_copy_syntax_tree(elt) for elt in node]
+    elif isinstance(node, ast.AST):
+        copy = node.__class__.__new__(node.__class__)
+        copy.__dict__.update(node.__dict__)
+        for field in node._fields:
+            setattr(copy, field, _copy_syntax_tree(getattr(node, field)))
+        return copy
+    else:
+        return node
+
+
 class SpecializedFunction:
     def __init__(self, instance_type, host_function):
         self.instance_type = instance_type
@@ -243,27 +281,42 @@ class ASTSynthesizer:
             self.source_last_new_line = len(self.source) + 2
         return self._add(fragment)
 
+    def _numeric_elt_type(self, value):
+        """Return the element type of `value` if it is a non-empty list
+        of numbers of the same type, or ``None`` otherwise."""
+        if len(value) == 0:
+            return None
+        v = value[0]
+        if isinstance(v, int):
+            T = int
+        elif isinstance(v, float):
+            T = float
+        elif isinstance(v, numpy.int32):
+            T = numpy.int32
+        elif isinstance(v, numpy.int64):
+            T = numpy.int64
+        else:
+            return None
+        for v in value:
+            if not isinstance(v, T):
+                return None
+        return T
+
+    def _quote_blob(self, value, typ):
+        # Large numeric arrays and lists are quoted as a whole, so that
+        # their elements are emitted as a single constant instead of going
+        # through the AST and the IR one by one.
+        quote_loc   = self._add('`')
+        repr_loc    = self._add("<{} of {} elements>".format(type(value).__name__,
+                                                             numpy.size(value)))
+        unquote_loc = self._add('`')
+        loc         = quote_loc.join(unquote_loc)
+        return asttyped.QuoteT(value=value, type=typ, loc=loc)
+
     def fast_quote_list(self, value):
         elts = [None] * len(value)
-        is_T = False
-        if len(value) > 0:
-            v = value[0]
-            is_T = True
-            if isinstance(v, int):
-                T = int
-            elif isinstance(v, float):
-                T = float
-            elif isinstance(v, numpy.int32):
-                T = numpy.int32
-            elif isinstance(v, numpy.int64):
-                T = numpy.int64
-            else:
-                is_T = False
-            if is_T:
-                for v in value:
-                    if not isinstance(v, T):
-                        is_T = False
-                        break
+        T = self._numeric_elt_type(value)
+        is_T = T is not None
         if is_T:
             is_int = T != float
             if T == int:
@@ -364,6 +417,10 @@ class ASTSynthesizer:
 
             return asttyped.QuoteT(value=value, type=builtins.TByteArray(), loc=loc)
         elif isinstance(value, list):
+            if len(value) >= QUOTE_BLOB_THRESHOLD:
+                T = self._numeric_elt_type(value)
+                if T is not None:
+                    return self._quote_blob(value, builtins.TList(_blob_elt_types[T]()))
             begin_loc = self._add_iterable("[")
             elts = self.fast_quote_list(value)
             end_loc   = self._add_iterable("]")
@@ -378,6 +435,10 @@ class ASTSynthesizer:
                                    type=types.TTuple([e.type for e in elts]),
                                    begin_loc=begin_loc, end_loc=end_loc,
                                    loc=begin_loc.join(end_loc))
+        elif isinstance(value, numpy.ndarray) and value.size >= QUOTE_BLOB_THRESHOLD and \
+                value.ndim > 0 and value.dtype.type in _blob_elt_types:
+            typ = builtins.TArray(_blob_elt_types[value.dtype.type](), value.ndim)
+            return self._quote_blob(value, typ)
         elif isinstance(value, numpy.ndarray):
             return self.call(numpy.array, [list(value)], {})
         elif inspect.isfunction(value) or inspect.ismethod(value) or \
@@ -602,6 +663,11 @@ class StitchingASTTypedRewriter(ASTTypedRewriter):
         finally:
             self.env_stack.pop()
 
+    def visit_QuoteT(self, node):
+        # Quotes are already typed, and traversing their value would copy it
+        # if it is a list.
+        return node
+
     def visit_Name(self, node):
         typ = super()._try_find_name(node.id)
         if typ is not None:
@@ -801,6 +867,60 @@ class TypedtreeHasher(algorithm.Visitor):
             fields = fields + node._types
         return hash(tuple(freeze(getattr(node, field_name)) for field_name in fields))
 
+class TypedtreeDigest(TypedtreeHasher):
+    """
+    Like :class:`TypedtreeHasher`, but feeds a :mod:`hashlib` object instead
+    of computing Python hashes, so that the result is stable across interpreter
+    instances, and also accounts for literal values and quoted functions, since
+    those affect generated code.
+    """
+
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.type_printer = types.TypePrinter()
+
+    def update(self, fragment):
+        self.hasher.update(fragment.encode("utf-8"))
+        self.hasher.update(b"\0")
+
+    def update_type(self, typ):
+        self.update(self.type_printer.name(typ, max_depth=0))
+
+    def generic_visit(self, node):
+        self.update(type(node).__name__)
+        fields = node._fields
+        if hasattr(node, '_types'):
+            fields = fields + node._types
+        for field_name in fields:
+            self.update(field_name)
+            self._freeze(getattr(node, field_name))
+        if hasattr(node, 'flags'):
+            self.update(repr(sorted(node.flags)))
+
+    def _freeze(self, obj):
+        if isinstance(obj, ast.AST):
+            self.visit(obj)
+        elif isinstance(obj, list):
+            self.update("[{}".format(len(obj)))
+            for elem in obj:
+                self._freeze(elem)
+        elif isinstance(obj, types.Type):
+            self.update_type(obj)
+        elif obj is None or isinstance(obj, (bool, int, float, str, bytes, bytearray)):
+            self.update(repr(obj))
+        elif isinstance(obj, numpy.ndarray):
+            self.update("ndarray {} {}".format(obj.dtype.str, obj.shape))
+            self.hasher.update(numpy.ascontiguousarray(obj).tobytes())
+        elif inspect.ismethod(obj):
+            self._freeze(obj.__func__)
+        elif isinstance(obj, SpecializedFunction):
+            self._freeze(obj.host_function)
+        elif hasattr(obj, '__qualname__'):
+            self.update("{}.{}".format(getattr(obj, '__module__', ''), obj.__qualname__))
+        else:
+            self.update(type(obj).__qualname__)
+
+
 class Stitcher:
     def __init__(self, core, dmgr, engine=None, print_as_rpc=True, destination=0, subkernel_arg_types=[], subkernels={}):
         self.core = core
@@ -850,23 +970,38 @@ class Stitcher:
                                          quote=self._quote)
         typedtree_hasher = TypedtreeHasher()
 
-        # Iterate inference to fixed point.
-        old_typedtree_hash = None
-        old_attr_count = None
+        # Iterate inference to fixed point. After the first pass, only
+        # the functions that were injected, or whose own visit changed their
+        # types or discovered new host attributes or functions, are visited
+        # again. Since functions also affect each other through shared types
+        # and host values, the fixed point is only accepted once a pass over
+        # the entire typedtree does not change anything.
+        node_hashes = {}
+        dirty = None
         while True:
-            inferencer.visit(self.typedtree)
-            if self.definitely_changed:
-                changed = True
-                self.definitely_changed = False
-            else:
-                typedtree_hash = typedtree_hasher.visit(self.typedtree)
-                attr_count = self.embedding_map.attribute_count()
-                changed = old_attr_count != attr_count or \
-                          old_typedtree_hash != typedtree_hash
-                old_typedtree_hash = typedtree_hash
-                old_attr_count = attr_count
-
-            if not changed:
+            full_pass = not dirty
+            visited = {}
+            pending = [node for node in self.typedtree
+                       if full_pass or id(node) in dirty]
+            while pending:
+                for node in pending:
+                    attr_count = self.embedding_map.attribute_count()
+                    inferencer.visit(node)
+                    visited[id(node)] = (node, self.definitely_changed or
+                        attr_count != self.embedding_map.attribute_count())
+                    self.definitely_changed = False
+                # Visit the functions injected during this pass right away.
+                pending = [node for node in self.typedtree
+                           if id(node) not in visited and id(node) not in node_hashes]
+
+            dirty = set()
+            for node, discovered in visited.values():
+                node_hash = typedtree_hasher.visit(node)
+                if discovered or node_hashes.get(id(node)) != node_hash:
+                    dirty.add(id(node))
+                node_hashes[id(node)] = node_hash
+
+            if full_pass and not dirty:
                 break
 
         # After we've discovered every referenced attribute, check if any kernel_invariant
@@ -903,6 +1038,70 @@ class Stitcher:
             typing_env=self.globals, globals_in_scope=set(),
             body=self.typedtree, loc=source.Range(source_buffer, 0, 0))
 
+    def host_values(self):
+        """
+        Return the list of host objects, classes and modules quoted while
+        stitching, in a deterministic order.
+        """
+        values = []
+        seen = set()
+        def add(value):
+            if id(value) not in seen:
+                seen.add(id(value))
+                values.append(value)
+        for typ, typ_values in self.value_map.items():
+            for value, loc in typ_values:
+                add(value)
+                if types.is_instance(typ):
+                    add(type(value))
+        return values
+
+    def digest(self):
+        """
+        Return a hex digest of the stitched typedtree together with the values
+        of every attribute of the host objects it embeds. Must be called after
+        :meth:`finalize`.
+        """
+        hasher = hashlib.sha256()
+        typedtree_digest = TypedtreeDigest(hasher)
+        typedtree_digest.visit(self.typedtree)
+
+        host_values = self.host_values()
+        value_indices = {id(value): index for index, value in enumerate(host_values)}
+
+        def digest_value(value):
+            if id(value) in value_indices:
+                typedtree_digest.update("#{}".format(value_indices[id(value)]))
+            elif isinstance(value, numpy.ndarray):
+                typedtree_digest.update("ndarray {} {}".format(value.dtype.str, value.shape))
+                hasher.update(numpy.ascontiguousarray(value).tobytes())
+            elif isinstance(value, (list, tuple)):
+                typedtree_digest.update("{}[{}".format(type(value).__name__, len(value)))
+                for elt in value:
+                    digest_value(elt)
+            elif isinstance(value, (bool, int, float, str, bytes, bytearray,
+                                    numpy.integer, numpy.floating, numpy.bool_)) or \
+                    value is None:
+                typedtree_digest.update("{} {!r}".format(type(value).__name__, value))
+            else:
+                typedtree_digest._freeze(value)
+
+        for typ, typ_values in self.value_map.items():
+            typedtree_digest.update_type(typ)
+            # Kernel invariants change the generated code, e.g. attribute writeback.
+            constant_attributes = getattr(typ.find(), "constant_attributes", set())
+            typedtree_digest.update(repr(sorted(constant_attributes)))
+            for value, loc in typ_values:
+                digest_value(value)
+                for attr, attr_type in typ.find().attributes.items():
+                    if attr == "__objectid__":
+                        continue
+                    typedtree_digest.update(attr)
+                    typedtree_digest.update_type(attr_type)
+                    if hasattr(value, attr):
+                        digest_value(getattr(value, attr))
+        return hasher.hexdigest()
+
     def _inject(self, node):
         self.typedtree.insert(self.inject_at, node)
         self.inject_at += 1
@@ -1073,14 +1272,24 @@ class Stitcher:
         initial_whitespace = re.search(r"^\s*", source_code).group(0)
         initial_indent = len(initial_whitespace.expandtabs())
 
-        # Parse.
-        source_buffer = source.Buffer(source_code, filename, first_line)
-        lexer = source_lexer.Lexer(source_buffer, version=(3, 6), diagnostic_engine=self.engine)
-        lexer.indent = [(initial_indent,
-                         source.Range(source_buffer, 0, len(initial_whitespace)),
-                         initial_whitespace)]
-        parser = source_parser.Parser(lexer, version=(3, 6), diagnostic_engine=self.engine)
-        function_node = parser.file_input().body[0]
+        # Parse, unless the same source has already been parsed. The source is
+        # read through linecache, so with the import cache hook installed it is
+        # the source the function was imported from.
+        cache_key = (filename, first_line)
+        cached_source_code, function_node = \
+            _function_syntax_cache.get(cache_key, (None, None))
+        if cached_source_code != source_code:
+            source_buffer = source.Buffer(source_code, filename, first_line)
+            lexer = source_lexer.Lexer(source_buffer, version=(3, 6),
+                                       diagnostic_engine=self.engine)
+            lexer.indent = [(initial_indent,
+                             source.Range(source_buffer, 0, len(initial_whitespace)),
+                             initial_whitespace)]
+            parser = source_parser.Parser(lexer, version=(3, 6),
+                                          diagnostic_engine=self.engine)
+            function_node = parser.file_input().body[0]
+            _function_syntax_cache[cache_key] = (source_code, function_node)
+        function_node = _copy_syntax_tree(function_node)
 
         # Mangle the name, since we put everything into a single module.
         full_function_name = "{}.{}".format(module_name, host_function.__qualname__)
@@ -0,0 +1,291 @@
+"""
+The :class:`CompilationCache` class keeps the shared libraries produced
+for previously compiled kernels, so that resubmitting a kernel whose
+stitched typedtree, embedded host values and target are unchanged skips
+ARTIQ IR generation and LLVM entirely.
+
+Entries are keyed on a digest computed by :meth:`.Stitcher.digest` combined
+with the target description and the compiler version. They are kept in
+a bounded in-memory LRU and, optionally, in a size-bounded directory on disk
+that survives across processes (e.g. across experiments submitted to the master).
+
+Code generation stores exception names and object IDs into the
+:class:`.EmbeddingMap` after stitching. Since a cache hit bypasses code
+generation, these additions are recorded alongside the library and replayed
+into the fresh embedding map of the hit.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+
+from sipyco import pyon
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever the layout of cache entries or the way the key is computed changes.
+CACHE_FORMAT_VERSION = 2
+
+_HEADER = struct.Struct(">4sIII")
+_MAGIC = b"AQKC"
+
+
+class CacheEntry:
+    """A cached compilation result.
+
+    :var objects: (list of bytes) relocatable objects the library was linked
+        from, used to produce an unstripped library for symbolization.
+    :var stripped_library: (bytes) shared library as uploaded to the core device.
+    :var strings: (list of str) strings stored into the embedding map during
+        code generation, in order.
+    :var object_keys: (list of (int, int)) object keys allocated in the embedding map
+        during code generation, paired with the index of the corresponding value
+        in :meth:`.Stitcher.host_values`.
+    """
+    def __init__(self, objects, stripped_library, strings, object_keys):
+        self.objects = objects
+        self.stripped_library = stripped_library
+        self.strings = strings
+        self.object_keys = object_keys
+
+    def size(self):
+        return sum(len(obj) for obj in self.objects) + len(self.stripped_library)
+
+    def to_bytes(self):
+        metadata = pyon.encode({
+            "strings": self.strings,
+            "object_keys": self.object_keys,
+            "object_sizes": [len(obj) for obj in self.objects]
+        }).encode()
+        objects = b"".join(self.objects)
+        return (_HEADER.pack(_MAGIC, len(metadata),
+                             len(objects), len(self.stripped_library)) +
+                metadata + objects + self.stripped_library)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, metadata_len, objects_len, stripped_len = \
+            _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a kernel cache entry")
+        offset = _HEADER.size
+        if offset + metadata_len + objects_len + stripped_len != len(data):
+            raise ValueError("truncated kernel cache entry")
+        metadata = pyon.decode(data[offset:offset + metadata_len].decode())
+        offset += metadata_len
+        objects = []
+        for size in metadata["object_sizes"]:
+            objects.append(data[offset:offset + size])
+            offset += size
+        stripped_library = data[offset:offset + stripped_len]
+        return cls(objects, stripped_library, metadata["strings"],
+                   [tuple(obj) for obj in metadata["object_keys"]])
+
+    @classmethod
+    def record(cls, objects, stripped_library, embedding_map, mark, host_values):
+        """Capture the embedding map additions made since ``mark`` (as returned
+        by :func:`mark_embedding_map`). Returns ``None`` if an allocated object
+        is not one of ``host_values``, in which case the result cannot be cached."""
+        str_count, object_keys = mark
+        strings = [embedding_map.retrieve_str(str_id)
+                   for str_id in range(str_count, len(embedding_map.str_forward_map))]
+
+        value_indices = {id(value): index for index, value in enumerate(host_values)}
+        new_object_keys = []
+        for key, obj_ref in embedding_map.object_forward_map.items():
+            if key in object_keys:
+                continue
+            index = value_indices.get(id(obj_ref))
+            if index is None:
+                return None
+            new_object_keys.append((key, index))
+
+        return cls(objects, stripped_library, strings, new_object_keys)
+
+    def _check(self, embedding_map, host_values):
+        # Whether replaying into embedding_map gives the recorded IDs, without
+        # modifying it. Follows the allocation of EmbeddingMap.store_str and
+        # EmbeddingMap.store_object.
+        if len(set(self.strings)) != len(self.strings):
+            return False
+        for string in self.strings:
+            if string in embedding_map.str_forward_map:
+                return False
+
+        current_key = embedding_map.object_current_key
+        stored = dict()
+        for key, index in self.object_keys:
+            if index >= len(host_values):
+                return False
+            obj_id = id(host_values[index])
+            if obj_id in embedding_map.object_reverse_map:
+                obj_key = embedding_map.object_reverse_map[obj_id]
+            elif obj_id in stored:
+                obj_key = stored[obj_id]
+            else:
+                current_key += 1
+                while embedding_map.object_forward_map.get(current_key):
+                    current_key += 1
+                obj_key = stored[obj_id] = current_key
+            if obj_key != key:
+                return False
+        return True
+
+    def replay(self, embedding_map, host_values):
+        """Apply the recorded embedding map additions. Returns ``False``,
+        leaving the embedding map unchanged, if they would not give the
+        recorded string and object IDs."""
+        if not self._check(embedding_map, host_values):
+            return False
+        for string in self.strings:
+            embedding_map.store_str(string)
+        for key, index in self.object_keys:
+            obj_key = embedding_map.store_object(host_values[index])
+            assert obj_key == key
+        return True
+
+
+def mark_embedding_map(embedding_map):
+    """Snapshot the state of ``embedding_map`` for :meth:`CacheEntry.record`."""
+    return len(embedding_map.str_forward_map), set(embedding_map.object_forward_map)
+
+
+class CompilationCache:
+    """Content-addressed cache of compiled kernels.
+
+    :param directory: directory where entries are persisted, or ``None``
+        to only keep entries in memory.
+    :param max_memory_entries: number of entries kept in memory.
+    :param max_disk_size: total size in bytes of the entries kept in
+        ``directory``. The least recently used entries are evicted first.
+    """
+    def __init__(self, directory=None, max_memory_entries=32,
+                 max_disk_size=256*1024*1024):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_size = max_disk_size
+        self._memory = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(*components):
+        """Combine the string representations of ``components`` into a key."""
+        hasher = hashlib.sha256()
+        hasher.update(str(CACHE_FORMAT_VERSION).encode())
+        for component in components:
+            hasher.update(b"\0")
+            hasher.update(str(component).encode())
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".kcache")
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the :class:`CacheEntry` for ``key``, or ``None``."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    entry = CacheEntry.from_bytes(f.read())
+                # Use the modification time to track recency for eviction.
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, struct.error):
+                logger.warning("discarding corrupted kernel cache entry %s",
+                               path, exc_info=True)
+                self._discard(path)
+            else:
+                self._remember(key, entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.directory is None or entry.size() > self.max_disk_size:
+            return
+
+        # Write atomically, so that concurrent workers never read a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(entry.to_bytes())
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            logger.warning("failed to write kernel cache entry", exc_info=True)
+            self._discard(temp_path)
+            return
+        self._evict()
+
+    def _discard(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith(".kcache"):
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                total_size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_disk_size:
+                break
+            self._discard(path)
+            total_size -= size
+            self.evictions += 1
+
+    def clear(self):
+        self._memory.clear()
+        if self.directory is not None:
+            with os.scandir(self.directory) as it:
+                for dir_entry in it:
+                    if dir_entry.name.endswith(".kcache"):
+                        self._discard(dir_entry.path)
+
+    def stats(self):
+        """Return a dictionary of hit/miss statistics."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory)
+        }
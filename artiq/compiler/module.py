@@ -82,8 +82,9 @@ class Module:
         local_access_validator.process(self.artiq_ir)
         local_demoter.process(self.artiq_ir)
         constant_hoister.process(self.artiq_ir)
-        if remarks:
-            invariant_detection.process(self.artiq_ir)
+        invariant_detection.process(self.artiq_ir, remarks=remarks)
+        # only attributes that may have been modified need to be written back
+        self.written_attributes = invariant_detection.attr_written
         # for subkernels: main kernel inferencer output, to be passed to further compilations
         self.subkernel_arg_types = inferencer.subkernel_arg_types
 
@@ -93,7 +94,8 @@ class Module:
             engine=self.engine, module_name=self.name, target=target,
             embedding_map=self.embedding_map)
         return llvm_ir_generator.process(self.artiq_ir,
-            attribute_writeback=self.attribute_writeback)
+            attribute_writeback=self.attribute_writeback,
+            written_attributes=self.written_attributes)
 
     def __repr__(self):
         printer = types.TypePrinter()
@@ -1,4 +1,5 @@
-import os, sys, tempfile, subprocess, io
+import os, sys, tempfile, subprocess, io, time
+from collections import OrderedDict
 from artiq.compiler import types, ir
 from llvmlite import ir as ll, binding as llvm
 
@@ -49,6 +50,9 @@ class RunTool:
         for filename in self._tempnames.values():
             os.unlink(filename)
 
+# Maps demangler tool name to a dict of mangled to demangled symbol names.
+_demangle_cache = {}
+
 def _dump(target, kind, suffix, content):
     if target is not None:
         print("====== {} DUMP ======".format(kind.upper()), file=sys.stderr)
@@ -81,6 +85,11 @@ class Target:
         provided by the target, e.g. ``"printf"``.
     :var now_pinning: (boolean)
         Whether the target implements the now-pinning RTIO optimization.
+    :var opt_level: (int)
+        Optimization level, from 0 (no optimization, fastest compilation)
+        to 3 (loop unrolling and vectorization, slowest compilation).
+    :var timings: (dict of string to float)
+        Time in seconds spent in each compilation phase, e.g. ``"optimization"``.
     """
     triple = "unknown"
     data_layout = ""
@@ -94,21 +103,46 @@ class Target:
     tool_symbolizer = "llvm-symbolizer"
     tool_cxxfilt = "llvm-cxxfilt"
 
-    def __init__(self, subkernel_id=None):
+    opt_levels = (0, 1, 2, 3)
+    inlining_threshold = 275
+
+    def __init__(self, subkernel_id=None, opt_level=2):
+        if opt_level not in self.opt_levels:
+            raise ValueError("Unsupported optimization level {}".format(opt_level))
         self.llcontext = ll.Context()
         self.subkernel_id = subkernel_id
+        self.opt_level = opt_level
+        self.timings = {}
+
+    def __reduce__(self):
+        # Copies of the target, such as those sent to the worker processes
+        # compiling subkernels, start afresh with the same configuration.
+        return type(self), (self.subkernel_id, self.opt_level)
+
+    def add_timing(self, phase, start):
+        """Add the time elapsed since ``start``, as returned by
+        :func:`time.monotonic`, to the time spent in ``phase``."""
+        self.timings[phase] = self.timings.get(phase, 0.0) + time.monotonic() - start
 
     def target_machine(self):
         lltarget = llvm.Target.from_triple(self.triple)
         llmachine = lltarget.create_target_machine(
                         features=",".join(["+{}".format(f) for f in self.features]),
-                        reloc="pic", codemodel="default",
+                        opt=self.opt_level, reloc="pic", codemodel="default",
                         abiname="ilp32d" if isinstance(self, RV32GTarget) else "")
         llmachine.set_asm_verbosity(True)
         return llmachine
 
     def optimize(self, llmodule):
+        if self.opt_level == 0:
+            return
+
         llpassmgr = llvm.create_module_pass_manager()
+        if self.opt_level == 3:
+            # Let the loop optimizations query the cost model of the target.
+            # The target machine must outlive the pass manager.
+            llmachine = self.target_machine()
+            llmachine.add_analysis_passes(llpassmgr)
 
         # Register our alias analysis passes.
         llpassmgr.add_basic_alias_analysis_pass()
@@ -124,13 +158,26 @@ class Target:
         llpassmgr.add_function_attrs_pass()
         llpassmgr.add_global_optimizer_pass()
 
-        # Now, actually optimize the code.
-        llpassmgr.add_function_inlining_pass(275)
-        llpassmgr.add_ipsccp_pass()
-        llpassmgr.add_instruction_combining_pass()
-        llpassmgr.add_gvn_pass()
-        llpassmgr.add_cfg_simplification_pass()
-        llpassmgr.add_licm_pass()
+        if self.opt_level == 1:
+            # Only inline the functions that must be.
+            llpassmgr.add_always_inliner_pass()
+        elif self.opt_level == 2:
+            # Now, actually optimize the code.
+            llpassmgr.add_function_inlining_pass(self.inlining_threshold)
+            llpassmgr.add_ipsccp_pass()
+            llpassmgr.add_instruction_combining_pass()
+            llpassmgr.add_gvn_pass()
+            llpassmgr.add_cfg_simplification_pass()
+            llpassmgr.add_licm_pass()
+        else:
+            # Run the full LLVM pipeline, which includes loop unrolling
+            # and vectorization.
+            llpmbuilder = llvm.create_pass_manager_builder()
+            llpmbuilder.opt_level = 3
+            llpmbuilder.inlining_threshold = self.inlining_threshold
+            llpmbuilder.loop_vectorize = True
+            llpmbuilder.slp_vectorize = True
+            llpmbuilder.populate(llpassmgr)
 
         # Clean up after optimizing.
         llpassmgr.add_dead_arg_elimination_pass()
@@ -140,6 +187,13 @@ class Target:
 
     def compile(self, module):
         """Compile the module to a relocatable object for this target."""
+        return self.optimize_llvm_ir(self.generate_llvm_ir(module))
+
+    def generate_llvm_ir(self, module):
+        """Generate unoptimized LLVM IR for the module.
+
+        This accesses the host objects embedded in the module, and so must run
+        on the thread that stitched it."""
 
         if os.getenv("ARTIQ_DUMP_SIG"):
             print("====== MODULE_SIGNATURE DUMP ======", file=sys.stderr)
@@ -149,29 +203,43 @@ class Target:
             ir.BasicBlock._dump_loc = False
 
         type_printer = types.TypePrinter()
-        suffix = "_subkernel_{}".format(self.subkernel_id) if self.subkernel_id is not None else ""
-        _dump(os.getenv("ARTIQ_DUMP_IR"), "ARTIQ IR", suffix + ".txt",
+        _dump(os.getenv("ARTIQ_DUMP_IR"), "ARTIQ IR", self._dump_suffix() + ".txt",
               lambda: "\n".join(fn.as_entity(type_printer) for fn in module.artiq_ir))
 
-        llmod = module.build_llvm_ir(self)
+        start = time.monotonic()
+        llmodule = module.build_llvm_ir(self)
+        self.add_timing("llvm_ir", start)
+        return llmodule
 
+    def optimize_llvm_ir(self, llmod):
+        """Parse, verify and optimize LLVM IR generated by :meth:`generate_llvm_ir`,
+        either as a module or as text."""
+        suffix = self._dump_suffix()
+
+        start = time.monotonic()
         try:
             llparsedmod = llvm.parse_assembly(str(llmod))
             llparsedmod.verify()
         except RuntimeError:
             _dump("", "LLVM IR (broken)", ".ll", lambda: str(llmod))
             raise
+        self.add_timing("llvm_ir", start)
 
         _dump(os.getenv("ARTIQ_DUMP_UNOPT_LLVM"), "LLVM IR (generated)", suffix + "_unopt.ll",
               lambda: str(llparsedmod))
 
+        start = time.monotonic()
         self.optimize(llparsedmod)
+        self.add_timing("optimization", start)
 
         _dump(os.getenv("ARTIQ_DUMP_LLVM"), "LLVM IR (optimized)", suffix + ".ll",
               lambda: str(llparsedmod))
 
         return llparsedmod
 
+    def _dump_suffix(self):
+        return "_subkernel_{}".format(self.subkernel_id) if self.subkernel_id is not None else ""
+
     def assemble(self, llmodule):
         llmachine = self.target_machine()
 
@@ -181,12 +249,23 @@ class Target:
         _dump(os.getenv("ARTIQ_DUMP_OBJ"), "Object file", ".o",
               lambda: llmachine.emit_object(llmodule))
 
-        return llmachine.emit_object(llmodule)
+        start = time.monotonic()
+        obj = llmachine.emit_object(llmodule)
+        self.add_timing("assembly", start)
+        return obj
 
-    def link(self, objects):
-        """Link the relocatable objects into a shared library for this target."""
+    def link(self, objects, strip=False):
+        """Link the relocatable objects into a shared library for this target.
+
+        If ``strip`` is true, debug information is left out of the library,
+        which is equivalent to but cheaper than calling :meth:`strip` on the result."""
+        if strip and os.getenv("ARTIQ_DUMP_ELF") is not None:
+            return self.strip(self.link(objects))
+
+        start = time.monotonic()
         with RunTool([self.tool_ld, "-shared", "--eh-frame-hdr"] +
                      self.additional_linker_options +
+                     (["--strip-debug"] if strip else []) +
                      ["-T" + os.path.join(os.path.dirname(__file__), "kernel.ld")] +
                      ["{{obj{}}}".format(index) for index in range(len(objects))] +
                      ["-x"] +
@@ -195,14 +274,17 @@ class Target:
                      **{"obj{}".format(index): obj for index, obj in enumerate(objects)}) \
                 as results:
             library = results["output"].read()
+            self.add_timing("linking", start)
 
-            _dump(os.getenv("ARTIQ_DUMP_ELF"), "Shared library", ".elf",
-                  lambda: library)
+            if not strip:
+                _dump(os.getenv("ARTIQ_DUMP_ELF"), "Shared library", ".elf",
+                      lambda: library)
 
             return library
 
-    def compile_and_link(self, modules):
-        return self.link([self.assemble(self.compile(module)) for module in modules])
+    def compile_and_link(self, modules, strip=False):
+        return self.link([self.assemble(self.compile(module)) for module in modules],
+                         strip=strip)
 
     def strip(self, library):
         with RunTool([self.tool_strip, "--strip-debug", "{library}", "-o", "{output}"],
@@ -210,6 +292,20 @@ class Target:
                 as results:
             return results["output"].read()
 
+    def symbolizer(self, objects):
+        """Return a function symbolizing addresses for the shared library linked
+        from ``objects``. Since symbolization is only needed to report exceptions,
+        the unstripped library is only linked on first use."""
+        library = None
+        def symbolize(addresses):
+            nonlocal library
+            if addresses == []:
+                return []
+            if library is None:
+                library = self.link(objects)
+            return self.symbolize(library, addresses)
+        return symbolize
+
     def symbolize(self, library, addresses):
         if addresses == []:
             return []
@@ -260,8 +356,15 @@ class Target:
     def demangle(self, names):
         if not any(names):
             return names
-        with RunTool([self.tool_cxxfilt] + names) as results:
-            return results["__stdout__"].read().rstrip().split("\n")
+        # Backtraces of kernels repeatedly run by an experiment mostly refer to
+        # the same functions, so only spawn the demangler for unseen names.
+        cache = _demangle_cache.setdefault(self.tool_cxxfilt, {"": ""})
+        unknown = list(OrderedDict.fromkeys(name for name in names if name not in cache))
+        if unknown:
+            with RunTool([self.tool_cxxfilt] + unknown) as results:
+                demangled = results["__stdout__"].read().rstrip().split("\n")
+            cache.update(zip(unknown, demangled))
+        return [cache[name] for name in names]
 
 class NativeTarget(Target):
     def __init__(self):
@@ -1,6 +1,7 @@
 import sys, os
 from pythonparser import diagnostic
 from ..module import Module, Source
+from .. import targets
 from ..targets import RV32GTarget
 from . import benchmark
 
@@ -33,5 +34,24 @@ def main():
     benchmark(lambda: RV32GTarget().compile_and_link([module]),
               "LLVM optimization and linking")
 
+    target = RV32GTarget()
+    elf_obj = target.assemble(target.compile(module))
+
+    benchmark(lambda: target.strip(target.link([elf_obj])),
+              "Linking and stripping (separate ld.lld and llvm-strip runs)")
+
+    benchmark(lambda: target.link([elf_obj], strip=True),
+              "Linking and stripping (single ld.lld run)")
+
+    names = ["_ZN4core9panicking5panic17h0123456789abcdefE", "_Z8functionv"]
+    def demangle_uncached():
+        targets._demangle_cache.clear()
+        target.demangle(names)
+    benchmark(demangle_uncached,
+              "Demangling (uncached)")
+
+    benchmark(lambda: target.demangle(names),
+              "Demangling (cached)")
+
 if __name__ == "__main__":
     main()
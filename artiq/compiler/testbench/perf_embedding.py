@@ -1,16 +1,137 @@
 import sys, os, tokenize
+import numpy
 from pythonparser import diagnostic
+from ...language.core import kernel
+from ...language.units import us, MHz
 from ...language.environment import ProcessArgumentManager
 from ...master.databases import DeviceDB, DatasetDB
 from ...master.worker_db import DeviceManager, DatasetManager
 from ..module import Module
 from ..embedding import Stitcher
 from ..targets import RV32GTarget
+from ...coredevice.core import _compile_llvm_ir
+from concurrent.futures import ProcessPoolExecutor
 from . import benchmark
 
 
+# Host arrays and lists referenced by the `+arrays` benchmark kernel;
+# set in main().
+waveform = table = waveform_list = None
+
+@kernel
+def large_arrays():
+    acc = 0.0
+    for i in range(len(waveform)):
+        acc += waveform[i] * waveform_list[i]
+    for row in table:
+        acc += float(row[0])
+    core_log(acc)
+
+
+class Devices:
+    """Kernel touching every local device of the Kasli example device
+    database, for the `+devices` benchmark."""
+
+    device_names = (
+        ["ttl{}".format(i) for i in range(8)] +
+        ["ttl{}_counter".format(i) for i in range(8)] +
+        ["urukul0_ch{}".format(i) for i in range(4)] +
+        ["ttl_urukul0_sw{}".format(i) for i in range(4)] +
+        ["core", "core_cache", "core_dma", "i2c_switch0", "i2c_switch1",
+         "eeprom_urukul0", "spi_urukul0", "ttl_urukul0_sync",
+         "ttl_urukul0_io_update", "urukul0_cpld",
+         "spi_sampler0_adc", "spi_sampler0_pgia", "spi_sampler0_cnv",
+         "sampler0", "spi_zotino0", "ttl_zotino0_ldac", "ttl_zotino0_clr",
+         "zotino0", "led0", "led1"])
+
+    def __init__(self, device_mgr):
+        for name in self.device_names:
+            setattr(self, name, device_mgr.get(name))
+
+    @kernel
+    def run(self):
+        self.core.reset()
+        self.i2c_switch0.set(0)
+        self.i2c_switch1.unset()
+        self.core_cache.put("offsets", [self.eeprom_urukul0.read_i32(0)])
+
+        self.ttl0.output()
+        self.ttl1.output()
+        self.ttl2.input()
+        self.ttl3.input()
+        self.ttl0.pulse(1*us)
+        self.ttl1.pulse(1*us)
+        self.ttl2.sample_input()
+        self.ttl3.gate_rising(1*us)
+        self.ttl4.pulse(1*us)
+        self.ttl5.pulse(1*us)
+        self.ttl6.on()
+        self.ttl7.off()
+        self.ttl0_counter.gate_rising(1*us)
+        self.ttl1_counter.gate_falling(1*us)
+        self.ttl2_counter.gate_both(1*us)
+        self.ttl3_counter.set_config(True, False, True, False)
+        self.ttl4_counter.gate_rising_mu(1000)
+        self.ttl5_counter.gate_falling_mu(1000)
+        self.ttl6_counter.gate_both_mu(1000)
+        self.ttl7_counter.set_config(False, True, True, False)
+
+        self.urukul0_cpld.init()
+        self.urukul0_cpld.set_att(0, 10.)
+        self.urukul0_ch0.init()
+        self.urukul0_ch1.init()
+        self.urukul0_ch2.init()
+        self.urukul0_ch3.init()
+        self.urukul0_ch0.set(100*MHz)
+        self.urukul0_ch1.set_frequency(110*MHz)
+        self.urukul0_ch2.set_amplitude(0.5)
+        self.urukul0_ch3.set_mu(0x40000000)
+        self.ttl_urukul0_sw0.on()
+        self.ttl_urukul0_sw1.on()
+        self.ttl_urukul0_sw2.off()
+        self.ttl_urukul0_sw3.off()
+        self.ttl_urukul0_sync.set(125*MHz)
+        self.ttl_urukul0_io_update.pulse_mu(8)
+        self.spi_urukul0.set_config_mu(0, 32, 16, 1)
+
+        self.sampler0.init()
+        samples = [0.]*8
+        self.sampler0.sample(samples)
+        self.spi_sampler0_adc.set_config_mu(0, 32, 16, 0)
+        self.spi_sampler0_pgia.set_config_mu(0, 16, 16, 1)
+        self.spi_sampler0_cnv.pulse(1*us)
+
+        self.zotino0.init()
+        self.zotino0.set_dac([1., 2., 3.], [0, 1, 2])
+        self.spi_zotino0.set_config_mu(0, 32, 16, 1)
+        self.ttl_zotino0_ldac.pulse(1*us)
+        self.ttl_zotino0_clr.pulse(1*us)
+
+        with self.core_dma.record("blink"):
+            self.led0.pulse(1*us)
+            self.led1.pulse(1*us)
+        self.core_dma.playback("blink")
+        self.core_dma.erase("blink")
+
+
 def main():
-    if not len(sys.argv) == 2:
+    if len(sys.argv) > 1 and sys.argv[1] in ("+arrays", "+devices"):
+        mode = sys.argv[1]
+        del sys.argv[1]
+    else:
+        mode = None
+
+    if mode == "+arrays":
+        if not len(sys.argv) in (2, 3):
+            print("Expected a device database filename and optionally "
+                  "a sample count", file=sys.stderr)
+            exit(1)
+    elif mode == "+devices":
+        if not len(sys.argv) == 2:
+            print("Expected exactly one device database filename",
+                  file=sys.stderr)
+            exit(1)
+    elif not len(sys.argv) == 2:
         print("Expected exactly one module filename", file=sys.stderr)
         exit(1)
 
@@ -22,27 +143,53 @@ def main():
     engine = diagnostic.Engine()
     engine.process = process_diagnostic
 
-    with tokenize.open(sys.argv[1]) as f:
-        testcase_code = compile(f.read(), f.name, "exec")
-        testcase_vars = {'__name__': 'testbench'}
-        exec(testcase_code, testcase_vars)
-
-    device_db_path = os.path.join(os.path.dirname(sys.argv[1]), "device_db.py")
-    device_mgr = DeviceManager(DeviceDB(device_db_path))
-
-    dataset_db_path = os.path.join(os.path.dirname(sys.argv[1]), "dataset_db.mdb")
-    dataset_db = DatasetDB(dataset_db_path)
-    dataset_mgr = DatasetManager()
-
-    argument_mgr = ProcessArgumentManager({})
-
-    def embed():
-        experiment = testcase_vars["Benchmark"]((device_mgr, dataset_mgr, argument_mgr))
-
-        stitcher = Stitcher(core=experiment.core, dmgr=device_mgr)
-        stitcher.stitch_call(experiment.run, (), {})
-        stitcher.finalize()
-        return stitcher
+    if mode == "+arrays":
+        device_mgr = DeviceManager(DeviceDB(sys.argv[1]))
+        dataset_db = None
+        samples = int(sys.argv[2]) if len(sys.argv) == 3 else 100000
+
+        global waveform, table, waveform_list
+        waveform = numpy.linspace(-1.0, 1.0, samples)
+        table = numpy.arange(samples, dtype=numpy.int32).reshape((-1, 4))
+        waveform_list = [float(x) for x in waveform]
+
+        def embed():
+            stitcher = Stitcher(core=device_mgr.get("core"), dmgr=device_mgr)
+            stitcher.stitch_call(large_arrays, (), {})
+            stitcher.finalize()
+            return stitcher
+    elif mode == "+devices":
+        device_mgr = DeviceManager(DeviceDB(sys.argv[1]))
+        dataset_db = None
+        devices = Devices(device_mgr)
+
+        def embed():
+            stitcher = Stitcher(core=devices.core, dmgr=device_mgr)
+            stitcher.stitch_call(devices.run, (), {})
+            stitcher.finalize()
+            return stitcher
+    else:
+        with tokenize.open(sys.argv[1]) as f:
+            testcase_code = compile(f.read(), f.name, "exec")
+            testcase_vars = {'__name__': 'testbench'}
+            exec(testcase_code, testcase_vars)
+
+        device_db_path = os.path.join(os.path.dirname(sys.argv[1]), "device_db.py")
+        device_mgr = DeviceManager(DeviceDB(device_db_path))
+
+        dataset_db_path = os.path.join(os.path.dirname(sys.argv[1]), "dataset_db.mdb")
+        dataset_db = DatasetDB(dataset_db_path)
+        dataset_mgr = DatasetManager()
+
+        argument_mgr = ProcessArgumentManager({})
+
+        def embed():
+            experiment = testcase_vars["Benchmark"]((device_mgr, dataset_mgr, argument_mgr))
+
+            stitcher = Stitcher(core=experiment.core, dmgr=device_mgr)
+            stitcher.stitch_call(experiment.run, (), {})
+            stitcher.finalize()
+            return stitcher
 
     stitcher = embed()
     module = Module(stitcher)
@@ -69,7 +216,21 @@ def main():
     benchmark(lambda: target.strip(elf_shlib),
               "Stripping debug information")
 
-    dataset_db.close_db()
+    # Subkernels are compiled like this kernel, with their LLVM stages in a
+    # process pool when there are several CPUs.
+    count = os.cpu_count() or 1
+    llvm_ir = str(target.generate_llvm_ir(module))
+    benchmark(lambda: [_compile_llvm_ir(target, llvm_ir) for _ in range(count)],
+              "LLVM stages of {} subkernels (serially)".format(count))
+
+    def compile_pooled():
+        with ProcessPoolExecutor(count) as executor:
+            list(executor.map(_compile_llvm_ir, [target] * count, [llvm_ir] * count))
+    benchmark(compile_pooled,
+              "LLVM stages of {} subkernels (process pool)".format(count))
+
+    if dataset_db is not None:
+        dataset_db.close_db()
 
 if __name__ == "__main__":
     main()
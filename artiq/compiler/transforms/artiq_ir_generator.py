@@ -2731,7 +2731,35 @@ class ARTIQIRGenerator(algorithm.Visitor):
         return insn
 
     def visit_QuoteT(self, node):
-        return self.append(ir.Quote(node.value, node.type))
+        value = self.append(ir.Quote(node.value, node.type))
+        if builtins.is_list(node.type) or builtins.is_array(node.type):
+            # Large host lists and arrays are quoted as a single constant
+            # (see ASTSynthesizer.quote). Copy it, so that every evaluation
+            # gives a fresh value, like the literals quoted for smaller ones.
+            return self._copy_quoted(value)
+        return value
+
+    def _copy_quoted(self, value):
+        if builtins.is_array(value.type):
+            shape = self.append(ir.GetAttr(value, "shape"))
+            result, length = self._allocate_new_array(value.type.find()["elt"], shape)
+            source = self.append(ir.GetAttr(value, "buffer"))
+            target = self.append(ir.GetAttr(result, "buffer"))
+        else:
+            length = self.iterable_len(value)
+            result = self.append(ir.Alloc([length], value.type))
+            source, target = value, result
+
+        def body_gen(index):
+            elt = self.append(ir.GetElem(source, index))
+            self.append(ir.SetElem(target, index, elt))
+            return self.append(ir.Arith(ast.Add(loc=None), index,
+                                        ir.Constant(1, length.type)))
+        self._make_loop(ir.Constant(0, length.type),
+            lambda index: self.append(ir.Compare(ast.Lt(loc=None), index, length)),
+            body_gen)
+
+        return result
 
     def _get_raise_assert_func(self):
         """Emit the helper function that constructs AssertionErrors and raises
@@ -384,6 +384,9 @@ class Inferencer(algorithm.Visitor):
 
     def visit_CoerceT(self, node):
         self.generic_visit(node)
+        self._check_coercion(node)
+
+    def _check_coercion(self, node):
         if builtins.is_numeric(node.type) and builtins.is_numeric(node.value.type):
             pass
         elif (builtins.is_array(node.type) and builtins.is_array(node.value.type)
@@ -412,7 +415,9 @@ class Inferencer(algorithm.Visitor):
         else:
             node = asttyped.CoerceT(type=typ, value=coerced_node, other_value=other_node,
                                     loc=coerced_node.loc)
-        self.visit(node)
+        # The coerced value has just been visited by the caller; visiting it
+        # again would re-infer nested coercions exponentially many times.
+        self._check_coercion(node)
         return node
 
     def _coerce_numeric(self, nodes, map_return=lambda typ: typ, map_node_type =lambda typ:typ):
@@ -11,18 +11,34 @@ class IntMonomorphizer(algorithm.Visitor):
     def __init__(self, engine):
         self.engine = engine
 
+    def _width_of(self, n, loc):
+        if -2**31 < n < 2**31-1:
+            return 32
+        elif -2**63 < n < 2**63-1:
+            return 64
+        else:
+            diag = diagnostic.Diagnostic("error",
+                "integer literal out of range for a signed 64-bit value", {},
+                loc)
+            self.engine.process(diag)
+
     def visit_NumT(self, node):
         if builtins.is_int(node.type):
             if types.is_var(node.type["width"]):
-                if -2**31 < node.n < 2**31-1:
-                    width = 32
-                elif -2**63 < node.n < 2**63-1:
-                    width = 64
-                else:
-                    diag = diagnostic.Diagnostic("error",
-                        "integer literal out of range for a signed 64-bit value", {},
-                        node.loc)
-                    self.engine.process(diag)
+                width = self._width_of(node.n, node.loc)
+                if width is None:
                     return
 
                 node.type["width"].unify(types.TValue(width))
+
+    def visit_QuoteT(self, node):
+        # Lists of integers quoted as a whole by the embedding.
+        if builtins.is_list(node.type):
+            elt = builtins.get_iterable_elt(node.type)
+            if builtins.is_int(elt) and types.is_var(elt["width"]):
+                widths = [self._width_of(n, node.loc)
+                          for n in (min(node.value), max(node.value))]
+                if None in widths:
+                    return
+
+                elt["width"].unify(types.TValue(max(widths)))
@@ -171,6 +171,9 @@ class LLVMIRGenerator:
         self.llfunction = None
         self.llmap = {}
         self.llobject_map = {}
+        # (id(value), llty) -> (value, llvalue); the value is kept alive so that
+        # its id is not reused while the module is generated.
+        self.llquoted_map = {}
         self.llpred_map = {}
         self.phis = []
         self.debug_info_emitter = DebugInfoEmitter(self.llmodule)
@@ -546,16 +549,41 @@ class LLVMIRGenerator:
         else:
             assert False
 
-    def process(self, functions, attribute_writeback):
+    def process(self, functions, attribute_writeback, written_attributes=None):
         for func in functions:
             self.process_function(func)
 
         if attribute_writeback and self.embedding_map is not None:
-            self.emit_attribute_writeback()
+            self.emit_attribute_writeback(written_attributes)
 
         return self.llmodule
 
-    def emit_attribute_writeback(self):
+    def emit_attribute_writeback(self, written_attributes=None):
+        """
+        Emit the ``writeback`` global, describing a single asynchronous RPC
+        to service 0 that the runtime sends when the kernel returns. Its
+        arguments are ``(object, name, value)`` triples, one for each
+        attribute of the embedded objects that the kernel may have modified:
+        those in ``written_attributes`` (all attributes if ``None``), and those
+        with a mutable value.
+
+        The same attributes are also described by the ``typeinfo`` global,
+        for runtimes that predate ``writeback`` (see :meth:`emit_typeinfo`).
+        """
+        def is_mutable(typ):
+            typ = typ.find()
+            if builtins.is_list(typ) or builtins.is_array(typ) or \
+                    builtins.is_bytearray(typ):
+                return True
+            elif types.is_tuple(typ):
+                return any(is_mutable(elt) for elt in typ.elts)
+            else:
+                return False
+
+        def rpc_tag_error(typ):
+            print(typ)
+            assert False
+
         llobjects = defaultdict(lambda: [])
 
         for obj_id, obj_ref, obj_typ in self.embedding_map.iter_objects():
@@ -563,52 +591,13 @@ class LLVMIRGenerator:
             if llobject is not None:
                 llobjects[obj_typ].append(llobject.bitcast(llptr))
 
-        llrpcattrty = self.llcontext.get_identified_type("A")
-        llrpcattrty.elements = [lli32, llslice, llslice]
-
-        lldescty = self.llcontext.get_identified_type("D")
-        lldescty.elements = [llrpcattrty.as_pointer().as_pointer(), llptr.as_pointer()]
-
-        lldescs = []
+        # (offset, rpc tag, name) of the written back attributes of each type
+        attrs = {}
         for typ in llobjects:
-            if "__objectid__" not in typ.attributes:
+            if not types.is_instance(typ) or "__objectid__" not in typ.attributes:
                 continue
 
-            if types.is_constructor(typ):
-                type_name = "C.{}".format(typ.name)
-            else:
-                type_name = "I.{}".format(typ.name)
-
-            def llrpcattr_of_attr(offset, name, typ):
-                def rpc_tag_error(typ):
-                    print(typ)
-                    assert False
-
-                if name == "__objectid__":
-                    rpctag = b""
-                else:
-                    rpctag = b"Os" + ir.rpc_tag(typ, error_handler=rpc_tag_error) + b":n"
-
-                llrpcattrinit = ll.Constant(llrpcattrty, [
-                    ll.Constant(lli32, offset),
-                    self.llconst_of_const(ir.Constant(rpctag, builtins.TStr())),
-                    self.llconst_of_const(ir.Constant(name, builtins.TStr()))
-                ])
-
-                if name == "__objectid__":
-                    return self.get_or_define_global(name, llrpcattrty, llrpcattrinit)
-
-                llrpcattr = ll.GlobalVariable(self.llmodule, llrpcattrty,
-                                              name="A.{}.{}".format(type_name, name))
-                llrpcattr.initializer = llrpcattrinit
-                llrpcattr.global_constant = True
-                llrpcattr.unnamed_addr = True
-                llrpcattr.linkage = 'private'
-
-                return llrpcattr
-
             offset = 0
-            llrpcattrs = []
             for attr in typ.attributes:
                 attrtyp = typ.attributes[attr]
                 size, alignment = self.abi_layout_info.get_size_align_for_type(attrtyp)
@@ -616,18 +605,100 @@ class LLVMIRGenerator:
                 if offset % alignment != 0:
                     offset += alignment - (offset % alignment)
 
-                if types.is_instance(typ) and attr not in typ.constant_attributes:
+                if attr != "__objectid__" and attr not in typ.constant_attributes and \
+                        (written_attributes is None or
+                         (typ, attr) in written_attributes or is_mutable(attrtyp)):
                     try:
-                        llrpcattrs.append(llrpcattr_of_attr(offset, attr, attrtyp))
+                        rpctag = ir.rpc_tag(attrtyp, error_handler=rpc_tag_error)
+                        attrs.setdefault(typ, []).append((offset, rpctag, attr))
                     except ValueError:
                         pass
 
                 offset += size
 
-            if len(llrpcattrs) == 1:
-                # Don't bother serializing objects that only have __objectid__
-                # since there's nothing to writeback anyway.
-                continue
+        if not attrs:
+            return
+
+        llnames = {}
+        def llname_of_attr(name):
+            if name not in llnames:
+                llname = ll.GlobalVariable(self.llmodule, llslice,
+                                           name="A.{}".format(name))
+                llname.initializer = self.llconst_of_const(
+                    ir.Constant(name, builtins.TStr()))
+                llname.global_constant = True
+                llname.unnamed_addr = True
+                llname.linkage = 'private'
+                llnames[name] = llname.bitcast(llptr)
+            return llnames[name]
+
+        # The object arguments point to the elements of this array.
+        objects = [(typ, llobject) for typ in attrs for llobject in llobjects[typ]]
+        llobjectaryty = ll.ArrayType(llptr, len(objects))
+        llobjectary = ll.GlobalVariable(self.llmodule, llobjectaryty, name="Ox")
+        llobjectary.initializer = ll.Constant(llobjectaryty,
+            [llobject for typ, llobject in objects])
+        llobjectary.global_constant = True
+        llobjectary.linkage = 'private'
+
+        rpctag = b""
+        llargs = []
+        for index, (typ, llobject) in enumerate(objects):
+            llobjectref = llobjectary.gep([ll.Constant(lli32, 0),
+                                           ll.Constant(lli32, index)]).bitcast(llptr)
+            for offset, attrtag, attr in attrs[typ]:
+                rpctag += b"Os" + attrtag
+                llargs += [llobjectref, llname_of_attr(attr),
+                           llobject.gep([ll.Constant(lli32, offset)])]
+        rpctag += b":n"
+
+        llargaryty = ll.ArrayType(llptr, len(llargs))
+        llargary = ll.GlobalVariable(self.llmodule, llargaryty, name="Ax")
+        llargary.initializer = ll.Constant(llargaryty, llargs)
+        llargary.global_constant = True
+        llargary.linkage = 'private'
+
+        llwritebackty = ll.LiteralStructType([llslice, llptr.as_pointer()])
+        llwriteback = ll.GlobalVariable(self.llmodule, llwritebackty, name="writeback")
+        llwriteback.initializer = ll.Constant(llwritebackty, [
+            self.llconst_of_const(ir.Constant(rpctag, builtins.TStr())),
+            llargary.bitcast(llptr.as_pointer())
+        ])
+        llwriteback.global_constant = True
+
+        self.emit_typeinfo(attrs, llobjects)
+
+    def emit_typeinfo(self, attrs, llobjects):
+        """
+        Emit the ``typeinfo`` global, from which older runtimes (including
+        the Zynq runtime) send one asynchronous RPC per written back attribute.
+        ``attrs`` maps each type to the ``(offset, rpc tag, name)`` of its
+        written back attributes, and ``llobjects`` to its objects.
+        """
+        llrpcattrty = self.llcontext.get_identified_type("A")
+        llrpcattrty.elements = [lli32, llslice, llslice]
+
+        lldescty = self.llcontext.get_identified_type("D")
+        lldescty.elements = [llrpcattrty.as_pointer().as_pointer(), llptr.as_pointer()]
+
+        lldescs = []
+        for typ in attrs:
+            type_name = "I.{}".format(typ.name)
+
+            llrpcattrs = []
+            for offset, attrtag, attr in attrs[typ]:
+                llrpcattr = ll.GlobalVariable(self.llmodule, llrpcattrty,
+                                              name="A.{}.{}".format(type_name, attr))
+                llrpcattr.initializer = ll.Constant(llrpcattrty, [
+                    ll.Constant(lli32, offset),
+                    self.llconst_of_const(ir.Constant(b"Os" + attrtag + b":n",
+                                                      builtins.TStr())),
+                    self.llconst_of_const(ir.Constant(attr, builtins.TStr()))
+                ])
+                llrpcattr.global_constant = True
+                llrpcattr.unnamed_addr = True
+                llrpcattr.linkage = 'private'
+                llrpcattrs.append(llrpcattr)
 
             llrpcattraryty = ll.ArrayType(llrpcattrty.as_pointer(), len(llrpcattrs) + 1)
             llrpcattrary = ll.GlobalVariable(self.llmodule, llrpcattraryty,
@@ -1839,25 +1910,46 @@ class LLVMIRGenerator:
 
         return llresult
 
+    def _quote_numeric_to_llglobal(self, value, elt_type, kind_name):
+        # Emit the elements as a single global initialized from their raw
+        # bytes, instead of building an LLVM constant for each element.
+        llty = self.llty_of_type(elt_type)
+        if builtins.is_float(elt_type):
+            dtype = "f8"
+        else:
+            dtype = "i{}".format(builtins.get_int_width(elt_type) // 8)
+        byteorder = ">" if "E" in self.llmodule.data_layout.split("-") else "<"
+        data = numpy.asarray(value, dtype=byteorder + dtype)
+        _, align = self.abi_layout_info.get_size_align(llty)
+
+        llbytes = ll.Constant(ll.ArrayType(lli8, data.nbytes), bytearray(data.tobytes()))
+        name = self.llmodule.scope.deduplicate("quoted.{}".format(kind_name))
+        llglobal = ll.GlobalVariable(self.llmodule, llbytes.type, name)
+        llglobal.initializer = llbytes
+        llglobal.linkage = "private"
+        llglobal.align = align
+        return llglobal.bitcast(llty.as_pointer())
+
     def _quote_listish_to_llglobal(self, value, elt_type, path, kind_name):
         fail_msg = "at " + ".".join(path())
-        if len(value) > 0:
-            if builtins.is_int(elt_type):
+        if builtins.is_int(elt_type):
+            if isinstance(value, numpy.ndarray):
+                assert value.dtype.kind in "iu", fail_msg
+            else:
                 int_typ = (int, numpy.int32, numpy.int64)
                 for v in value:
                     assert isinstance(v, int_typ), fail_msg
-                llty = self.llty_of_type(elt_type)
-                llelts = [ll.Constant(llty, int(v)) for v in value]
-            elif builtins.is_float(elt_type):
+            return self._quote_numeric_to_llglobal(value, elt_type, kind_name)
+        elif builtins.is_float(elt_type):
+            if isinstance(value, numpy.ndarray):
+                assert value.dtype.kind == "f", fail_msg
+            else:
                 for v in value:
                     assert isinstance(v, float), fail_msg
-                llty = self.llty_of_type(elt_type)
-                llelts = [ll.Constant(llty, v) for v in value]
-            else:
-                llelts = [self._quote(value[i], elt_type, lambda: path() + [str(i)])
-                          for i in range(len(value))]
-        else:
-            llelts = []
+            return self._quote_numeric_to_llglobal(value, elt_type, kind_name)
+
+        llelts = [self._quote(value[i], elt_type, lambda: path() + [str(i)])
+                  for i in range(len(value))]
         lleltsary = ll.Constant(ll.ArrayType(self.llty_of_type(elt_type), len(llelts)),
                                 list(llelts))
         name = self.llmodule.scope.deduplicate("quoted.{}".format(kind_name))
@@ -1951,13 +2043,25 @@ class LLVMIRGenerator:
             assert isinstance(value, numpy.ndarray), fail_msg
             typ = typ.find()
             assert len(value.shape) == typ["num_dims"].find().value
+            # The same host array may be quoted many times, e.g. once for every
+            # reference to a global; share the elements between the references.
+            # Quotes in kernel code copy them (see ARTIQIRGenerator.visit_QuoteT).
+            key = (value_id, str(llty))
+            if key in self.llquoted_map:
+                return self.llquoted_map[key][1]
             flattened = value.reshape((-1,))
             lleltsptr = self._quote_listish_to_llglobal(flattened, typ["elt"], path, "array")
             llshape = ll.Constant.literal_struct([ll.Constant(lli32, s) for s in value.shape])
-            return ll.Constant(llty, [lleltsptr, llshape])
+            llconst = ll.Constant(llty, [lleltsptr, llshape])
+            self.llquoted_map[key] = (value, llconst)
+            return llconst
         elif builtins.is_listish(typ):
             assert isinstance(value, (list, numpy.ndarray)), fail_msg
             elt_type  = builtins.get_iterable_elt(typ)
+            if builtins.is_list(typ):
+                key = (value_id, str(llty))
+                if key in self.llquoted_map:
+                    return self.llquoted_map[key][1]
             lleltsptr = self._quote_listish_to_llglobal(value, elt_type, path, typ.find().name)
             if builtins.is_list(typ):
                 llconst   = ll.Constant(llty.pointee, [lleltsptr, ll.Constant(lli32, len(value))])
@@ -1965,6 +2069,7 @@ class LLVMIRGenerator:
                 llglobal = ll.GlobalVariable(self.llmodule, llconst.type, name)
                 llglobal.initializer = llconst
                 llglobal.linkage = "private"
+                self.llquoted_map[key] = (value, llglobal)
                 return llglobal
             llconst   = ll.Constant(llty, [lleltsptr, ll.Constant(lli32, len(value))])
             return llconst
@@ -7,6 +7,8 @@ import struct
 import logging
 import socket
 
+import numpy
+
 
 logger = logging.getLogger(__name__)
 
@@ -37,15 +39,15 @@ class ExceptionType(Enum):
 def get_analyzer_dump(host, port=1382):
     sock = socket.create_connection((host, port))
     try:
-        r = bytes()
+        r = bytearray()
         while True:
-            buf = sock.recv(8192)
+            buf = sock.recv(65536)
             if not buf:
                 break
             r += buf
     finally:
         sock.close()
-    return r
+    return bytes(r)
 
 
 OutputMessage = namedtuple(
@@ -85,11 +87,123 @@ def decode_message(data):
         raise ValueError
 
 
+# Layout of the big-endian 32-byte records sent by the analyzer.
+# For exception messages, the exception type is the least significant
+# byte of the address field.
+_record_dtype = numpy.dtype([
+    ("data", ">u8"),
+    ("address", ">u4"),
+    ("rtio_counter", ">u8"),
+    ("timestamp", ">u8"),
+    ("type_channel", ">u4")])
+
+event_dtype = numpy.dtype([
+    ("channel", "u4"),
+    ("type", "u1"),
+    ("timestamp", "u8"),
+    ("rtio_counter", "u8"),
+    ("address", "u4"),
+    ("data", "u8")])
+
+
+def decode_events(data):
+    """Decode analyzer records into a NumPy structured array with the fields
+    of :data:`event_dtype`. ``type`` holds :class:`MessageType` values."""
+    return _records_to_events(
+        numpy.frombuffer(data, _record_dtype, len(data)//32))
+
+
+def _records_to_events(records):
+    events = numpy.empty(len(records), event_dtype)
+    events["channel"] = records["type_channel"] >> 2
+    events["type"] = records["type_channel"] & 0b11
+    events["timestamp"] = records["timestamp"]
+    events["rtio_counter"] = records["rtio_counter"]
+    events["address"] = records["address"]
+    events["data"] = records["data"]
+    return events
+
+
+def event_to_message(event):
+    """Convert an element of an array returned by :func:`decode_events`
+    to the corresponding message namedtuple."""
+    return _row_to_message(*event.item())
+
+
+_OUTPUT = MessageType.output.value
+_INPUT = MessageType.input.value
+_EXCEPTION = MessageType.exception.value
+
+
+def _row_to_message(channel, message_type, timestamp, rtio_counter,
+                    address, data):
+    if message_type == _OUTPUT:
+        return OutputMessage(channel, timestamp, rtio_counter, address, data)
+    elif message_type == _INPUT:
+        return InputMessage(channel, timestamp, rtio_counter, data)
+    elif message_type == _EXCEPTION:
+        return ExceptionMessage(channel, rtio_counter,
+                                ExceptionType(address & 0xff))
+    else:
+        return StoppedMessage(rtio_counter)
+
+
+def messages_to_events(messages):
+    """Inverse of :func:`event_to_message`, for a list of messages."""
+    rows = []
+    for message in messages:
+        if isinstance(message, OutputMessage):
+            rows.append((message.channel, MessageType.output.value,
+                         message.timestamp, message.rtio_counter,
+                         message.address, message.data))
+        elif isinstance(message, InputMessage):
+            rows.append((message.channel, MessageType.input.value,
+                         message.timestamp, message.rtio_counter,
+                         0, message.data))
+        elif isinstance(message, ExceptionMessage):
+            rows.append((message.channel, MessageType.exception.value,
+                         0, message.rtio_counter,
+                         message.exception_type.value, 0))
+        else:
+            rows.append((0, MessageType.stopped.value,
+                         0, message.rtio_counter, 0, 0))
+    return numpy.array(rows, event_dtype)
+
+
+class MessageList:
+    """Read-only sequence of message namedtuples, created on access
+    from an array of decoded events."""
+    def __init__(self, events):
+        self.events = events
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MessageList(self.events[index])
+        return event_to_message(self.events[index])
+
+    def __iter__(self):
+        for event in self.events:
+            yield event_to_message(event)
+
+
 DecodedDump = namedtuple(
-    "DecodedDump", "log_channel dds_onehot_sel messages")
+    "DecodedDump", "log_channel dds_onehot_sel messages events",
+    defaults=(None, ))
 
 
-def decode_dump(data):
+DumpHeader = namedtuple(
+    "DumpHeader", "log_channel dds_onehot_sel record_count")
+
+# endian byte followed by the device-endian header
+_DUMP_HEADER_LEN = 16
+
+
+def decode_dump_header(data):
+    """Decode the header of a complete analyzer dump. ``data`` can be any
+    bytes-like object, including a memory-mapped file."""
     # extract endian byte
     if data[0] == ord('E'):
         endian = '>'
@@ -97,18 +211,17 @@ def decode_dump(data):
         endian = '<'
     else:
         raise ValueError
-    data = data[1:]
     # only header is device endian
     # messages are big endian
-    parts = struct.unpack(endian + "IQbbb", data[:15])
+    parts = struct.unpack_from(endian + "IQbbb", data, 1)
     (sent_bytes, total_byte_count,
      error_occurred, log_channel, dds_onehot_sel) = parts
 
     expected_len = sent_bytes + 15
-    if expected_len != len(data):
+    if expected_len != len(data) - 1:
         raise ValueError("analyzer dump has incorrect length "
                          "(got {}, expected {})".format(
-                            len(data), expected_len))
+                            len(data) - 1, expected_len))
     if error_occurred:
         logger.warning("error occurred within the analyzer, "
                        "data may be corrupted")
@@ -116,12 +229,19 @@ def decode_dump(data):
         logger.info("analyzer ring buffer has wrapped %d times",
                     total_byte_count//sent_bytes)
 
-    position = 15
-    messages = []
-    for _ in range(sent_bytes//32):
-        messages.append(decode_message(data[position:position+32]))
-        position += 32
-    return DecodedDump(log_channel, bool(dds_onehot_sel), messages)
+    return DumpHeader(log_channel, bool(dds_onehot_sel), sent_bytes//32)
+
+
+def _dump_records(data, header):
+    return numpy.frombuffer(data, _record_dtype, header.record_count,
+                            _DUMP_HEADER_LEN)
+
+
+def decode_dump(data):
+    header = decode_dump_header(data)
+    events = _records_to_events(_dump_records(data, header))
+    return DecodedDump(header.log_channel, header.dds_onehot_sel,
+                       MessageList(events), events)
 
 
 def vcd_codes():
@@ -135,25 +255,55 @@ def vcd_codes():
         yield code
 
 
+_double = struct.Struct(">d")
+
+
+def _double_to_bits(x):
+    return int.from_bytes(_double.pack(x), "big")
+
+
 class VCDChannel:
-    def __init__(self, out, code):
+    def __init__(self, out, code, width=None):
         self.out = out
         self.code = code
+        self._vector_suffix = " " + code + "\n"
+        self._scalar_values = {value: value + code + "\n" for value in "01XZ"}
+        if width is not None:
+            self._bits_format = "b{:0" + str(width) + "b} " + code + "\n"
 
     def set_value(self, value):
         if len(value) > 1:
-            self.out.write("b" + value + " " + self.code + "\n")
+            self.out.write("b" + value + self._vector_suffix)
         else:
-            self.out.write(value + self.code + "\n")
+            self.out.write(self._scalar_values.get(value)
+                           or value + self.code + "\n")
+
+    def set_value_bits(self, value):
+        """Set the value from an integer, zero-padded to the channel width."""
+        self.out.write(self._bits_format.format(value))
 
     def set_value_double(self, x):
-        integer_cast = struct.unpack(">Q", struct.pack(">d", x))[0]
-        self.set_value("{:064b}".format(integer_cast))
+        self.out.write("b{:064b}".format(_double_to_bits(x)) +
+                       self._vector_suffix)
+
+
+class _BatchedWriter:
+    """Collects the strings written to it until :meth:`flush` passes them
+    to ``fileobj`` in a single call."""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.pending = []
+        self.write = self.pending.append
+
+    def flush(self):
+        if self.pending:
+            self.fileobj.write("".join(self.pending))
+            self.pending.clear()
 
 
 class VCDManager:
     def __init__(self, fileobj):
-        self.out = fileobj
+        self.out = _BatchedWriter(fileobj)
         self.codes = vcd_codes()
         self.current_time = None
 
@@ -164,7 +314,7 @@ class VCDManager:
         code = next(self.codes)
         self.out.write("$var wire {width} {code} {name} $end\n"
                        .format(name=name, code=code, width=width))
-        return VCDChannel(self.out, code)
+        return VCDChannel(self.out, code, width)
 
     @contextmanager
     def scope(self, name):
@@ -177,6 +327,9 @@ class VCDManager:
             self.out.write("#{}\n".format(time))
             self.current_time = time
 
+    def flush(self):
+        self.out.flush()
+
 
 class TTLHandler:
     def __init__(self, vcd_manager, name):
@@ -475,97 +628,356 @@ def get_dds_sysclk(devices):
                                       ("AD9914",), "sysclk")
 
 
-def create_channel_handlers(vcd_manager, devices, ref_period,
-                            dds_sysclk, dds_onehot_sel):
-    channel_handlers = dict()
+def _iter_channel_devices(devices):
+    # Yields (kind, RTIO channel, device name) for the devices with a known
+    # analyzer representation. The kind is also the VCD scope of the device.
     for name, desc in sorted(devices.items(), key=itemgetter(0)):
         if isinstance(desc, dict) and desc["type"] == "local":
             if (desc["module"] == "artiq.coredevice.ttl"
                     and desc["class"] in {"TTLOut", "TTLInOut"}):
-                channel = desc["arguments"]["channel"]
-                channel_handlers[channel] = TTLHandler(vcd_manager, name)
+                yield "ttl", desc["arguments"]["channel"], name
             if (desc["module"] == "artiq.coredevice.ttl"
                     and desc["class"] == "TTLClockGen"):
-                channel = desc["arguments"]["channel"]
-                channel_handlers[channel] = TTLClockGenHandler(vcd_manager, name, ref_period)
+                yield "ttl_clkgen", desc["arguments"]["channel"], name
             if (desc["module"] == "artiq.coredevice.ad9914"
                     and desc["class"] == "AD9914"):
-                dds_bus_channel = desc["arguments"]["bus_channel"]
-                dds_channel = desc["arguments"]["channel"]
-                if dds_bus_channel in channel_handlers:
-                    dds_handler = channel_handlers[dds_bus_channel]
-                else:
-                    dds_handler = DDSHandler(vcd_manager, dds_onehot_sel, dds_sysclk)
-                    channel_handlers[dds_bus_channel] = dds_handler
-                dds_handler.add_dds_channel(name, dds_channel)
+                yield "dds", desc["arguments"]["bus_channel"], name
             if (desc["module"] == "artiq.coredevice.spi2" and
                     desc["class"] == "SPIMaster"):
-                channel = desc["arguments"]["channel"]
-                channel_handlers[channel] = SPIMaster2Handler(
-                        vcd_manager, name)
+                yield "spi2", desc["arguments"]["channel"], name
+
+
+def create_channel_handlers(vcd_manager, devices, ref_period,
+                            dds_sysclk, dds_onehot_sel):
+    channel_handlers = dict()
+    for kind, channel, name in _iter_channel_devices(devices):
+        if kind == "ttl":
+            channel_handlers[channel] = TTLHandler(vcd_manager, name)
+        elif kind == "ttl_clkgen":
+            channel_handlers[channel] = TTLClockGenHandler(vcd_manager, name, ref_period)
+        elif kind == "dds":
+            if channel in channel_handlers:
+                dds_handler = channel_handlers[channel]
+            else:
+                dds_handler = DDSHandler(vcd_manager, dds_onehot_sel, dds_sysclk)
+                channel_handlers[channel] = dds_handler
+            dds_handler.add_dds_channel(name, devices[name]["arguments"]["channel"])
+        elif kind == "spi2":
+            channel_handlers[channel] = SPIMaster2Handler(
+                    vcd_manager, name)
     return channel_handlers
 
 
+def get_channel_names(devices):
+    """Map RTIO channel numbers to names following the VCD scopes created by
+    :func:`create_channel_handlers`, e.g. ``ttl/ttl0``. AD9914 devices
+    sharing a bus are named ``dds/<name>,<name>...``."""
+    channel_names = dict()
+    for kind, channel, name in _iter_channel_devices(devices):
+        if kind == "dds" and channel in channel_names:
+            channel_names[channel] += "," + name
+        else:
+            channel_names[channel] = kind + "/" + name
+    return channel_names
+
+
 def get_message_time(message):
     return getattr(message, "timestamp", message.rtio_counter)
 
 
-def decoded_dump_to_vcd(fileobj, devices, dump, uniform_interval=False):
-    vcd_manager = VCDManager(fileobj)
-    ref_period = get_ref_period(devices)
+def get_event_times(events):
+    """Vectorized :func:`get_message_time` for decoded event arrays."""
+    timed = events["type"] <= MessageType.input.value
+    return numpy.where(timed, events["timestamp"], events["rtio_counter"])
+
+
+def sort_event_chunks(chunks, window=1 << 16):
+    """Sort a stream of decoded event arrays by time, holding at most
+    ``window`` events back in addition to the chunk being processed.
+
+    Yields ``(events, times)`` pairs. The analyzer records events
+    in nearly chronological order, so a bounded window is enough to restore
+    the ordering of real dumps. Events displaced by more than ``window``
+    positions are emitted at the latest time written so far."""
+    pending_events = numpy.empty(0, event_dtype)
+    pending_times = numpy.empty(0, numpy.int64)
+    last_time = None
+    late_events = 0
+
+    def emit(events, times):
+        nonlocal last_time, late_events
+        if last_time is not None:
+            late = times < last_time
+            if late.any():
+                late_events += int(numpy.count_nonzero(late))
+                times = numpy.maximum(times, last_time)
+        last_time = times[-1]
+        return events, times
+
+    for events in chunks:
+        events = numpy.concatenate((pending_events, events))
+        times = numpy.concatenate((pending_times,
+                                   get_event_times(events[len(pending_events):])
+                                   .astype(numpy.int64)))
+        order = numpy.argsort(times, kind="stable")
+        events = events[order]
+        times = times[order]
+        split = len(events) - window
+        if split > 0:
+            yield emit(events[:split], times[:split])
+            pending_events = events[split:]
+            pending_times = times[split:]
+        else:
+            pending_events = events
+            pending_times = times
+    if len(pending_events):
+        yield emit(pending_events, pending_times)
 
-    if ref_period is not None:
-        if not uniform_interval:
-            vcd_manager.set_timescale_ps(ref_period*1e12)
-    else:
-        logger.warning("unable to determine core device ref_period")
-        ref_period = 1e-9  # guess
-    dds_sysclk = get_dds_sysclk(devices)
-    if dds_sysclk is None:
-        logger.warning("unable to determine DDS sysclk")
-        dds_sysclk = 3e9  # guess
-
-    if isinstance(dump.messages[-1], StoppedMessage):
-        messages = dump.messages[:-1]
-    else:
-        logger.warning("StoppedMessage missing")
-        messages = dump.messages
-    messages = sorted(messages, key=get_message_time)
-
-    channel_handlers = create_channel_handlers(
-        vcd_manager, devices, ref_period,
-        dds_sysclk, dump.dds_onehot_sel)
-    vcd_log_channels = get_vcd_log_channels(dump.log_channel, messages)
-    channel_handlers[dump.log_channel] = LogHandler(
-        vcd_manager, vcd_log_channels)
-    if uniform_interval:
-        # RTIO event timestamp in machine units
-        timestamp = vcd_manager.get_channel("timestamp", 64)
-        # RTIO time interval between this and the next timed event
-        # in SI seconds
-        interval = vcd_manager.get_channel("interval", 64)
-    slack = vcd_manager.get_channel("rtio_slack", 64)
-
-    vcd_manager.set_time(0)
-    start_time = 0
-    for m in messages:
-        start_time = get_message_time(m)
-        if start_time:
-            break
-
-    t0 = 0
-    for i, message in enumerate(messages):
-        if message.channel in channel_handlers:
-            t = get_message_time(message) - start_time
+    if late_events:
+        logger.warning("%d events were too far out of order to be sorted "
+                       "and have been moved to a later time", late_events)
+
+
+def _iter_chunk_messages(chunks):
+    for events, _ in chunks:
+        yield from MessageList(events)
+
+
+class _VCDEventWriter:
+    def __init__(self, fileobj, devices, log_channel, dds_onehot_sel,
+                 vcd_log_channels, uniform_interval):
+        self.vcd_manager = vcd_manager = VCDManager(fileobj)
+        ref_period = get_ref_period(devices)
+
+        if ref_period is not None:
+            if not uniform_interval:
+                vcd_manager.set_timescale_ps(ref_period*1e12)
+        else:
+            logger.warning("unable to determine core device ref_period")
+            ref_period = 1e-9  # guess
+        dds_sysclk = get_dds_sysclk(devices)
+        if dds_sysclk is None:
+            logger.warning("unable to determine DDS sysclk")
+            dds_sysclk = 3e9  # guess
+        self.ref_period = ref_period
+
+        self.channel_handlers = create_channel_handlers(
+            vcd_manager, devices, ref_period,
+            dds_sysclk, dds_onehot_sel)
+        self.channel_handlers[log_channel] = LogHandler(
+            vcd_manager, vcd_log_channels)
+        self.handled_channels = numpy.array(
+            list(self.channel_handlers.keys()), numpy.uint32)
+        self.uniform_interval = uniform_interval
+        if uniform_interval:
+            # RTIO event timestamp in machine units
+            self.timestamp = vcd_manager.get_channel("timestamp", 64)
+            # RTIO time interval between this and the next timed event
+            # in SI seconds
+            self.interval = vcd_manager.get_channel("interval", 64)
+        self.slack = vcd_manager.get_channel("rtio_slack", 64)
+
+        vcd_manager.set_time(0)
+        self.start_time = None
+        self.t0 = 0
+        self.event_count = 0
+
+    def write(self, events, times):
+        """Write a chunk of events sorted by time, following
+        those previously written."""
+        vcd_manager = self.vcd_manager
+        channel_handlers = self.channel_handlers
+        slack = self.slack
+        uniform_interval = self.uniform_interval
+        first_index = self.event_count
+        self.event_count += len(events)
+
+        if self.start_time is None:
+            nonzero_times = numpy.flatnonzero(times)
+            if len(nonzero_times):
+                self.start_time = int(times[nonzero_times[0]])
+        start_time = self.start_time
+
+        indices = numpy.flatnonzero(
+            numpy.isin(events["channel"], self.handled_channels) &
+            (events["type"] != MessageType.stopped.value))
+        if not len(indices):
+            return
+        handled = events[indices]
+        rows = zip(*(handled[field].tolist() for field in event_dtype.names))
+        slack_bits = ((handled["timestamp"].astype(numpy.int64) -
+                       handled["rtio_counter"].astype(numpy.int64))
+                      *self.ref_period).view(numpy.uint64).tolist()
+        if start_time is None:
+            # Only events at time zero so far; never advance the VCD time.
+            event_times = [-1]*len(indices)
+        else:
+            event_times = (times[indices] - start_time).tolist()
+
+        for i, row, t, message_slack in zip(indices.tolist(), rows,
+                                            event_times, slack_bits):
+            message = _row_to_message(*row)
             if t >= 0:
                 if uniform_interval:
-                    interval.set_value_double((t - t0)*ref_period)
-                    vcd_manager.set_time(i)
-                    timestamp.set_value("{:064b}".format(t))
-                    t0 = t
+                    self.interval.set_value_double((t - self.t0)*self.ref_period)
+                    vcd_manager.set_time(first_index + i)
+                    self.timestamp.set_value_bits(t)
+                    self.t0 = t
                 else:
                     vcd_manager.set_time(t)
-            channel_handlers[message.channel].process_message(message)
-            if isinstance(message, OutputMessage):
-                slack.set_value_double(
-                    (message.timestamp - message.rtio_counter)*ref_period)
+            channel_handlers[row[0]].process_message(message)
+            if row[1] == _OUTPUT:
+                slack.set_value_bits(message_slack)
+        vcd_manager.flush()
+
+    def flush(self):
+        self.vcd_manager.flush()
+
+
+def decoded_dump_to_vcd(fileobj, devices, dump, uniform_interval=False):
+    events = dump.events
+    if events is None:
+        events = messages_to_events(dump.messages)
+    if len(events) and events[-1]["type"] == MessageType.stopped.value:
+        events = events[:-1]
+    else:
+        logger.warning("StoppedMessage missing")
+    times = get_event_times(events)
+    order = numpy.argsort(times, kind="stable")
+    events = events[order]
+    times = times[order].astype(numpy.int64)
+
+    log_events = events[(events["channel"] == dump.log_channel) &
+                        (events["type"] == MessageType.output.value)]
+    vcd_log_channels = get_vcd_log_channels(dump.log_channel,
+                                            MessageList(log_events))
+    writer = _VCDEventWriter(fileobj, devices, dump.log_channel,
+                             dump.dds_onehot_sel, vcd_log_channels,
+                             uniform_interval)
+    # Write in chunks to bound the size of the output buffer.
+    chunk_size = 1 << 16
+    for start in range(0, len(events), chunk_size):
+        writer.write(events[start:start + chunk_size],
+                     times[start:start + chunk_size])
+    writer.flush()
+
+
+def _strip_stopped(records):
+    if (len(records) and
+            records[-1]["type_channel"] & 0b11 == MessageType.stopped.value):
+        return records[:-1]
+    else:
+        logger.warning("StoppedMessage missing")
+        return records
+
+
+def _iter_event_chunks(records, chunk_size, type_channel=None):
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        if type_channel is not None:
+            chunk = chunk[chunk["type_channel"] == type_channel]
+        yield _records_to_events(chunk)
+
+
+def dump_to_vcd(fileobj, devices, data, uniform_interval=False,
+                chunk_size=1 << 16, window=1 << 16):
+    """Convert a raw analyzer dump to VCD with bounded memory usage.
+
+    Unlike :func:`decoded_dump_to_vcd`, the dump is decoded and written in
+    chunks of ``chunk_size`` events, which are sorted using
+    :func:`sort_event_chunks` with the given ``window``. ``data`` can be
+    a memory-mapped dump file, in which case it is never loaded in full.
+
+    Returns the number of events processed."""
+    header = decode_dump_header(data)
+    records = _strip_stopped(_dump_records(data, header))
+
+    # The width of log channels must be known before any value is written.
+    log_chunks = _iter_event_chunks(
+        records, chunk_size,
+        header.log_channel << 2 | MessageType.output.value)
+    vcd_log_channels = get_vcd_log_channels(
+        header.log_channel,
+        _iter_chunk_messages(sort_event_chunks(log_chunks, window)))
+    writer = _VCDEventWriter(fileobj, devices, header.log_channel,
+                             header.dds_onehot_sel, vcd_log_channels,
+                             uniform_interval)
+    for events, times in sort_event_chunks(
+            _iter_event_chunks(records, chunk_size), window):
+        writer.write(events, times)
+    writer.flush()
+    return writer.event_count
+
+
+def _append_columns(group, columns, compression):
+    for name, values in columns.items():
+        if name in group:
+            dataset = group[name]
+            length = len(dataset)
+            dataset.resize((length + len(values), ))
+            dataset[length:] = values
+        else:
+            group.create_dataset(name, data=values, maxshape=(None, ),
+                                 chunks=True, compression=compression)
+
+
+def dump_to_hdf5(group, devices, data, chunk_size=1 << 16, window=1 << 16,
+                 compression="gzip"):
+    """Write the events of a raw analyzer dump as columnar arrays into
+    the HDF5 group ``group``, e.g. an ``h5py.File`` opened for writing.
+
+    Output and input events are stored under ``channels/<name>``, with
+    ``name`` as given by :func:`get_channel_names` (``log`` for the log
+    channel and ``channel<n>`` for channels without a known device). Each of
+    these groups has a ``channel`` attribute and the one-dimensional datasets
+    ``type`` (:class:`MessageType` value), ``timestamp``, ``rtio_counter``,
+    ``address``, ``data`` and ``slack`` (``timestamp - rtio_counter``,
+    in machine units). Exceptions are stored in the ``exceptions`` group
+    with the ``channel``, ``rtio_counter`` and ``exception_type`` datasets.
+
+    Events are sorted by time as in :func:`dump_to_vcd`. Datasets are chunked
+    and compressed, so a single channel can be read without decompressing the
+    others. Returns the number of events processed."""
+    header = decode_dump_header(data)
+    records = _strip_stopped(_dump_records(data, header))
+
+    group.attrs["log_channel"] = header.log_channel
+    group.attrs["dds_onehot_sel"] = header.dds_onehot_sel
+    ref_period = get_ref_period(devices)
+    if ref_period is not None:
+        group.attrs["ref_period"] = ref_period
+    channel_names = get_channel_names(devices)
+    channel_names.setdefault(header.log_channel, "log")
+    channel_groups = dict()
+
+    event_count = 0
+    for events, _ in sort_event_chunks(
+            _iter_event_chunks(records, chunk_size), window):
+        event_count += len(events)
+
+        exceptions = events[events["type"] == MessageType.exception.value]
+        if len(exceptions):
+            _append_columns(group.require_group("exceptions"), {
+                "channel": exceptions["channel"],
+                "rtio_counter": exceptions["rtio_counter"],
+                "exception_type": (exceptions["address"] & 0xff).astype(numpy.uint8)
+            }, compression)
+
+        events = events[events["type"] <= MessageType.input.value]
+        for channel in numpy.unique(events["channel"]).tolist():
+            if channel not in channel_groups:
+                name = channel_names.get(channel, "channel{}".format(channel))
+                channel_group = group.require_group("channels/" + name)
+                channel_group.attrs["channel"] = channel
+                channel_groups[channel] = channel_group
+            channel_events = events[events["channel"] == channel]
+            _append_columns(channel_groups[channel], {
+                "type": channel_events["type"],
+                "timestamp": channel_events["timestamp"],
+                "rtio_counter": channel_events["rtio_counter"],
+                "address": channel_events["address"],
+                "data": channel_events["data"],
+                "slack": (channel_events["timestamp"].astype(numpy.int64) -
+                          channel_events["rtio_counter"].astype(numpy.int64))
+            }, compression)
+    return event_count
@@ -95,18 +95,10 @@ def _receive_array(kernel, embedding_map):
     tag = chr(kernel._read_int8())
     fn = receivers[tag]
     length = numpy.prod(shape)
-    if tag == "b":
-        buffer = kernel._read(length)
-        elems = numpy.ndarray((length, ), '?', buffer)
-    elif tag == "i":
-        buffer = kernel._read(4 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'i4', buffer)
-    elif tag == "I":
-        buffer = kernel._read(8 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'i8', buffer)
-    elif tag == "f":
-        buffer = kernel._read(8 * length)
-        elems = numpy.ndarray((length, ), kernel.endian + 'd', buffer)
+    if tag in _array_dtypes:
+        # Receive straight into the array memory.
+        elems = numpy.empty((length, ), _array_dtypes[tag].newbyteorder(kernel.endian))
+        kernel._read_into(elems.view(numpy.uint8))
     else:
         fn = receivers[tag]
         elems = []
@@ -119,6 +111,14 @@ def _receive_array(kernel, embedding_map):
     return elems.reshape(shape)
 
 
+_array_dtypes = {
+    "b": numpy.dtype('?'),
+    "i": numpy.dtype('i4'),
+    "I": numpy.dtype('i8'),
+    "f": numpy.dtype('d'),
+}
+
+
 def _receive_range(kernel, embedding_map):
     start = kernel._receive_rpc_value(embedding_map)
     stop = kernel._receive_rpc_value(embedding_map)
@@ -157,7 +157,7 @@ receivers = {
 
 class CommKernelDummy:
     def __init__(self):
-        pass
+        self.writeback_bytes = 0
 
     def load(self, kernel_library):
         pass
@@ -185,12 +185,23 @@ def incompatible_versions(v1, v2):
 class CommKernel:
     warned_of_mismatch = False
 
+    # Reads larger than this bypass the read buffer.
+    read_buffer_size = 65536
+
     def __init__(self, host, port=1381):
         self._read_type = None
         self.host = host
         self.port = port
-        self.read_buffer = bytearray()
+        # Received data is kept in read_buffer[read_start:read_end].
+        self.read_buffer = bytearray(self.read_buffer_size)
+        self.read_view = memoryview(self.read_buffer)
+        self.read_start = 0
+        self.read_end = 0
+        self.recv_count = 0
         self.write_buffer = bytearray()
+        # Total size of the attribute writeback messages received from
+        # kernels, for profiling.
+        self.writeback_bytes = 0
 
 
     def open(self):
@@ -200,14 +211,17 @@ class CommKernel:
         self.socket.sendall(b"ARTIQ coredev\n")
         endian = self._read(1)
         if endian == b"e":
-            self.endian = "<"
+            self._set_endian("<")
         elif endian == b"E":
-            self.endian = ">"
+            self._set_endian(">")
         else:
             raise IOError("Incorrect reply from device: expected e/E.")
-        self.unpack_int32 = struct.Struct(self.endian + "l").unpack
-        self.unpack_int64 = struct.Struct(self.endian + "q").unpack
-        self.unpack_float64 = struct.Struct(self.endian + "d").unpack
+
+    def _set_endian(self, endian):
+        self.endian = endian
+        self.unpack_int32 = struct.Struct(self.endian + "l").unpack_from
+        self.unpack_int64 = struct.Struct(self.endian + "q").unpack_from
+        self.unpack_float64 = struct.Struct(self.endian + "d").unpack_from
 
         self.pack_header = struct.Struct(self.endian + "lB").pack
         self.pack_int8 = struct.Struct(self.endian + "B").pack
@@ -220,27 +234,61 @@ class CommKernel:
             return
         self.socket.close()
         del self.socket
+        self.read_start = self.read_end = 0
         logger.debug("disconnected")
 
     #
     # Reader interface
     #
 
-    def _read(self, length):
-        # cache the reads to avoid frequent call to recv
-        while len(self.read_buffer) < length:
-            # the number is just the maximum amount
+    def _recv_into(self, view, flags=0):
+        count = self.socket.recv_into(view, 0, flags)
+        if not count:
+            raise ConnectionResetError("Core device connection closed unexpectedly")
+        self.recv_count += count
+        return count
+
+    def _received_bytes(self):
+        """Number of bytes read so far, excluding the buffered ones."""
+        return self.recv_count - (self.read_end - self.read_start)
+
+    def _fill(self, length):
+        # Make sure at least length (<= read_buffer_size) bytes are buffered.
+        if self.read_end - self.read_start >= length:
+            return
+        if self.read_start == self.read_end:
+            self.read_start = self.read_end = 0
+        elif self.read_start + length > self.read_buffer_size:
+            # Move the unread data to the beginning of the buffer.
+            remaining = self.read_end - self.read_start
+            self.read_view[:remaining] = self.read_view[self.read_start:self.read_end]
+            self.read_start = 0
+            self.read_end = remaining
+        while self.read_end - self.read_start < length:
+            # cache the reads to avoid frequent call to recv
             # when there is not much data, it would return earlier
-            diff = length - len(self.read_buffer)
-            flag = 0
-            if diff > 8192:
-                flag |= socket.MSG_WAITALL
-            new_buffer = self.socket.recv(8192, flag)
-            if not new_buffer:
-                raise ConnectionResetError("Core device connection closed unexpectedly")
-            self.read_buffer += new_buffer
-        result = self.read_buffer[:length]
-        self.read_buffer = self.read_buffer[length:]
+            self.read_end += self._recv_into(self.read_view[self.read_end:])
+
+    def _read_into(self, buffer):
+        """Fill the writable bytes-like object ``buffer`` with received data,
+        receiving directly into it when it is larger than the buffered data."""
+        view = memoryview(buffer)
+        length = len(view)
+        buffered = min(length, self.read_end - self.read_start)
+        view[:buffered] = self.read_view[self.read_start:self.read_start + buffered]
+        self.read_start += buffered
+        offset = buffered
+        while offset < length:
+            offset += self._recv_into(view[offset:], socket.MSG_WAITALL)
+
+    def _read(self, length):
+        if length > self.read_buffer_size:
+            result = bytearray(length)
+            self._read_into(result)
+            return result
+        self._fill(length)
+        result = self.read_buffer[self.read_start:self.read_start + length]
+        self.read_start += length
         return result
 
     def _read_header(self):
@@ -249,14 +297,14 @@ class CommKernel:
         # Wait for a synchronization sequence, 5a 5a 5a 5a.
         sync_count = 0
         while sync_count < 4:
-            sync_byte = self._read(1)[0]
+            sync_byte = self._read_int8()
             if sync_byte == 0x5a:
                 sync_count += 1
             else:
                 sync_count = 0
 
         # Read message header.
-        raw_type = self._read(1)[0]
+        raw_type = self._read_int8()
         self._read_type = Reply(raw_type)
 
         logger.debug("receiving message: type=%r",
@@ -272,18 +320,27 @@ class CommKernel:
         self._read_expect(ty)
 
     def _read_int8(self):
-        return self._read(1)[0]
+        self._fill(1)
+        value = self.read_buffer[self.read_start]
+        self.read_start += 1
+        return value
 
     def _read_int32(self):
-        (value, ) = self.unpack_int32(self._read(4))
+        self._fill(4)
+        (value, ) = self.unpack_int32(self.read_buffer, self.read_start)
+        self.read_start += 4
         return value
 
     def _read_int64(self):
-        (value, ) = self.unpack_int64(self._read(8))
+        self._fill(8)
+        (value, ) = self.unpack_int64(self.read_buffer, self.read_start)
+        self.read_start += 8
         return value
 
     def _read_float64(self):
-        (value, ) = self.unpack_float64(self._read(8))
+        self._fill(8)
+        (value, ) = self.unpack_float64(self.read_buffer, self.read_start)
+        self.read_start += 8
         return value
 
     def _read_bool(self):
@@ -424,23 +481,52 @@ class CommKernel:
             else:
                 args.append(value)
 
-    def _skip_rpc_value(self, tags):
-        tag = chr(tags.pop(0))
+    def _skip_rpc_value(self, tags, index):
+        # Return the index of the tag following the one at index.
+        tag = chr(tags[index])
+        index += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[index]
+            index += 1
             for _ in range(length):
-                self._skip_rpc_value(tags)
+                index = self._skip_rpc_value(tags, index)
         elif tag == "l":
-            self._skip_rpc_value(tags)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "r":
-            self._skip_rpc_value(tags)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "a":
-            _ndims = tags.pop(0)
-            self._skip_rpc_value(tags)
-        else:
-            pass
+            index = self._skip_rpc_value(tags, index + 1)
+        return index
 
-    def _send_rpc_value(self, tags, value, root, function):
+    def _as_flat_array(self, value, kinds):
+        # Returns None unless value converts to a one-dimensional array of
+        # one of the given dtype kinds, in which case the caller should fall
+        # back to per-element serialization, which rejects e.g. nested lists.
+        try:
+            array = numpy.asarray(value)
+        except ValueError:
+            # ragged nested lists
+            return None
+        if array.ndim != 1 or array.dtype.kind not in kinds:
+            return None
+        return array
+
+    def _pack_int_array(self, value, bits, expected):
+        # Returns None if value cannot be converted in bulk, in which case
+        # the caller should fall back to per-element serialization.
+        array = self._as_flat_array(value, "iu")
+        if array is None:
+            return None
+        if array.size > 0 and not (-2**(bits - 1) <= array.min() and
+                                   array.max() < 2**(bits - 1)):
+            raise RPCReturnValueError(
+                "type mismatch: cannot serialize {value} as {type}".format(
+                    value=repr(value), type=expected))
+        return array.astype(self.endian + "i" + str(bits // 8)).tobytes()
+
+    def _send_rpc_value(self, tags, index, value, root, function):
+        # Serialize value according to the tag at index, and return the index
+        # of the tag following it.
         def check(cond, expected):
             if not cond:
                 raise RPCReturnValueError(
@@ -449,13 +535,15 @@ class CommKernel:
                         value=repr(value), type=expected(),
                         function=function, root=root))
 
-        tag = chr(tags.pop(0))
+        tag = chr(tags[index])
+        index += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[index]
+            index += 1
             check(isinstance(value, tuple) and length == len(value),
                   lambda: "tuple of {}".format(length))
             for elt in value:
-                self._send_rpc_value(tags, elt, root, function)
+                index = self._send_rpc_value(tags, index, elt, root, function)
         elif tag == "n":
             check(value is None,
                   lambda: "None")
@@ -500,40 +588,55 @@ class CommKernel:
             check(isinstance(value, list),
                   lambda: "list")
             self._write_int32(len(value))
-            tag_element = chr(tags[0])
+            tag_element = chr(tags[index])
             if tag_element == "b":
                 self._write(bytes(value))
             elif tag_element == "i":
-                try:
-                    self._write(struct.pack(self.endian + "%sl" % len(value), *value))
-                except struct.error:
-                    raise RPCReturnValueError(
-                        "type mismatch: cannot serialize {value} as {type}".format(
-                            value=repr(value), type="32-bit integer list"))
+                packed = self._pack_int_array(value, 32, "32-bit integer list")
+                if packed is None:
+                    try:
+                        packed = struct.pack(self.endian + "%sl" % len(value), *value)
+                    except struct.error:
+                        raise RPCReturnValueError(
+                            "type mismatch: cannot serialize {value} as {type}".format(
+                                value=repr(value), type="32-bit integer list"))
+                self._write(packed)
             elif tag_element == "I":
-                try:
-                    self._write(struct.pack(self.endian + "%sq" % len(value), *value))
-                except struct.error:
-                    raise RPCReturnValueError(
-                        "type mismatch: cannot serialize {value} as {type}".format(
-                            value=repr(value), type="64-bit integer list"))
+                packed = self._pack_int_array(value, 64, "64-bit integer list")
+                if packed is None:
+                    try:
+                        packed = struct.pack(self.endian + "%sq" % len(value), *value)
+                    except struct.error:
+                        raise RPCReturnValueError(
+                            "type mismatch: cannot serialize {value} as {type}".format(
+                                value=repr(value), type="64-bit integer list"))
+                self._write(packed)
             elif tag_element == "f":
-                self._write(struct.pack(self.endian + "%sd" %
-                                        len(value), *value))
+                array = self._as_flat_array(value, "fiu")
+                if array is not None:
+                    self._write(array.astype(self.endian + "d").tobytes())
+                else:
+                    try:
+                        packed = struct.pack(self.endian + "%sd" % len(value), *value)
+                    except struct.error:
+                        raise RPCReturnValueError(
+                            "type mismatch: cannot serialize {value} as {type}".format(
+                                value=repr(value), type="float list"))
+                    self._write(packed)
             else:
                 for elt in value:
-                    tags_copy = bytearray(tags)
-                    self._send_rpc_value(tags_copy, elt, root, function)
-            self._skip_rpc_value(tags)
+                    self._send_rpc_value(tags, index, elt, root, function)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "a":
             check(isinstance(value, numpy.ndarray),
                   lambda: "numpy.ndarray")
-            num_dims = tags.pop(0)
+            num_dims = tags[index]
+            index += 1
             check(num_dims == len(value.shape),
                   lambda: "{}-dimensional numpy.ndarray".format(num_dims))
             for s in value.shape:
                 self._write_int32(s)
-            tag_element = chr(tags[0])
+            tag_element = chr(tags[index])
             if tag_element == "b":
                 self._write(value.reshape((-1,), order="C").tobytes())
             elif tag_element == "i":
@@ -550,21 +653,17 @@ class CommKernel:
                 self._write(array.tobytes())
             else:
                 for elt in value.reshape((-1,), order="C"):
-                    tags_copy = bytearray(tags)
-                    self._send_rpc_value(tags_copy, elt, root, function)
-            self._skip_rpc_value(tags)
+                    self._send_rpc_value(tags, index, elt, root, function)
+            index = self._skip_rpc_value(tags, index)
         elif tag == "r":
             check(isinstance(value, range),
                   lambda: "range")
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.start, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.stop, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.step, root, function)
-            tags = tags_copy
+            self._send_rpc_value(tags, index, value.start, root, function)
+            self._send_rpc_value(tags, index, value.stop, root, function)
+            index = self._send_rpc_value(tags, index, value.step, root, function)
         else:
             raise IOError("Unknown RPC value tag: {}".format(repr(tag)))
+        return index
 
     def _truncate_message(self, msg, limit=4096):
         if len(msg) > limit:
@@ -573,13 +672,18 @@ class CommKernel:
             return msg
 
     def _serve_rpc(self, embedding_map):
+        start = self._received_bytes()
         is_async = self._read_bool()
         service_id = self._read_int32()
         args, kwargs = self._receive_rpc_args(embedding_map)
         return_tags = self._read_bytes()
 
         if service_id == 0:
-            def service(obj, attr, value): return setattr(obj, attr, value)
+            # attribute writeback: (object, name, value) triples
+            def service(*args):
+                for obj, attr, value in zip(args[0::3], args[1::3], args[2::3]):
+                    setattr(obj, attr, value)
+            self.writeback_bytes += self._received_bytes() - start
         else:
             service = embedding_map.retrieve_object(service_id)
         logger.debug("rpc service: [%d]%r%s %r %r -> %s", service_id, service,
@@ -646,8 +750,7 @@ class CommKernel:
                          service_id, args, kwargs, result)
             self._write_header(Request.RPCReply)
             self._write_bytes(return_tags)
-            self._send_rpc_value(bytearray(return_tags),
-                                 result, result, service)
+            self._send_rpc_value(return_tags, 0, result, result, service)
             self._flush()
 
     def _serve_exception(self, embedding_map, symbolizer, demangler):
@@ -1,11 +1,14 @@
-import os, sys
+import os, sys, time, logging
 import numpy
 from inspect import getfullargspec
 from functools import wraps
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 
 from pythonparser import diagnostic
+from llvmlite import binding as llvm
 
-from artiq import __artiq_dir__ as artiq_dir
+from artiq import __artiq_dir__ as artiq_dir, __version__ as artiq_version
 
 from artiq.language.core import *
 from artiq.language.types import *
@@ -14,10 +17,16 @@ from artiq.language.units import *
 from artiq.compiler.module import Module
 from artiq.compiler.embedding import Stitcher
 from artiq.compiler.targets import RV32IMATarget, RV32GTarget, CortexA9Target
+from artiq.compiler.kernel_cache import (CompilationCache, CacheEntry,
+                                         mark_embedding_map)
 
 from artiq.coredevice.comm_kernel import CommKernel, CommKernelDummy
 # Import for side effects (creating the exception classes).
 from artiq.coredevice import exceptions
+from artiq.tools import get_user_cache_dir
+
+
+logger = logging.getLogger(__name__)
 
 
 def _render_diagnostic(diagnostic, colored):
@@ -65,6 +74,29 @@ def get_target_cls(target):
         raise ValueError("Unsupported target")
 
 
+_opt_level_flags = {"O0": 0, "O1": 1, "O2": 2, "O3": 3}
+
+def get_opt_level(function, default):
+    """Return the optimization level selected by the ``O0`` to ``O3`` flags
+    of the kernel ``function``, or ``default`` if it has none."""
+    flags = function.artiq_embedded.flags
+    levels = {_opt_level_flags[flag] for flag in flags if flag in _opt_level_flags}
+    if len(levels) > 1:
+        raise ValueError("Kernel {} has conflicting optimization level flags"
+                         .format(function.__qualname__))
+    return levels.pop() if levels else default
+
+
+def _compile_llvm_ir(target, llvm_ir):
+    """Optimize, assemble and link LLVM IR given as text.
+
+    Returns the relocatable objects, the stripped library and the timings of
+    the target. This does not access host objects, and may run in a worker
+    process, with a copy of the target."""
+    objects = [target.assemble(target.optimize_llvm_ir(llvm_ir))]
+    return objects, target.link(objects, strip=True), target.timings
+
+
 class Core:
     """Core device driver.
 
@@ -82,6 +114,15 @@ class Core:
         (optional).
     :param analyze_at_run_end: automatically trigger the core device analyzer
         proxy after the Experiment's run stage finishes.
+    :param compilation_cache: reuse the compiled kernel when the same kernel
+        is run again with identical embedded host values. Compiled kernels
+        are also persisted in the user cache directory, so that they are
+        reused by later experiments.
+    :param compilation_cache_size: maximum size in bytes of the on-disk
+        compilation cache.
+    :param opt_level: optimization level of kernels (and subkernels) that do
+        not specify one with the ``O0`` to ``O3`` flags, from 0 (fastest
+        compilation) to 3 (loop unrolling and vectorization).
     """
 
     kernel_invariants = {
@@ -92,11 +133,14 @@ class Core:
                  host, ref_period,
                  analyzer_proxy=None, analyze_at_run_end=False,
                  ref_multiplier=8,
-                 target="rv32g", satellite_cpu_targets={}):
+                 target="rv32g", satellite_cpu_targets={},
+                 compilation_cache=True, compilation_cache_size=256*1024*1024,
+                 opt_level=2):
         self.ref_period = ref_period
         self.ref_multiplier = ref_multiplier
         self.satellite_cpu_targets = satellite_cpu_targets
         self.target_cls = get_target_cls(target)
+        self.opt_level = opt_level
         self.coarse_ref_period = ref_period*ref_multiplier
         if host is None:
             self.comm = CommKernelDummy()
@@ -110,6 +154,15 @@ class Core:
         self.core = self
         self.comm.core = self
         self.analyzer_proxy = None
+        # Time in seconds spent in each phase of the last kernel compilation.
+        self.compile_timings = {}
+
+        if compilation_cache and not os.getenv("ARTIQ_NO_COMPILATION_CACHE"):
+            self.compilation_cache = CompilationCache(
+                os.path.join(get_user_cache_dir(), "kernels"),
+                max_disk_size=compilation_cache_size)
+        else:
+            self.compilation_cache = None
 
     def notify_run_end(self):
         if self.analyze_at_run_end:
@@ -122,31 +175,115 @@ class Core:
                 attribute_writeback=True, print_as_rpc=True,
                 target=None, destination=0, subkernel_arg_types=[],
                 subkernels={}):
+        embedding_map, llvm_job, backend, subkernel_arg_types = \
+            self._compile_frontend(function, args, kwargs, set_result,
+                                   attribute_writeback, print_as_rpc,
+                                   target, destination, subkernel_arg_types,
+                                   subkernels)
+        kernel_library, symbolizer, demangler = \
+            backend(None if llvm_job is None else _compile_llvm_ir(*llvm_job))
+        return embedding_map, kernel_library, symbolizer, demangler, \
+               subkernel_arg_types
+
+    def _compile_frontend(self, function, args, kwargs, set_result,
+                          attribute_writeback, print_as_rpc,
+                          target, destination, subkernel_arg_types,
+                          subkernels):
+        """Run the compilation stages that access host objects.
+
+        Returns the embedding map, the arguments of :func:`_compile_llvm_ir`
+        (or ``None`` if the kernel was found in the compilation cache), a
+        function completing the compilation and the inferred subkernel
+        argument types. The arguments of :func:`_compile_llvm_ir` can be
+        sent to another process. The result of that function is passed to the
+        completing function, which returns the stripped library, the
+        symbolizer and the demangler."""
         try:
             engine = _DiagnosticEngine(all_errors_are_fatal=True)
 
+            start = time.monotonic()
             stitcher = Stitcher(engine=engine, core=self, dmgr=self.dmgr,
                                 print_as_rpc=print_as_rpc,
                                 destination=destination, subkernel_arg_types=subkernel_arg_types,
                                 subkernels=subkernels)
             stitcher.stitch_call(function, args, kwargs, set_result)
             stitcher.finalize()
-
+            if target is None:
+                target = self.target_cls(
+                    opt_level=get_opt_level(function, self.opt_level))
+            target.add_timing("embedding", start)
+            demangler = lambda symbols: target.demangle(symbols)
+
+            cache_key = self._compilation_cache_key(stitcher, target, attribute_writeback)
+            if cache_key is not None:
+                host_values = stitcher.host_values()
+                entry = self.compilation_cache.get(cache_key)
+                if entry is not None and entry.replay(stitcher.embedding_map, host_values):
+                    def cached_backend(compiled):
+                        self._record_timings(function, target, cached=True)
+                        return entry.stripped_library, \
+                               target.symbolizer(entry.objects), demangler
+                    return stitcher.embedding_map, None, cached_backend, {}
+                embedding_map_mark = mark_embedding_map(stitcher.embedding_map)
+
+            start = time.monotonic()
             module = Module(stitcher,
                 ref_period=self.ref_period,
                 attribute_writeback=attribute_writeback)
-            target = target if target is not None else self.target_cls()
-
-            library = target.compile_and_link([module])
-            stripped_library = target.strip(library)
-
-            return stitcher.embedding_map, stripped_library, \
-                   lambda addresses: target.symbolize(library, addresses), \
-                   lambda symbols: target.demangle(symbols), \
-                   module.subkernel_arg_types
+            target.add_timing("transforms", start)
+            llmodule = target.generate_llvm_ir(module)
         except diagnostic.Error as error:
             raise CompileError(error.diagnostic) from error
 
+        def backend(compiled):
+            objects, stripped_library, timings = compiled
+            if timings is not target.timings:
+                # The LLVM stages ran in another process, with a copy of the target.
+                for phase, duration in timings.items():
+                    target.timings[phase] = target.timings.get(phase, 0.0) + duration
+            self._record_timings(function, target, cached=False)
+
+            if cache_key is not None:
+                # LLVM IR generation was the last stage to add embedding map entries.
+                entry = CacheEntry.record(objects, stripped_library,
+                                          stitcher.embedding_map, embedding_map_mark,
+                                          host_values)
+                if entry is not None:
+                    self.compilation_cache.put(cache_key, entry)
+
+            return stripped_library, target.symbolizer(objects), demangler
+
+        return stitcher.embedding_map, (target, str(llmodule)), backend, \
+               module.subkernel_arg_types
+
+    def _record_timings(self, function, target, cached):
+        timings = dict(target.timings)
+        logger.debug("%s %s at optimization level %d: %s",
+                     "found cached" if cached else "compiled",
+                     function.__qualname__ if target.subkernel_id is None
+                     else "subkernel {}".format(target.subkernel_id),
+                     target.opt_level,
+                     ", ".join("{} {:.3f}s".format(phase, duration)
+                               for phase, duration in timings.items()))
+        if target.subkernel_id is None:
+            self.compile_timings = timings
+
+    def _compilation_cache_key(self, stitcher, target, attribute_writeback):
+        if self.compilation_cache is None:
+            return None
+        # Kernels calling subkernels need the inferred subkernel argument
+        # types, which are only available after a full compilation.
+        if stitcher.embedding_map.subkernels():
+            return None
+        # Dumping intermediate representations requires running every stage.
+        if any(name.startswith("ARTIQ_DUMP_") for name in os.environ):
+            return None
+        return self.compilation_cache.key(
+            stitcher.digest(), artiq_version, llvm.llvm_version_info,
+            type(target).__name__, target.triple, target.features,
+            target.subkernel_id, target.opt_level, self.ref_period,
+            attribute_writeback)
+
     def _run_compiled(self, kernel_library, embedding_map, symbolizer, demangler):
         if self.first_run:
             self.comm.check_system_info()
@@ -168,6 +305,14 @@ class Core:
         return result
 
     def compile_subkernel(self, sid, subkernel_fn, embedding_map, args, subkernel_arg_types, subkernels):
+        destination, object_map, llvm_job, backend = \
+            self._compile_subkernel_frontend(sid, subkernel_fn, args,
+                                             subkernel_arg_types, subkernels)
+        kernel_library, _, _ = \
+            backend(None if llvm_job is None else _compile_llvm_ir(*llvm_job))
+        return destination, kernel_library, object_map
+
+    def _compile_subkernel_frontend(self, sid, subkernel_fn, args, subkernel_arg_types, subkernels):
         # pass self to subkernels (if applicable)
         # assuming the first argument is self
         subkernel_args = getfullargspec(subkernel_fn.artiq_embedded.function)
@@ -177,34 +322,64 @@ class Core:
                 self_arg = args[:1]
         destination = subkernel_fn.artiq_embedded.destination
         destination_tgt = self.satellite_cpu_targets[destination]
-        target = get_target_cls(destination_tgt)(subkernel_id=sid)
-        object_map, kernel_library, _, _, _ = \
-            self.compile(subkernel_fn, self_arg, {}, attribute_writeback=False,
-                        print_as_rpc=False, target=target, destination=destination, 
-                        subkernel_arg_types=subkernel_arg_types.get(sid, []),
-                        subkernels=subkernels)
+        target = get_target_cls(destination_tgt)(
+            subkernel_id=sid,
+            opt_level=get_opt_level(subkernel_fn, self.opt_level))
+        object_map, llvm_job, backend, _ = \
+            self._compile_frontend(subkernel_fn, self_arg, {}, None,
+                                   attribute_writeback=False, print_as_rpc=False,
+                                   target=target, destination=destination,
+                                   subkernel_arg_types=subkernel_arg_types.get(sid, []),
+                                   subkernels=subkernels)
         if object_map.has_rpc():
             raise ValueError("Subkernel must not use RPC")
-        return destination, kernel_library, object_map
+        return destination, object_map, llvm_job, backend
 
     def compile_and_upload_subkernels(self, embedding_map, args, subkernel_arg_types):
+        # Stitching and LLVM IR generation access host objects and run here in
+        # order of subkernel ID, while the CPU-bound LLVM stages of previous
+        # subkernels run in worker processes, which are sent the LLVM IR as text.
+        # Libraries are uploaded in order of subkernel ID as soon as they are ready.
         subkernels = embedding_map.subkernels()
         subkernels_compiled = []
-        while True:
-            new_subkernels = {}
-            for sid, subkernel_fn in subkernels.items():
-                if sid in subkernels_compiled:
-                    continue
-                destination, kernel_library, sub_embedding_map = \
-                    self.compile_subkernel(sid, subkernel_fn, embedding_map,
-                                        args, subkernel_arg_types, subkernels)
+        pending = deque()
+
+        max_workers = min(len(subkernels), os.cpu_count() or 1)
+        executor = ProcessPoolExecutor(max_workers) if max_workers > 1 else None
+
+        def submit(llvm_job):
+            if llvm_job is not None and executor is not None:
+                return executor.submit(_compile_llvm_ir, *llvm_job)
+            future = Future()
+            future.set_result(None if llvm_job is None else _compile_llvm_ir(*llvm_job))
+            return future
+
+        def upload_ready(wait):
+            while pending and (wait or pending[0][3].done()):
+                sid, destination, backend, compiled = pending.popleft()
+                kernel_library, _, _ = backend(compiled.result())
                 self.comm.upload_subkernel(kernel_library, sid, destination)
-                new_subkernels.update(sub_embedding_map.subkernels())
-                subkernels_compiled.append(sid)
-            if new_subkernels == subkernels:
-                break
-            subkernels.update(new_subkernels)
 
+        try:
+            while True:
+                new_subkernels = {}
+                for sid, subkernel_fn in subkernels.items():
+                    if sid in subkernels_compiled:
+                        continue
+                    destination, sub_embedding_map, llvm_job, backend = \
+                        self._compile_subkernel_frontend(sid, subkernel_fn, args,
+                                                         subkernel_arg_types, subkernels)
+                    pending.append((sid, destination, backend, submit(llvm_job)))
+                    new_subkernels.update(sub_embedding_map.subkernels())
+                    subkernels_compiled.append(sid)
+                    upload_ready(wait=False)
+                if new_subkernels == subkernels:
+                    break
+                subkernels.update(new_subkernels)
+            upload_ready(wait=True)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
     def precompile(self, function, *args, **kwargs):
         """Precompile a kernel and return a callable that executes it on the core device
@@ -0,0 +1,86 @@
+"""Measures how many events per second the analyzer dump decoder and the
+VCD and HDF5 converters process.
+
+Builds a synthetic dump of TTL output events on one channel, and reports the
+throughput of each stage.
+
+Example: ``python -m artiq.coredevice.testbench.analyzer -n 4000000``
+"""
+
+import argparse
+import io
+import struct
+import time
+
+import numpy
+import h5py
+
+from artiq.coredevice.comm_analyzer import (decode_dump, decoded_dump_to_vcd,
+                                            dump_to_vcd, dump_to_hdf5,
+                                            MessageType)
+
+
+_devices = {
+    "core": {
+        "type": "local",
+        "module": "artiq.coredevice.core",
+        "class": "Core",
+        "arguments": {"host": None, "ref_period": 1e-9}
+    },
+    "ttl0": {
+        "type": "local",
+        "module": "artiq.coredevice.ttl",
+        "class": "TTLOut",
+        "arguments": {"channel": 0}
+    }
+}
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(
+        description="ARTIQ analyzer decoding benchmark")
+    parser.add_argument("-n", "--events", default=1 << 20, type=int,
+                        help="number of events in the dump "
+                             "(default: %(default)d)")
+    return parser
+
+
+def synthetic_dump(count, log_channel=31):
+    records = numpy.zeros(count, numpy.dtype([
+        ("data", ">u8"), ("address", ">u4"), ("rtio_counter", ">u8"),
+        ("timestamp", ">u8"), ("type_channel", ">u4")]))
+    records["timestamp"] = numpy.arange(count)*8 + 1000
+    records["rtio_counter"] = records["timestamp"] - 500
+    records["data"] = numpy.arange(count) % 2
+    records[-1]["type_channel"] = MessageType.stopped.value
+    data = records.tobytes()
+    return (b"e" + struct.pack("<IQbbb", len(data), len(data), 0, log_channel, 0) +
+            data)
+
+
+def _report(name, count, f):
+    t0 = time.monotonic()
+    result = f()
+    t1 = time.monotonic()
+    print("{}: {:.2f} s, {:.0f} events/s".format(name, t1 - t0, count/(t1 - t0)))
+    return result
+
+
+def main():
+    args = get_argparser().parse_args()
+    count = args.events
+    dump = synthetic_dump(count)
+
+    decoded_dump = _report("Decoding", count, lambda: decode_dump(dump))
+    _report("VCD conversion", count,
+            lambda: decoded_dump_to_vcd(io.StringIO(), _devices, decoded_dump))
+    _report("Streaming VCD conversion", count,
+            lambda: dump_to_vcd(io.StringIO(), _devices, dump))
+    with h5py.File("analyzer.h5", "w", driver="core",
+                   backing_store=False) as f:
+        _report("HDF5 conversion", count,
+                lambda: dump_to_hdf5(f, _devices, dump))
+
+
+if __name__ == "__main__":
+    main()
@@ -552,7 +552,20 @@ extern fn subkernel_await_message(id: u32, timeout: u64, tags: &CSlice<u8>, min:
     // RpcRecvRequest should be called `count` times after this to receive message data
 }
 
-unsafe fn attribute_writeback(typeinfo: *const ()) {
+unsafe fn attribute_writeback(writeback: *const ()) {
+    // A single RPC to service 0, with (object, name, value) triples
+    // as arguments; see LLVMIRGenerator.emit_attribute_writeback.
+    struct Writeback {
+        tag:  CSlice<'static, u8>,
+        data: *const *const ()
+    }
+
+    let writeback = writeback as *const Writeback;
+    rpc_send_async(0, &(*writeback).tag, (*writeback).data);
+}
+
+unsafe fn attribute_writeback_typeinfo(typeinfo: *const ()) {
+    // One RPC per attribute, for kernels compiled without `writeback`.
     struct Attr {
         offset: usize,
         tag:    CSlice<'static, u8>,
@@ -616,6 +629,7 @@ pub unsafe fn main() {
     let __bss_start = library.lookup(b"__bss_start").unwrap();
     let _end = library.lookup(b"_end").unwrap();
     let __modinit__ = library.lookup(b"__modinit__").unwrap();
+    let writeback = library.lookup(b"writeback");
     let typeinfo = library.lookup(b"typeinfo");
     let _sstack_guard = library.lookup(b"_sstack_guard").unwrap();
 
@@ -630,8 +644,10 @@ pub unsafe fn main() {
 
     (mem::transmute::<u32, fn()>(__modinit__))();
 
-    if let Some(typeinfo) = typeinfo {
-        attribute_writeback(typeinfo as *const ());
+    if let Some(writeback) = writeback {
+        attribute_writeback(writeback as *const ());
+    } else if let Some(typeinfo) = typeinfo {
+        attribute_writeback_typeinfo(typeinfo as *const ());
     }
 
     // Make sure all async RPCs are processed before exiting.
@@ -32,6 +32,11 @@ def get_argparser():
 
     parser.add_argument("-o", "--output", default=None,
                         help="output file")
+    parser.add_argument("-O", "--opt-level", default=None, type=int,
+                        choices=range(4),
+                        help="optimization level of kernels without an "
+                             "optimization level flag (default: "
+                             "from the core device)")
     parser.add_argument("file", metavar="FILE",
                         help="file containing the experiment to compile")
     parser.add_argument("arguments", metavar="ARGUMENTS",
@@ -62,6 +67,8 @@ def main():
                 raise ValueError("Experiment entry point must be a kernel")
             core_name = exp.run.artiq_embedded.core_name
             core = getattr(exp_inst, core_name)
+            if args.opt_level is not None:
+                core.opt_level = args.opt_level
 
             object_map, main_kernel_library, _, _, subkernel_arg_types = \
                 core.compile(exp.run, [exp_inst], {},
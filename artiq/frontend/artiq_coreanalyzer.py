@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
+import logging
+import mmap
 import sys
+import time
+
+import h5py
 
 from sipyco import common_args
 
 from artiq.master.databases import DeviceDB
 from artiq.master.worker_db import DeviceManager
 from artiq.coredevice.comm_analyzer import (get_analyzer_dump,
-                                            decode_dump, decoded_dump_to_vcd)
+                                            decode_dump, dump_to_vcd,
+                                            dump_to_hdf5)
+
+
+logger = logging.getLogger(__name__)
 
 
 def get_argparser():
@@ -25,6 +34,9 @@ def get_argparser():
                         action="store_true", help="print raw decoded messages")
     parser.add_argument("-w", "--write-vcd", type=str, default=None,
                         help="format and write contents to VCD file")
+    parser.add_argument("-H", "--write-hdf5", type=str, default=None,
+                        help="write events as per-channel columnar arrays "
+                             "to HDF5 file")
     parser.add_argument("-d", "--write-dump", type=str, default=None,
                         help="write raw dump file")
 
@@ -40,33 +52,41 @@ def main():
     args = get_argparser().parse_args()
     common_args.init_logger_from_args(args)
 
-    if (not args.print_decoded
-            and args.write_vcd is None and args.write_dump is None):
-        print("No action selected, use -p, -w and/or -d. See -h for help.")
+    if (not args.print_decoded and args.write_vcd is None
+            and args.write_hdf5 is None and args.write_dump is None):
+        print("No action selected, use -p, -w, -H and/or -d. "
+              "See -h for help.")
         sys.exit(1)
 
     device_mgr = DeviceManager(DeviceDB(args.device_db))
     if args.read_dump:
         with open(args.read_dump, "rb") as f:
-            dump = f.read()
+            # Map the file so that large dumps are paged in on demand.
+            dump = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     else:
         core_addr = device_mgr.get_desc("core")["arguments"]["host"]
         dump = get_analyzer_dump(core_addr)
-    decoded_dump = decode_dump(dump)
     if args.print_decoded:
+        decoded_dump = decode_dump(dump)
         print("Log channel:", decoded_dump.log_channel)
         print("DDS one-hot:", decoded_dump.dds_onehot_sel)
         for message in decoded_dump.messages:
             print(message)
     if args.write_vcd:
         with open(args.write_vcd, "w") as f:
-            decoded_dump_to_vcd(f, device_mgr.get_device_db(),
-                                decoded_dump,
-                                uniform_interval=args.vcd_uniform_interval)
+            t0 = time.monotonic()
+            event_count = dump_to_vcd(
+                f, device_mgr.get_device_db(), dump,
+                uniform_interval=args.vcd_uniform_interval)
+            elapsed = time.monotonic() - t0
+        logger.info("wrote %d events to VCD in %.2fs (%.0f events/s)",
+                    event_count, elapsed, event_count/max(elapsed, 1e-9))
+    if args.write_hdf5:
+        with h5py.File(args.write_hdf5, "w") as f:
+            dump_to_hdf5(f, device_mgr.get_device_db(), dump)
     if args.write_dump:
         with open(args.write_dump, "wb") as f:
             f.write(dump)
 
-
 if __name__ == "__main__":
     main()
@@ -41,6 +41,11 @@ def get_argparser():
     parser.add_argument(
         "--port-broadcast", default=1067, type=int,
         help="TCP port to connect to for broadcasts")
+    parser.add_argument(
+        "--dataset-max-rate", default=None, type=float,
+        help=("maximum rate of dataset updates per second, which must be "
+              "one of the rates published by the master "
+              "(default: no limit)"))
     parser.add_argument(
         "--db-file", default=None,
         help="database file for local GUI settings")
@@ -156,7 +161,10 @@ def main():
                                   ("explist_status", explorer.StatusUpdater),
                                   ("datasets", datasets.Model),
                                   ("schedule", schedule.Model)):
-        subscriber = ModelSubscriber(notifier_name, modelf,
+        published_name = notifier_name
+        if notifier_name == "datasets" and args.dataset_max_rate is not None:
+            published_name = "datasets@{:g}Hz".format(args.dataset_max_rate)
+        subscriber = ModelSubscriber(published_name, modelf,
             report_disconnect)
         loop.run_until_complete(subscriber.connect(
             args.server, args.port_notify))
@@ -4,6 +4,7 @@ import asyncio
 import argparse
 import atexit
 import logging
+import os
 from types import SimpleNamespace
 
 from sipyco.pc_rpc import Server as RPCServer
@@ -42,6 +43,31 @@ def get_argparser():
                        help="device database file (default: '%(default)s')")
     group.add_argument("--dataset-db", default="dataset_db.mdb",
                        help="dataset file (default: '%(default)s')")
+    group.add_argument(
+        "--dataset-db-compression", default="none",
+        choices=["none", "zlib", "lz4", "zstd"],
+        help=("compression of the persistent datasets, lz4 and zstd "
+              "require the corresponding Python packages "
+              "(default: '%(default)s')"))
+    group.add_argument(
+        "--lazy-datasets", default=False, action="store_true",
+        help=("load the values of persistent datasets on demand instead "
+              "of at start-up"))
+    group.add_argument(
+        "--dataset-cache-size", default=None, type=float,
+        help=("with --lazy-datasets, maximum size in MiB of the unmodified "
+              "dataset values kept in memory (default: unlimited)"))
+    group.add_argument(
+        "--dataset-notify-period", default=0.1, type=float,
+        help=("time window in seconds within which dataset modifications "
+              "are coalesced before being sent to subscribers "
+              "(default: %(default)s)"))
+    group.add_argument(
+        "--dataset-notify-rate", default=[], type=float, action="append",
+        metavar="RATE",
+        help=("additionally publish datasets at a maximum rate of RATE "
+              "updates per second, under the notifier name "
+              "'datasets@<RATE>Hz' (can be repeated)"))
 
     group = parser.add_argument_group("repository")
     group.add_argument(
@@ -54,6 +80,16 @@ def get_argparser():
         "--experiment-subdir", default="",
         help=("path to the experiment folder from the repository root "
               "(default: '%(default)s')"))
+    group.add_argument(
+        "--repository-scan-cache", default="repository_scan_cache.pyon",
+        help=("file where the results of examining experiment files are "
+              "kept across master restarts, or empty to only keep them "
+              "in memory (default: '%(default)s')"))
+    group.add_argument(
+        "--repo-scan-workers", default=None, type=int,
+        help=("number of worker processes examining experiment files "
+              "concurrently during repository scans "
+              "(default: number of CPUs, at most 4)"))
     log_args(parser)
 
     parser.add_argument("--name",
@@ -62,6 +98,17 @@ def get_argparser():
     parser.add_argument("--log-submissions", default=None, 
         help="set the filename to create the experiment subimission")
 
+    group = parser.add_argument_group("workers")
+    group.add_argument(
+        "--worker-pool-size", default=1, type=int,
+        help=("number of worker processes started in advance for new runs, "
+              "0 to start them when runs are built (default: %(default)d)"))
+    group.add_argument(
+        "--worker-max-runs", default=1, type=int,
+        help=("number of runs after which a worker process from the pool is "
+              "ended; reused workers keep the modules imported by previous "
+              "experiments (default: %(default)d)"))
+
     return parser
 
 
@@ -92,7 +139,13 @@ def main():
         server_broadcast.broadcast("ccb", msg)
 
     device_db = DeviceDB(args.device_db)
-    dataset_db = DatasetDB(args.dataset_db)
+    dataset_db = DatasetDB(args.dataset_db,
+                           notify_period=args.dataset_notify_period,
+                           notify_rates=args.dataset_notify_rate,
+                           compression=args.dataset_db_compression,
+                           lazy=args.lazy_datasets,
+                           cache_size=None if args.dataset_cache_size is None
+                           else int(args.dataset_cache_size*2**20))
     atexit.register(dataset_db.close_db)
     dataset_db.start(loop=loop)
     atexit_register_coroutine(dataset_db.stop, loop=loop)
@@ -103,10 +156,13 @@ def main():
     else:
         repo_backend = FilesystemBackend(args.repository)
     experiment_db = ExperimentDB(
-        repo_backend, worker_handlers, args.experiment_subdir)
+        repo_backend, worker_handlers, args.experiment_subdir,
+        args.repository_scan_cache or None,
+        args.repo_scan_workers or min(os.cpu_count() or 1, 4))
     atexit.register(experiment_db.close)
 
-    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db, args.log_submissions)
+    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db, args.log_submissions,
+                          args.worker_pool_size, args.worker_max_runs)
     scheduler.start(loop=loop)
     atexit_register_coroutine(scheduler.stop, loop=loop)
 
@@ -145,9 +201,9 @@ def main():
     server_notify = Publisher({
         "schedule": scheduler.notifier,
         "devices": device_db.data,
-        "datasets": dataset_db.data,
         "explist": experiment_db.explist,
-        "explist_status": experiment_db.status
+        "explist_status": experiment_db.status,
+        **dataset_db.get_notifiers()
     })
     loop.run_until_complete(server_notify.start(
         bind, args.port_notify))
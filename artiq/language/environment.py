@@ -342,7 +342,8 @@ class HasEnvironment:
     @rpc(flags={"async"})
     def set_dataset(self, key, value, *,
                     unit=None, scale=None, precision=None,
-                    broadcast=False, persist=False, archive=True):
+                    broadcast=False, persist=False, archive=True,
+                    stream=False):
         """Sets the contents and handling modes of a dataset.
 
         Datasets must be scalars (``bool``, ``int``, ``float`` or NumPy scalar)
@@ -361,6 +362,12 @@ class HasEnvironment:
             broadcast.
         :param archive: the data is saved into the local storage of the current
             run (archived as a HDF5 file).
+        :param stream: for archived lists and NumPy arrays, the data is
+            written to the HDF5 file of the run while it is being modified
+            with :meth:`append_to_dataset` and :meth:`mutate_dataset`
+            (at most every second by default), instead of only at the end of
+            the experiment. Elements of streamed lists must all have the same
+            type and shape.
         """
         metadata = {}
         if unit is not None:
@@ -369,7 +376,8 @@ class HasEnvironment:
             metadata["scale"] = scale
         if precision is not None:
             metadata["precision"] = precision
-        self.__dataset_mgr.set(key, value, metadata, broadcast, persist, archive)
+        self.__dataset_mgr.set(key, value, metadata, broadcast, persist, archive,
+                               stream)
 
     @rpc(flags={"async"})
     def mutate_dataset(self, key, index, value):
@@ -1,12 +1,20 @@
 import asyncio
+import copy
+import io
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import lmdb
+import numpy
 
 from sipyco.sync_struct import Notifier, process_mod, ModAction, update_from_dict
 from sipyco import pyon
 from sipyco.asyncio_tools import TaskObject
 
 from artiq.tools import file_import
+from artiq.master import worker_ipc
 
 
 def device_db_from_file(filename):
@@ -40,55 +48,435 @@ class DeviceDB:
         return self.data.raw_view["satellite_cpu_targets"][destination]
 
 
+def _mod_region(live, mod):
+    """Return the range ``(start, stop)`` along the first axis of the
+    dataset value ``live`` that ``mod`` (already applied) may have changed,
+    or ``None`` if the change cannot be expressed as such a range. ``stop``
+    is ``None`` if the length of the (list) value may have changed."""
+    path = mod["path"]
+    action = mod["action"]
+    if len(path) < 2 or path[1] != 1:
+        return None
+    if len(path) > 2:
+        index = path[2]
+        if type(index) is not int or index < 0:
+            return None
+        return index, index + 1
+    is_array = isinstance(live, numpy.ndarray)
+    if not is_array and not isinstance(live, list):
+        return None
+    length = len(live)
+    if action == ModAction.append.value:
+        return length - 1, None
+    if action != ModAction.setitem.value:
+        return None
+    key = mod["key"]
+    if is_array and isinstance(key, tuple) and key:
+        key = key[0]
+    if isinstance(key, int):
+        if key < 0:
+            key += length
+        return key, key + 1
+    if not isinstance(key, slice) or key.step not in (None, 1):
+        return None
+    if is_array:
+        start, stop, _ = key.indices(length)
+        return start, stop
+    # list slice assignments may resize the list: republish its tail
+    start = 0 if key.start is None else key.start
+    try:
+        inserted = len(mod["value"])
+    except TypeError:
+        return None
+    if start < 0:
+        return None
+    return min(start, length - inserted), None
+
+
+class _DatasetNotifier(Notifier):
+    # The raw view is used to initialize new subscribers, and is obtained
+    # from the database which may first need to load some datasets.
+    def __init__(self, backing_store, snapshot):
+        Notifier.__init__(self, backing_store)
+        self._snapshot = snapshot
+
+    @property
+    def raw_view(self):
+        return self._snapshot()
+
+    @raw_view.setter
+    def raw_view(self, value):
+        pass
+
+
+class DatasetPublisher:
+    """Publishes the modifications of a dataset database to subscribers,
+    at a rate of at most one update per ``period`` seconds.
+
+    Within a period, modifications are coalesced per key: a replaced dataset
+    is sent once with its latest value, and in-place modifications of list
+    and array datasets are sent as a single assignment of the modified slice.
+    All the mods sent are read from the live data when the period expires,
+    which makes them idempotent and allows ``notifier`` to share the backing
+    store of the database for the initial synchronization of new
+    subscribers. Creations and deletions of keys are forwarded immediately.
+
+    If given, ``snapshot`` is called to obtain the data sent to new
+    subscribers instead of the backing store.
+    """
+    def __init__(self, backing_store, period=0.0, snapshot=None):
+        if snapshot is None:
+            self.notifier = Notifier(backing_store)
+        else:
+            self.notifier = _DatasetNotifier(backing_store, snapshot)
+        self._live = backing_store
+        self.period = period
+        self._published_keys = set(backing_store.keys())
+        # key -> None (whole dataset) or [start, stop]
+        self._dirty = dict()
+        self._handle = None
+        self._last_flush = 0.0
+
+    def _publish(self, mod):
+        if self.notifier.publish is not None:
+            self.notifier.publish(mod)
+
+    def process_mod(self, mod):
+        """Records a mod that has been applied to the backing store."""
+        path = mod["path"]
+        live = self._live
+        if not path:
+            key = mod["key"]
+            if mod["action"] == ModAction.delitem.value:
+                self._dirty.pop(key, None)
+                self._published_keys.discard(key)
+                self._publish(mod)
+            elif key not in self._published_keys:
+                self._published_keys.add(key)
+                self._dirty.pop(key, None)
+                self._publish(mod)
+            else:
+                self._dirty[key] = None
+        else:
+            key = path[0]
+            if key in self._dirty and self._dirty[key] is None:
+                return
+            region = _mod_region(live[key][1], mod)
+            if region is None:
+                self._dirty[key] = None
+            elif key in self._dirty:
+                dirty = self._dirty[key]
+                dirty[0] = min(dirty[0], region[0])
+                if dirty[1] is not None:
+                    dirty[1] = (None if region[1] is None
+                                else max(dirty[1], region[1]))
+            else:
+                self._dirty[key] = list(region)
+        if self._dirty and self._handle is None:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        delay = self._last_flush + self.period - time.monotonic()
+        if delay > 0:
+            self._handle = loop.call_later(delay, self.flush)
+        else:
+            self._handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        """Sends the pending modifications to the subscribers."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._last_flush = time.monotonic()
+        dirty, self._dirty = self._dirty, dict()
+        live = self._live
+        for key, region in dirty.items():
+            if region is None:
+                self._publish({"action": ModAction.setitem.value,
+                               "path": [], "key": key, "value": live[key]})
+                continue
+            value = live[key][1]
+            start, stop = region
+            if stop is not None and start >= stop:
+                continue
+            self._publish({"action": ModAction.setitem.value,
+                           "path": [key, 1], "key": slice(start, stop),
+                           "value": value[start:stop]})
+
+
+# Persisted datasets are stored as a header with the format version (a byte
+# never present at the start of the legacy PYON records), the compression
+# method and the length of the PYON encoded metadata, followed by the
+# metadata and the (compressed) binary framed encoding of the value used by
+# the master-worker IPC, in which numerical arrays are kept as raw buffers.
+# Metadata can be read without decoding the value.
+_record_version = 1
+_record_header = struct.Struct("<BBI")
+_compressions = ["none", "zlib", "lz4", "zstd"]
+
+
+def _get_codec(compression):
+    if compression == "none":
+        return (lambda data: data), bytes
+    elif compression == "zlib":
+        import zlib
+        return zlib.compress, zlib.decompress
+    elif compression == "lz4":
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    elif compression == "zstd":
+        import zstandard
+        return (zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress)
+    else:
+        raise ValueError("unknown compression method: " + compression)
+
+
+def _decode_metadata(record):
+    _, _, length = _record_header.unpack_from(record)
+    start = _record_header.size
+    return pyon.decode(bytes(record[start:start+length]).decode())
+
+
+def _decode_value(record, codecs):
+    _, compression, length = _record_header.unpack_from(record)
+    compression = _compressions[compression]
+    if compression not in codecs:
+        codecs[compression] = _get_codec(compression)
+    payload = codecs[compression][1](record[_record_header.size+length:])
+    return worker_ipc.read_message(io.BytesIO(payload).read)
+
+
+# placeholder for the values of lazily loaded datasets
+_not_loaded = object()
+
+
 class DatasetDB(TaskObject):
-    def __init__(self, persist_file, autosave_period=30):
+    """Dataset database of the master.
+
+    Persistent datasets are kept in the LMDB file ``persist_file`` and saved
+    every ``autosave_period`` seconds. Records are written in a binary format
+    compressed with ``compression`` (``none``, ``zlib``, ``lz4`` or ``zstd``,
+    the latter two requiring the corresponding Python packages). Records in
+    the PYON format of previous versions are read and converted at the next
+    save. Encoding, compression and LMDB transactions run in a separate
+    thread, so that saving large datasets does not block the event loop.
+    Datasets modified in place while they are being saved are copied first.
+
+    With ``lazy``, only the keys and metadata of the persistent datasets are
+    loaded at start-up, and values are decoded when first needed (by
+    :meth:`get`, a modification, or the initialization of a subscriber).
+    Unmodified values loaded this way are kept in a LRU cache of at most
+    ``cache_size`` bytes (unlimited if ``None``) and reloaded from the file
+    after being evicted.
+    """
+    def __init__(self, persist_file, autosave_period=30,
+                 notify_period=0.1, notify_rates=(), compression="none",
+                 lazy=False, cache_size=None):
         self.persist_file = persist_file
         self.autosave_period = autosave_period
+        self.compression = _compressions.index(compression)
+        self._compress = _get_codec(compression)[0]
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._codecs = dict()
+        # id of dataset entry -> number of saves encoding it
+        self._saving = dict()
+
+        # key -> size of the value, for unmodified lazily loaded values
+        self._cache = OrderedDict()
+        self._cache_total = 0
+        self.cache_size = cache_size
+        self._not_loaded_count = 0
 
         self.lmdb = lmdb.open(persist_file, subdir=False, map_size=2**30)
         data = dict()
-        with self.lmdb.begin() as txn:
-            for key, value_and_metadata in txn.cursor():
-                value, metadata = pyon.decode(value_and_metadata.decode())
-                data[key.decode()] = (True, value, metadata)
-        self.data = Notifier(data)
         self.pending_keys = set()
+        with self.lmdb.begin(buffers=True) as txn:
+            for key, record in txn.cursor():
+                key = bytes(key).decode()
+                if record[0] != _record_version:
+                    value, metadata = pyon.decode(bytes(record).decode())
+                    self.pending_keys.add(key)
+                elif lazy:
+                    value = _not_loaded
+                    metadata = _decode_metadata(record)
+                    self._not_loaded_count += 1
+                else:
+                    value = _decode_value(record, self._codecs)
+                    metadata = _decode_metadata(record)
+                data[key] = (True, value, metadata)
+        self.data = Notifier(data)
+
+        self.publishers = {"datasets": DatasetPublisher(
+            data, notify_period, self._snapshot)}
+        for rate in notify_rates:
+            self.publishers["datasets@{:g}Hz".format(rate)] = \
+                DatasetPublisher(data, max(notify_period, 1/rate),
+                                 self._snapshot)
+        self.data.publish = self._publish
+
+    def _load(self, key):
+        persist, value, metadata = self.data.raw_view[key]
+        if value is _not_loaded:
+            with self.lmdb.begin(buffers=True) as txn:
+                record = txn.get(key.encode())
+                value = _decode_value(record, self._codecs)
+                size = len(record)
+            if isinstance(value, numpy.ndarray):
+                size = max(size, value.nbytes)
+            # modifies the backing store directly, as the dataset is
+            # unchanged for subscribers
+            self.data.raw_view[key] = (persist, value, metadata)
+            self._not_loaded_count -= 1
+            self._cache[key] = size
+            self._cache_total += size
+            self._evict()
+        elif key in self._cache:
+            self._cache.move_to_end(key)
+        return value
+
+    def _evict(self):
+        if self.cache_size is None:
+            return
+        while self._cache_total > self.cache_size and len(self._cache) > 1:
+            key, size = self._cache.popitem(last=False)
+            self._cache_total -= size
+            persist, _, metadata = self.data.raw_view[key]
+            self.data.raw_view[key] = (persist, _not_loaded, metadata)
+            self._not_loaded_count += 1
+
+    def _forget(self, key):
+        # The value of the key is about to be modified or replaced: it can
+        # no longer be evicted.
+        if key in self._cache:
+            self._cache_total -= self._cache.pop(key)
+        elif key in self.data.raw_view and \
+                self.data.raw_view[key][1] is _not_loaded:
+            self._not_loaded_count -= 1
+
+    def _snapshot(self):
+        live = self.data.raw_view
+        if not self._not_loaded_count:
+            return live
+        snapshot = dict()
+        for key, (persist, value, metadata) in live.items():
+            if value is _not_loaded:
+                value = self._load(key)
+            snapshot[key] = (persist, value, metadata)
+        return snapshot
+
+    def _publish(self, mod):
+        for publisher in self.publishers.values():
+            publisher.process_mod(mod)
+
+    def get_notifiers(self):
+        """Returns the notifiers to be published, by name. Subscribers
+        select their maximum update rate through the name of the notifier,
+        ``datasets`` or ``datasets@<rate>Hz``."""
+        return {name: publisher.notifier
+                for name, publisher in self.publishers.items()}
 
     def close_db(self):
+        self._executor.shutdown()
         self.lmdb.close()
 
-    def save(self):
+    def _take_pending(self):
+        # Runs in the event loop thread. The entries of the datasets to be
+        # saved are only encoded by the executor, and are copied by
+        # update() before being modified in place in the meantime.
+        records = dict()
+        for key in self.pending_keys:
+            if key not in self.data.raw_view or not self.data.raw_view[key][0]:
+                records[key] = None
+            else:
+                entry = self.data.raw_view[key]
+                self._saving[id(entry)] = self._saving.get(id(entry), 0) + 1
+                records[key] = entry
+        self.pending_keys.clear()
+        return records
+
+    def _release(self, records):
+        for entry in records.values():
+            if entry is not None:
+                count = self._saving.pop(id(entry))
+                if count > 1:
+                    self._saving[id(entry)] = count - 1
+
+    def _write(self, records):
+        encoded = dict()
+        for key, entry in records.items():
+            if entry is None:
+                encoded[key] = None
+            else:
+                _, value, metadata = entry
+                metadata = pyon.encode(metadata).encode()
+                header = _record_header.pack(
+                    _record_version, self.compression, len(metadata))
+                parts = worker_ipc.encode_message(value, worker_ipc.BINARY)
+                encoded[key] = b"".join([
+                    header, metadata, self._compress(b"".join(parts))])
         with self.lmdb.begin(write=True) as txn:
-            for key in self.pending_keys:
-                if key not in self.data.raw_view or not self.data.raw_view[key][0]:
+            for key, record in encoded.items():
+                if record is None:
                     txn.delete(key.encode())
                 else:
-                    value_and_metadata = (self.data.raw_view[key][1],
-                                          self.data.raw_view[key][2])
-                    txn.put(key.encode(), 
-                            pyon.encode(value_and_metadata).encode())
-        self.pending_keys.clear()
+                    txn.put(key.encode(), record)
+
+    def save(self):
+        """Saves the pending modifications, blocking until they are
+        written."""
+        # Writes go through the single thread of the executor, and are
+        # therefore committed in order.
+        records = self._take_pending()
+        try:
+            self._executor.submit(self._write, records).result()
+        finally:
+            self._release(records)
+
+    async def save_async(self):
+        """Saves the pending modifications without blocking the event
+        loop."""
+        records = self._take_pending()
+        future = asyncio.wrap_future(self._executor.submit(self._write, records))
+        future.add_done_callback(lambda future: self._release(records))
+        # shielded so that cancellation does not drop submitted records
+        await asyncio.shield(future)
 
     async def _do(self):
         try:
             while True:
                 await asyncio.sleep(self.autosave_period)
-                self.save()
+                await self.save_async()
         finally:
             self.save()
 
     def get(self, key):
-        return self.data.raw_view[key][1]
+        return self._load(key)
 
     def get_metadata(self, key):
         return self.data.raw_view[key][2]
 
+    def _copy_on_write(self, key):
+        entry = self.data.raw_view[key]
+        if id(entry) in self._saving:
+            # modifies the backing store directly, as the dataset is
+            # unchanged for subscribers
+            self.data.raw_view[key] = copy.deepcopy(entry)
+
     def update(self, mod):
         if mod["path"]:
             key = mod["path"][0]
+            self._load(key)
+            self._copy_on_write(key)
         else:
             assert(mod["action"] == ModAction.setitem.value or mod["action"] == ModAction.delitem.value)
             key = mod["key"]
+        self._forget(key)
         self.pending_keys.add(key)
         process_mod(self.data, mod)
 
@@ -104,10 +492,12 @@ class DatasetDB(TaskObject):
                 metadata = self.data.raw_view[key][2]
             else:
                 metadata = {}
+        self._forget(key)
         self.data[key] = (persist, value, metadata)
         self.pending_keys.add(key)
 
     def delete(self, key):
+        self._forget(key)
         del self.data[key]
         self.pending_keys.add(key)
     #
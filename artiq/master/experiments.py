@@ -3,9 +3,11 @@ import os
 import tempfile
 import shutil
 import time
+import hashlib
 import logging
 
 from sipyco.sync_struct import Notifier, update_from_dict
+from sipyco import pyon
 
 from artiq.master.worker import (Worker, WorkerInternalException,
                                  log_worker_exception)
@@ -15,19 +17,161 @@ from artiq.tools import get_windows_drives, exc_to_warning
 logger = logging.getLogger(__name__)
 
 
+class _ScanCache:
+    """Results of examining experiment files during repository scans.
+
+    Entries are looked up by file name (relative to the repository root)
+    and are only used if the hash of the file contents matches, and if the
+    device database and the Python files of the repository, which may be
+    imported by the experiment, are unchanged since it was examined.
+    """
+    version = 2
+
+    def __init__(self, persist_file=None):
+        self.persist_file = persist_file
+        self.entries = dict()
+        if persist_file is not None:
+            try:
+                data = pyon.load_file(persist_file)
+                if data["version"] == self.version:
+                    self.entries = data["entries"]
+            except FileNotFoundError:
+                pass
+            except:
+                logger.warning("failed to load repository scan cache, "
+                               "ignoring", exc_info=True)
+        self.environment_hash = None
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+        self._modified = False
+
+    @staticmethod
+    def hash_device_db(device_db):
+        return hashlib.sha256(pyon.encode(device_db).encode()).hexdigest()
+
+    @staticmethod
+    def hash_file(path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    @staticmethod
+    def hash_repository(file_hashes):
+        """Hash the ``file_hashes`` of all Python files of the repository,
+        a dictionary from file names to file hashes."""
+        return hashlib.sha256(pyon.encode(
+            sorted(file_hashes.items())).encode()).hexdigest()
+
+    def start_scan(self, device_db_hash, repository_hash):
+        self.environment_hash = hashlib.sha256(pyon.encode(
+            (device_db_hash, repository_hash)).encode()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        self._seen = set()
+
+    def get(self, filename, file_hash):
+        self._seen.add(filename)
+        entry = self.entries.get(filename)
+        if (entry is not None and entry[0] == file_hash
+                and entry[1] == self.environment_hash):
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, filename, file_hash, description):
+        self.entries[filename] = (file_hash, self.environment_hash, description)
+        self._modified = True
+
+    def finish_scan(self, subdir):
+        """Drop the entries of files below ``subdir`` that were not seen
+        during the scan, and save the cache if it was modified."""
+        prefix = os.path.join(subdir, "") if subdir else ""
+        for filename in list(self.entries.keys()):
+            if filename.startswith(prefix) and filename not in self._seen:
+                del self.entries[filename]
+                self._modified = True
+        if self._modified and self.persist_file is not None:
+            try:
+                pyon.store_file(self.persist_file, {
+                    "version": self.version,
+                    "entries": self.entries
+                })
+            except OSError:
+                logger.warning("failed to save repository scan cache",
+                               exc_info=True)
+            else:
+                self._modified = False
+
+
 class _RepoScanner:
-    def __init__(self, worker_handlers):
+    def __init__(self, worker_handlers, cache=None, workers=1):
         self.worker_handlers = worker_handlers
-        self.worker = None
+        if cache is None:
+            cache = _ScanCache()
+        self.cache = cache
+        self.workers = workers
+
+    def _list_files(self, root, subdir, files):
+        # Returns the directory tree below subdir, as a list of file names
+        # and (directory name, subtree) pairs, and appends the file names
+        # to files.
+        tree = []
+        for de in os.scandir(os.path.join(root, subdir)):
+            if de.name.startswith("."):
+                continue
+            if de.is_file() and de.name.endswith(".py"):
+                filename = os.path.join(subdir, de.name)
+                tree.append(filename)
+                files.append(filename)
+            if de.is_dir():
+                tree.append((de.name, self._list_files(
+                    root, os.path.join(subdir, de.name), files)))
+        return tree
+
+    def _hash_files(self, root):
+        # Returns the hashes of all Python files of the repository, which
+        # experiment files may import, by file name.
+        file_hashes = dict()
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if name.startswith(".") or not name.endswith(".py"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    file_hashes[os.path.relpath(path, root)] = \
+                        self.cache.hash_file(path)
+                except OSError:
+                    logger.warning("Skipping file '%s'", path, exc_info=True)
+        return file_hashes
 
-    async def process_file(self, entry_dict, root, filename):
-        logger.debug("processing file %s %s", root, filename)
+    async def _examine_files(self, root, queue, descriptions):
+        worker = Worker(self.worker_handlers)
         try:
-            description = await self.worker.examine(
-                "scan", os.path.join(root, filename))
-        except:
-            log_worker_exception()
-            raise
+            while not queue.empty():
+                filename, file_hash = queue.get_nowait()
+                logger.debug("processing file %s %s", root, filename)
+                try:
+                    try:
+                        description = await worker.examine(
+                            "scan", os.path.join(root, filename))
+                    except:
+                        log_worker_exception()
+                        raise
+                except Exception as exc:
+                    logger.warning("Skipping file '%s'", filename,
+                        exc_info=not isinstance(exc, WorkerInternalException))
+                    # restart worker
+                    await worker.close()
+                    worker = Worker(self.worker_handlers)
+                else:
+                    self.cache.put(filename, file_hash, description)
+                    descriptions[filename] = description
+        finally:
+            await worker.close()
+
+    def _add_entries(self, entry_dict, filename, description):
         for class_name, class_desc in description.items():
             name = class_desc["name"]
             if "/" in name:
@@ -52,42 +196,61 @@ class _RepoScanner:
             }
             entry_dict[name] = entry
 
-    async def _scan(self, root, subdir=""):
+    def _build_entries(self, tree, descriptions):
         entry_dict = dict()
-        for de in os.scandir(os.path.join(root, subdir)):
-            if de.name.startswith("."):
-                continue
-            if de.is_file() and de.name.endswith(".py"):
-                filename = os.path.join(subdir, de.name)
-                try:
-                    await self.process_file(entry_dict, root, filename)
-                except Exception as exc:
-                    logger.warning("Skipping file '%s'", filename,
-                        exc_info=not isinstance(exc, WorkerInternalException))
-                    # restart worker
-                    await self.worker.close()
-                    self.worker = Worker(self.worker_handlers)
-            if de.is_dir():
-                subentries = await self._scan(
-                    root, os.path.join(subdir, de.name))
-                entries = {de.name + "/" + k: v for k, v in subentries.items()}
+        for item in tree:
+            if isinstance(item, tuple):
+                dirname, subtree = item
+                subentries = self._build_entries(subtree, descriptions)
+                entries = {dirname + "/" + k: v for k, v in subentries.items()}
                 entry_dict.update(entries)
+            elif item in descriptions:
+                self._add_entries(entry_dict, item, descriptions[item])
         return entry_dict
 
     async def scan(self, root, subdir=""):
-        self.worker = Worker(self.worker_handlers)
-        try:
-            r = await self._scan(root, subdir)
-        finally:
-            await self.worker.close()
-        return r
+        files = []
+        tree = self._list_files(root, subdir, files)
+        file_hashes = self._hash_files(root)
+
+        get_device_db = self.worker_handlers.get("get_device_db")
+        self.cache.start_scan(
+            None if get_device_db is None
+            else self.cache.hash_device_db(get_device_db()),
+            self.cache.hash_repository(file_hashes))
+
+        descriptions = dict()
+        queue = asyncio.Queue()
+        for filename in files:
+            file_hash = file_hashes.get(os.path.normpath(filename))
+            if file_hash is None:
+                continue
+            description = self.cache.get(filename, file_hash)
+            if description is None:
+                queue.put_nowait((filename, file_hash))
+            else:
+                descriptions[filename] = description
+
+        # Experiment files are examined concurrently, but entries are
+        # added in directory order so that duplicate names are renamed
+        # deterministically.
+        workers = min(self.workers, queue.qsize())
+        if workers:
+            await asyncio.gather(*[
+                self._examine_files(root, queue, descriptions)
+                for _ in range(workers)])
+        self.cache.finish_scan(subdir)
+        return self._build_entries(tree, descriptions)
 
 
 class ExperimentDB:
-    def __init__(self, repo_backend, worker_handlers, experiment_subdir=""):
+    def __init__(self, repo_backend, worker_handlers, experiment_subdir="",
+                 scan_cache_file=None, scan_workers=1):
         self.repo_backend = repo_backend
         self.worker_handlers = worker_handlers
         self.experiment_subdir = experiment_subdir
+        self.scan_cache = _ScanCache(scan_cache_file)
+        self.scan_workers = scan_workers
 
         self.cur_rev = self.repo_backend.get_head_rev()
         self.repo_backend.request_rev(self.cur_rev)
@@ -116,9 +279,13 @@ class ExperimentDB:
             self.cur_rev = new_cur_rev
             self.status["cur_rev"] = new_cur_rev
             t1 = time.monotonic()
-            new_explist = await _RepoScanner(self.worker_handlers).scan(
-                wd, self.experiment_subdir)
-            logger.info("repository scan took %d seconds", time.monotonic()-t1)
+            new_explist = await _RepoScanner(
+                self.worker_handlers, self.scan_cache,
+                self.scan_workers).scan(wd, self.experiment_subdir)
+            logger.info("repository scan took %d seconds "
+                        "(%d files cached, %d examined)",
+                        time.monotonic()-t1,
+                        self.scan_cache.hits, self.scan_cache.misses)
             update_from_dict(self.explist, new_explist)
         finally:
             self._scanning = False
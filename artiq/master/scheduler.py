@@ -1,7 +1,9 @@
 import asyncio
+import heapq
 import logging
 import csv
 import os.path
+from collections import deque
 from enum import Enum
 from time import time
 
@@ -47,6 +49,187 @@ def _mk_worker_method(name):
     return worker_method
 
 
+class WorkerPool:
+    """Worker processes started in advance and handed out to runs when they
+    are built, so that runs do not wait for the Python interpreter to start
+    and import ARTIQ.
+
+    :param size: number of idle workers kept ready. If zero, workers are
+        created by each run.
+    :param max_runs: number of runs after which a worker process is ended.
+        Workers are also ended when their run fails or is deleted. Reused
+        workers keep the modules imported by previous experiments.
+    """
+    def __init__(self, worker_handlers, size=0, max_runs=1):
+        self.worker_handlers = worker_handlers
+        self.size = size
+        self.max_runs = max_runs
+
+        self._idle = []
+        self._starting = set()
+        self._run_counts = dict()
+        self._loop = None
+        self._closed = False
+        self.stats = {
+            "handed_out": 0,
+            "reused": 0,
+            "missed": 0,
+            "startup_time_saved": 0.0
+        }
+
+    def _fill(self):
+        while not self._closed and \
+                len(self._idle) + len(self._starting) < self.size:
+            worker = Worker(self.worker_handlers)
+            self._starting.add(worker)
+            asyncio.ensure_future(self._start(worker), loop=self._loop)
+
+    async def _start(self, worker):
+        try:
+            await worker.start()
+        except:
+            if not self._closed:
+                logger.warning("failed to start worker in advance",
+                               exc_info=True)
+            await worker.close()
+        else:
+            if self._closed:
+                await worker.close()
+            else:
+                self._run_counts[worker] = 0
+                self._idle.append(worker)
+        finally:
+            self._starting.discard(worker)
+
+    def start(self, *, loop=None):
+        self._loop = loop
+        self._fill()
+
+    def take(self):
+        """Returns an idle started worker, or ``None`` if there is none."""
+        worker = None
+        while self._idle:
+            candidate = self._idle.pop(0)
+            if candidate.ipc.process.returncode is None:
+                worker = candidate
+                break
+            self._run_counts.pop(candidate)
+            asyncio.ensure_future(candidate.close())
+        if worker is None:
+            if self.size:
+                self.stats["missed"] += 1
+        else:
+            self.stats["handed_out"] += 1
+            if self._run_counts[worker]:
+                self.stats["reused"] += 1
+            self.stats["startup_time_saved"] += worker.startup_time
+            logger.debug("using worker started in advance, "
+                         "saving %.3f s", worker.startup_time)
+        self._fill()
+        return worker
+
+    async def release(self, worker, reusable):
+        """Returns a worker at the end of a run, which is closed unless
+        ``reusable`` is true and it is kept for another run."""
+        run_count = self._run_counts.pop(worker, None)
+        if (reusable and not self._closed
+                and run_count is not None and run_count + 1 < self.max_runs
+                and worker.ipc.process.returncode is None):
+            self._run_counts[worker] = run_count + 1
+            self._idle.append(worker)
+        else:
+            await worker.close()
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        self._run_counts.clear()
+        for worker in idle:
+            await worker.close()
+        for worker in list(self._starting):
+            await worker.close()
+
+
+class _RunQueue:
+    """Heap of the runs with a given status, ordered by ``key``.
+
+    Runs that change status are not removed from the heap, but skipped when
+    they reach its top.
+    """
+    def __init__(self, status, key):
+        self.status = status
+        self._key = key
+        self._heap = []
+        self._compact_size = 64
+
+    def _valid(self, entry):
+        _, serial, run = entry
+        return run.status == self.status and run.status_serial == serial
+
+    def push(self, run):
+        heapq.heappush(self._heap, (self._key(run), run.status_serial, run))
+        if len(self._heap) > self._compact_size:
+            self._heap = [entry for entry in self._heap if self._valid(entry)]
+            heapq.heapify(self._heap)
+            self._compact_size = 2*len(self._heap) + 64
+
+    def _top(self):
+        while self._heap and not self._valid(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def peek(self):
+        entry = self._top()
+        return None if entry is None else entry[2]
+
+    def peek_key(self):
+        entry = self._top()
+        return None if entry is None else entry[0]
+
+    def runs(self):
+        """Iterate over the runs of the heap, in no particular order."""
+        return (entry[2] for entry in self._heap if self._valid(entry))
+
+    def pop(self):
+        entry = self._top()
+        if entry is None:
+            return None
+        heapq.heappop(self._heap)
+        return entry[2]
+
+
+def _priority_order(run):
+    # heapq is a min-heap, and the highest priority key comes first
+    priority, due_date, rid = run.priority_key()
+    return -priority, -due_date, -rid
+
+
+def _due_date_order(run):
+    return run.due_date or 0, run.rid
+
+
+# Statuses that runs go through in this order, some of them optionally.
+# The time spent in "paused" is counted in "running".
+_timed_statuses = ["pending", "flushing", "preparing", "prepare_done",
+                   "running", "run_done", "analyzing", "deleting"]
+
+
+def _summarize(values):
+    values = sorted(values)
+    n = len(values)
+
+    def percentile(p):
+        return values[min(n - 1, n*p//100)]
+    return {
+        "count": n,
+        "mean": sum(values)/n,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": values[-1]
+    }
+
+
 class Run:
     def __init__(self, rid, pipeline_name,
                  wd, expid, priority, due_date, flush,
@@ -61,9 +244,16 @@ class Run:
         self.flush = flush
 
         self.worker = Worker(pool.worker_handlers)
-        self.termination_requested = False
+        self._worker_pool = pool.worker_pool
+        self._termination_requested = False
+        self.analyzed = False
 
         self._status = RunStatus.pending
+        # status name -> time the run first entered it
+        self.timestamps = {self._status.name: time()}
+        self.status_serial = 0
+        self._status_changed = pool.run_status_changed
+        self._pause_state_changed = pool.update_pause_flags
 
         notification = {
             "pipeline": self.pipeline_name,
@@ -71,7 +261,8 @@ class Run:
             "priority": self.priority,
             "due_date": self.due_date,
             "flush": self.flush,
-            "status": self._status.name
+            "status": self._status.name,
+            "timestamps": dict(self.timestamps)
         }
         notification.update(kwargs)
         self._notifier = pool.notifier
@@ -85,10 +276,27 @@ class Run:
     @status.setter
     def status(self, value):
         self._status = value
+        self.status_serial += 1
+        self._status_changed(self)
+        first = value.name not in self.timestamps
+        if first:
+            self.timestamps[value.name] = time()
         if not self.worker.closed.is_set():
             self._notifier[self.rid]["status"] = self._status.name
+            if first:
+                self._notifier[self.rid]["timestamps"][value.name] = \
+                    self.timestamps[value.name]
         self._state_changed.notify()
 
+    @property
+    def termination_requested(self):
+        return self._termination_requested
+
+    @termination_requested.setter
+    def termination_requested(self, value):
+        self._termination_requested = value
+        self._pause_state_changed()
+
     def priority_key(self):
         """Return a comparable value that defines a run priority order.
 
@@ -96,14 +304,31 @@ class Run:
         """
         return (self.priority, -(self.due_date or 0), -self.rid)
 
+    def get_timings(self):
+        """Returns the time spent in each status, and in each part of the
+        execution by the worker, in seconds."""
+        timings = dict(self.worker.timings)
+        statuses = [s for s in _timed_statuses if s in self.timestamps]
+        for status, next_status in zip(statuses, statuses[1:]):
+            timings[status] = (self.timestamps[next_status]
+                               - self.timestamps[status])
+        return timings
+
     async def close(self):
         # called through pool
-        await self.worker.close()
+        if self._worker_pool is None:
+            await self.worker.close()
+        else:
+            await self._worker_pool.release(self.worker, self.analyzed)
         del self._notifier[self.rid]
 
     _build = _mk_worker_method("build")
 
     async def build(self):
+        if self._worker_pool is not None and not self.worker.closed.is_set():
+            worker = self._worker_pool.take()
+            if worker is not None:
+                self.worker = worker
         await self._build(self.rid, self.pipeline_name,
                           self.wd, self.expid,
                           self.priority)
@@ -115,12 +340,25 @@ class Run:
 
 
 class RunPool:
-    def __init__(self, ridc, worker_handlers, notifier, experiment_db, log_submissions):
+    def __init__(self, ridc, worker_handlers, notifier, experiment_db, log_submissions,
+                 worker_pool=None, run_timings=None):
         self.runs = dict()
         self.state_changed = Condition()
 
+        # Pending runs wait in _due_runs until their due date has elapsed,
+        # then move to _runnable_runs.
+        self._due_runs = _RunQueue(RunStatus.pending, _due_date_order)
+        self._runnable_runs = _RunQueue(RunStatus.pending, _priority_order)
+        self.prepared_runs = _RunQueue(RunStatus.prepare_done, _priority_order)
+        self.run_done_runs = _RunQueue(RunStatus.run_done, _priority_order)
+        # running and paused runs, whose workers are kept informed of
+        # whether they should pause
+        self._active_runs = set()
+
         self.ridc = ridc
         self.worker_handlers = worker_handlers
+        self.worker_pool = worker_pool
+        self.run_timings = run_timings
         self.notifier = notifier
         self.experiment_db = experiment_db
         self.log_submissions = log_submissions
@@ -151,14 +389,67 @@ class RunPool:
         if self.log_submissions is not None:          
             self.log_submission(rid, expid)
         self.runs[rid] = run
+        self._due_runs.push(run)
         self.state_changed.notify()
         return rid
 
+    def run_status_changed(self, run):
+        # called through Run.status
+        if run.status == RunStatus.pending:
+            self._due_runs.push(run)
+        elif run.status == RunStatus.prepare_done:
+            self.prepared_runs.push(run)
+        elif run.status == RunStatus.run_done:
+            self.run_done_runs.push(run)
+        if run.status in (RunStatus.running, RunStatus.paused):
+            self._active_runs.add(run)
+        else:
+            self._active_runs.discard(run)
+        self.update_pause_flags()
+
+    def update_pause_flags(self):
+        """Pushes the current results of ``check_pause`` and
+        ``check_termination`` for the running and paused runs to their
+        workers."""
+        if not self._active_runs:
+            return
+        prepared = self.prepared_runs.peek()
+        for run in self._active_runs:
+            pause = run.status == RunStatus.running and (
+                run.termination_requested
+                or (prepared is not None
+                    and prepared.priority_key() > run.priority_key()))
+            run.worker.set_pause_flags(pause, run.termination_requested)
+
+    def get_pending(self, now, prepared=None):
+        """Returns the pending run of highest priority whose due date has
+        elapsed (or ``None``), and the earliest due date of the other
+        pending runs that take precedence over the run ``prepared``, if
+        any (or ``None``)."""
+        while True:
+            key = self._due_runs.peek_key()
+            if key is None or not key[0] < now:
+                break
+            self._runnable_runs.push(self._due_runs.pop())
+
+        if key is None:
+            due_date = None
+        elif (prepared is None or
+                self._due_runs.peek().priority_key() > prepared.priority_key()):
+            due_date = key[0]
+        else:
+            due_date = min((r.due_date for r in self._due_runs.runs()
+                            if r.priority_key() > prepared.priority_key()),
+                           default=None)
+        return self._runnable_runs.peek(), due_date
+
     async def delete(self, rid):
         # called through deleter
         if rid not in self.runs:
             return
         run = self.runs[rid]
+        if run.analyzed and self.run_timings is not None:
+            self.run_timings.append(run.get_timings())
         await run.close()
         if "repo_rev" in run.expid:
             self.experiment_db.repo_backend.release_rev(run.expid["repo_rev"])
@@ -179,29 +470,18 @@ class PrepareStage(TaskObject):
         of them are going to become next-in-line before further pool state
         changes (which will also cause a re-evaluation).
         """
-        pending_runs = list(
-            filter(lambda r: r.status == RunStatus.pending,
-                   self.pool.runs.values()))
-
         now = time()
-        def is_runnable(r):
-            return (r.due_date or 0) < now
-
-        prepared_max = max((r.priority_key() for r in self.pool.runs.values()
-                            if r.status == RunStatus.prepare_done),
-                           default=None)
-        def takes_precedence(r):
-            return prepared_max is None or r.priority_key() > prepared_max
+        prepared = self.pool.prepared_runs.peek()
+        candidate, due_date = self.pool.get_pending(now, prepared)
 
-        candidate = max(filter(is_runnable, pending_runs),
-                        key=lambda r: r.priority_key(),
-                        default=None)
-        if candidate is not None and takes_precedence(candidate):
+        if candidate is not None and (
+                prepared is None
+                or candidate.priority_key() > prepared.priority_key()):
             return candidate
 
-        return min((r.due_date - now for r in pending_runs
-                    if (not is_runnable(r) and takes_precedence(r))),
-                   default=None)
+        if due_date is None:
+            return None
+        return due_date - now
 
     async def _do(self):
         while True:
@@ -246,14 +526,7 @@ class RunStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            r = max(prepared_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # prepared_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.prepared_runs.peek()
 
     async def _do(self):
         stack = []
@@ -271,12 +544,12 @@ class RunStage(TaskObject):
             run = stack.pop()
             try:
                 if run.status == RunStatus.paused:
-                    run.status = RunStatus.running
                     # clear "termination requested" flag now
                     # so that if it is set again during the resume, this
                     # results in another exception.
                     request_termination = run.termination_requested
                     run.termination_requested = False
+                    run.status = RunStatus.running
                     completed = await run.resume(request_termination)
                 else:
                     run.status = RunStatus.running
@@ -300,14 +573,7 @@ class AnalyzeStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        run_runs = filter(lambda r: r.status == RunStatus.run_done,
-                          self.pool.runs.values())
-        try:
-            r = max(run_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # run_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.run_done_runs.peek()
 
     async def _do(self):
         while True:
@@ -322,12 +588,16 @@ class AnalyzeStage(TaskObject):
                 logger.error("got worker exception in analyze stage of RID %d.",
                              run.rid)
                 log_worker_exception()
+            else:
+                run.analyzed = True
             self.delete_cb(run.rid)
 
 
 class Pipeline:
-    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db, log_submissions):
-        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db, log_submissions)
+    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db, log_submissions,
+                 worker_pool=None, run_timings=None):
+        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db, log_submissions,
+                            worker_pool, run_timings)
         self._prepare = PrepareStage(self.pool, deleter.delete)
         self._run = RunStage(self.pool, deleter.delete)
         self._analyze = AnalyzeStage(self.pool, deleter.delete)
@@ -384,8 +654,10 @@ class Deleter(TaskObject):
         for name in pipeline_names:
             if not self._pipelines[name].pool.runs:
                 logger.debug("garbage-collecting pipeline '%s'...", name)
-                await self._pipelines[name].stop()
-                del self._pipelines[name]
+                # Remove the pipeline first, so that runs submitted while
+                # it stops go to a new pipeline.
+                pipeline = self._pipelines.pop(name)
+                await pipeline.stop()
                 logger.debug("garbage-collection of pipeline '%s' completed",
                              name)
 
@@ -398,8 +670,12 @@ class Deleter(TaskObject):
 
 
 class Scheduler:
-    def __init__(self, ridc, worker_handlers, experiment_db, log_submissions):
+    def __init__(self, ridc, worker_handlers, experiment_db, log_submissions,
+                 worker_pool_size=0, worker_max_runs=1, run_stats_history=1000):
         self.notifier = Notifier(dict())
+        self._worker_pool = WorkerPool(worker_handlers, worker_pool_size,
+                                       worker_max_runs)
+        self._run_timings = deque(maxlen=run_stats_history)
 
         self._pipelines = dict()
         self._worker_handlers = worker_handlers
@@ -413,6 +689,7 @@ class Scheduler:
     def start(self, *, loop=None):
         self._loop = loop
         self._deleter.start(loop=self._loop)
+        self._worker_pool.start(loop=self._loop)
 
     async def stop(self):
         # NB: restart of a stopped scheduler is not supported
@@ -422,6 +699,7 @@ class Scheduler:
                 self._deleter.delete(rid)
         await self._deleter.join()
         await self._deleter.stop()
+        await self._worker_pool.close()
         if self._pipelines:
             logger.warning("some pipelines were not garbage-collected")
 
@@ -441,7 +719,8 @@ class Scheduler:
             logger.debug("creating pipeline '%s'", pipeline_name)
             pipeline = Pipeline(self._ridc, self._deleter,
                                 self._worker_handlers, self.notifier,
-                                self._experiment_db, self._log_submissions)
+                                self._experiment_db, self._log_submissions,
+                                self._worker_pool, self._run_timings)
             self._pipelines[pipeline_name] = pipeline
             pipeline.start(loop=self._loop)
         return pipeline.pool.submit(expid, priority, due_date, flush, pipeline_name)
@@ -461,6 +740,37 @@ class Scheduler:
                     self.delete(rid)
                 break
 
+    def get_worker_pool_stats(self):
+        """Returns the number of runs that were given a worker started in
+        advance (``handed_out``, of which ``reused`` had already served
+        other runs) or had to start their own because the pool was empty
+        (``missed``), and the total start-up time of the workers handed out
+        (``startup_time_saved``, in seconds)."""
+        return self._worker_pool.stats
+
+    def get_run_stats(self):
+        """Returns statistics of the durations of the last successful runs,
+        in seconds.
+
+        The statistics are given for the time spent in each status
+        (``pending``, ``flushing``, ``preparing``, ``prepare_done``,
+        ``running`` including pauses, ``run_done`` and ``analyzing``), and
+        for the parts of the execution by the worker: start-up of the worker
+        process (``spawn``, only for runs that did not get a worker started
+        in advance), ``build``, ``prepare``, ``run`` and ``analyze`` actions,
+        writing of the results file (``write_results``), and waiting for
+        replies of the master to requests of the experiment (``ipc``).
+
+        Each of them is a dictionary with the number of runs (``count``),
+        and the ``mean``, ``p50``, ``p90``, ``p99`` percentiles and ``max``
+        of the durations."""
+        durations = dict()
+        for timings in self._run_timings:
+            for name, duration in timings.items():
+                durations.setdefault(name, []).append(duration)
+        return {name: _summarize(values)
+                for name, values in durations.items()}
+
     def get_status(self):
         """Returns a dictionary containing information about the runs currently
         tracked by the scheduler.
@@ -488,12 +798,8 @@ class Scheduler:
                 if run.termination_requested:
                     return True
 
-                prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                                       pipeline.pool.runs.values())
-                try:
-                    r = max(prepared_runs, key=lambda r: r.priority_key())
-                except ValueError:
-                    # prepared_runs is an empty sequence
+                r = pipeline.pool.prepared_runs.peek()
+                if r is None:
                     return False
                 return r.priority_key() > run.priority_key()
         raise KeyError("RID not found")
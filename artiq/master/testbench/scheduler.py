@@ -0,0 +1,243 @@
+"""Measures how many runs per second a master moves through the scheduler,
+and where the time goes.
+
+Starts a master with local workers in a temporary directory, submits runs of
+an experiment that does nothing, and reports the end-to-end latency of the
+runs along with the statistics of ``scheduler.get_run_stats()``. Before
+starting the master, it measures in-process the cost of submitting runs, of
+selecting the next run to prepare and of ``check_pause`` with a large backlog
+of runs that are not due yet.
+
+Example: ``python -m artiq.master.testbench.scheduler -n 200 -- --worker-pool-size 4``
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from artiq.master.scheduler import Scheduler, RunStatus
+
+from sipyco.pc_rpc import AsyncioClient
+from sipyco.sync_struct import Subscriber
+
+
+_noop_experiment = """
+from artiq.experiment import *
+
+
+class NoOp(EnvExperiment):
+    def build(self):
+        pass
+
+    def run(self):
+        pass
+"""
+
+# rows of the report, in order
+_stages = [
+    "pending", "flushing", "preparing", "prepare_done", "running",
+    "run_done", "analyzing",
+    "spawn", "build", "prepare", "run", "analyze", "write_results", "ipc"
+]
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(
+        description="ARTIQ scheduler benchmark")
+    parser.add_argument("-n", "--runs", default=100, type=int,
+                        help="number of runs to submit (default: %(default)d)")
+    parser.add_argument("-p", "--pipelines", default=1, type=int,
+                        help="number of pipelines the runs are distributed "
+                             "over (default: %(default)d)")
+    parser.add_argument("-b", "--backlog", default=10000, type=int,
+                        help="number of queued runs for the in-process "
+                             "measurements, 0 to skip them "
+                             "(default: %(default)d)")
+    parser.add_argument("--port-base", default=13250, type=int,
+                        help="first of the four consecutive ports used by "
+                             "the master (default: %(default)d)")
+    parser.add_argument("--timeout", default=600.0, type=float,
+                        help="maximum duration of the benchmark in seconds "
+                             "(default: %(default).0f)")
+    parser.add_argument("master_args", nargs=argparse.REMAINDER,
+                        help="additional arguments for artiq_master, "
+                             "after '--'")
+    return parser
+
+
+def _print_row(name, count, values):
+    print("{:<16} {:>6} ".format(name, count) +
+          " ".join("{:>9.2f}".format(v*1e3) for v in values))
+
+
+class _RIDCounter:
+    def __init__(self):
+        self._next_rid = 0
+
+    def get(self):
+        rid = self._next_rid
+        self._next_rid += 1
+        return rid
+
+
+def _benchmark_backlog(count, experiment_file, repeats=1000):
+    loop = asyncio.new_event_loop()
+    try:
+        scheduler = Scheduler(_RIDCounter(), dict(), None, None)
+        scheduler.start(loop=loop)
+        expid = {
+            "log_level": logging.WARNING,
+            "file": experiment_file,
+            "class_name": "NoOp",
+            "arguments": dict()
+        }
+
+        late = time.time() + 100000
+        t0 = time.monotonic()
+        for i in range(count):
+            scheduler.submit("main", expid, i % 10, late + i, False)
+        t_submit = time.monotonic() - t0
+
+        pool = scheduler._pipelines["main"].pool
+        prepare = scheduler._pipelines["main"]._prepare
+        pool.runs[0].status = RunStatus.running
+        pool.runs[1].status = RunStatus.prepare_done
+        t0 = time.monotonic()
+        for i in range(repeats):
+            prepare._get_run()
+        t_get_run = time.monotonic() - t0
+
+        t0 = time.monotonic()
+        for i in range(repeats):
+            scheduler.check_pause(0)
+        t_check_pause = time.monotonic() - t0
+
+        # keep the stages from picking up runs that have no worker
+        pool.runs[0].status = RunStatus.pending
+        pool.runs[1].status = RunStatus.pending
+        loop.run_until_complete(scheduler.stop())
+    finally:
+        loop.close()
+
+    print("With {} queued runs:".format(count))
+    for name, value in [("submission (per run)", t_submit/count),
+                        ("prepare stage selection", t_get_run/repeats),
+                        ("check_pause", t_check_pause/repeats)]:
+        print("  {:<24} {:>9.2f} us".format(name, value*1e6))
+    print()
+
+
+async def _connect(port, target, timeout=30.0):
+    t0 = time.monotonic()
+    while True:
+        client = AsyncioClient()
+        try:
+            await client.connect_rpc("127.0.0.1", port, target)
+            return client
+        except OSError:
+            if time.monotonic() - t0 > timeout:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def _benchmark(args, experiment_file):
+    port_notify = args.port_base
+    port_control = args.port_base + 1
+
+    schedule = await _connect(port_control, "master_schedule")
+    try:
+        submitted = dict()  # RID -> submission timestamp
+        latencies = []
+        done = asyncio.Event()
+
+        def notify(mod):
+            if mod["action"] == "setitem" and mod["path"] == []:
+                submitted[mod["key"]] = mod["value"]["timestamps"]["pending"]
+            elif mod["action"] == "delitem" and mod["key"] in submitted:
+                latencies.append(time.time() - submitted[mod["key"]])
+                if len(latencies) == args.runs:
+                    done.set()
+        subscriber = Subscriber("schedule", lambda x: x, notify)
+        await subscriber.connect("127.0.0.1", port_notify)
+        try:
+            expid = {
+                "log_level": logging.WARNING,
+                "file": experiment_file,
+                "class_name": "NoOp",
+                "arguments": dict()
+            }
+            t0 = time.monotonic()
+            for i in range(args.runs):
+                await schedule.submit("bench{}".format(i % args.pipelines),
+                                      expid, 0, None, False)
+            t_submit = time.monotonic() - t0
+            await asyncio.wait_for(done.wait(), args.timeout)
+            t_total = time.monotonic() - t0
+        finally:
+            await subscriber.close()
+        stats = await schedule.get_run_stats()
+    finally:
+        schedule.close_rpc()
+
+    print("{} runs in {:.2f} s: {:.1f} runs/s (submission: {:.2f} ms/run)"
+          .format(args.runs, t_total, args.runs/t_total,
+                  t_submit/args.runs*1e3))
+    print()
+    print("{:<16} {:>6} ".format("stage (ms)", "count") +
+          " ".join("{:>9}".format(c)
+                   for c in ("mean", "p50", "p90", "p99", "max")))
+    _print_row("end-to-end", len(latencies),
+               [np.mean(latencies)] +
+               list(np.percentile(latencies, [50, 90, 99])) +
+               [np.max(latencies)])
+    for name in _stages:
+        if name in stats:
+            s = stats[name]
+            _print_row(name, s["count"],
+                       [s["mean"], s["p50"], s["p90"], s["p99"], s["max"]])
+
+
+def main():
+    args = get_argparser().parse_args()
+    master_args = args.master_args
+    if master_args[:1] == ["--"]:
+        master_args = master_args[1:]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "device_db.py"), "w") as f:
+            f.write("device_db = {}\n")
+        os.mkdir(os.path.join(tmpdir, "repository"))
+        experiment_file = os.path.join(tmpdir, "noop.py")
+        with open(experiment_file, "w") as f:
+            f.write(_noop_experiment)
+
+        if args.backlog > 0:
+            _benchmark_backlog(args.backlog, experiment_file)
+
+        master = subprocess.Popen(
+            [sys.executable, "-m", "artiq.frontend.artiq_master",
+             "--port-notify", str(args.port_base),
+             "--port-control", str(args.port_base + 1),
+             "--port-logging", str(args.port_base + 2),
+             "--port-broadcast", str(args.port_base + 3)] + master_args,
+            cwd=tmpdir)
+        try:
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(_benchmark(args, experiment_file))
+            finally:
+                loop.close()
+        finally:
+            master.terminate()
+            master.wait()
+
+
+if __name__ == "__main__":
+    main()
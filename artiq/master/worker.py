@@ -4,12 +4,14 @@ import asyncio
 import logging
 import subprocess
 import time
+from multiprocessing import shared_memory
 
 from sipyco import pipe_ipc, pyon
 from sipyco.logging_tools import LogParser
 from sipyco.packed_exceptions import current_exc_packed
 
 from artiq.tools import asyncio_wait_or_cancel
+from artiq.master import worker_ipc
 
 
 logger = logging.getLogger(__name__)
@@ -41,15 +43,28 @@ def log_worker_exception():
         logger.error("worker exception details", exc_info=True)
 
 
+# Layout of the shared memory block through which the master pushes the
+# results of check_pause() and check_termination() for the current run.
+PAUSE_FLAG = 0
+TERMINATION_FLAG = 1
+_PAUSE_FLAGS_SIZE = 2
+
+
 class Worker:
-    def __init__(self, handlers=dict(), send_timeout=10.0):
+    def __init__(self, handlers=dict(), send_timeout=10.0,
+                 framing=worker_ipc.BINARY):
         self.handlers = handlers
         self.send_timeout = send_timeout
+        self.framing = framing
 
         self.rid = None
         self.filename = None
         self.ipc = None
+        self.startup_time = None
+        # action or part of the current run -> duration in seconds
+        self.timings = dict()
         self.watchdogs = dict()  # wid -> expiration (using time.monotonic)
+        self._pause_flags = None
 
         self.io_lock = asyncio.Lock()
         self.closed = asyncio.Event()
@@ -73,10 +88,33 @@ class Worker:
         else:
             return None
 
+    def set_pause_flags(self, pause, termination):
+        """Publishes to the worker process whether the current run should
+        pause and whether its termination has been requested, so that it can
+        answer ``check_pause`` and ``check_termination`` locally."""
+        if self.closed.is_set():
+            return
+        if self._pause_flags is None:
+            self._pause_flags = shared_memory.SharedMemory(
+                create=True, size=_PAUSE_FLAGS_SIZE)
+        buf = self._pause_flags.buf
+        buf[PAUSE_FLAG] = pause
+        buf[TERMINATION_FLAG] = termination
+
+    def _close_pause_flags(self):
+        if self._pause_flags is not None:
+            self._pause_flags.close()
+            self._pause_flags.unlink()
+            self._pause_flags = None
+
+    def _add_timings(self, timings):
+        for name, duration in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + duration
+
     def _get_log_source(self):
         return "worker({},{})".format(self.rid, self.filename if self.filename is not None else "<none>")
 
-    async def _create_process(self, log_level):
+    async def _create_process(self, log_level, announce_ready=False):
         if self.ipc is not None:
             return  # process already exists, recycle
         await self.io_lock.acquire()
@@ -86,9 +124,11 @@ class Worker:
             self.ipc = pipe_ipc.AsyncioParentComm()
             env = os.environ.copy()
             env["PYTHONUNBUFFERED"] = "1"
+            args = [self.ipc.get_address(), str(log_level), self.framing]
+            if announce_ready:
+                args.append("ready")
             await self.ipc.create_subprocess(
-                sys.executable, "-m", "artiq.master.worker_impl",
-                self.ipc.get_address(), str(log_level),
+                sys.executable, "-m", "artiq.master.worker_impl", *args,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                 env=env, start_new_session=True)
             asyncio.ensure_future(
@@ -100,6 +140,23 @@ class Worker:
         finally:
             self.io_lock.release()
 
+    async def start(self, timeout=30.0, log_level=logging.WARNING):
+        """Creates the worker process in advance, and waits until it has
+        imported its modules and is ready to build an experiment.
+
+        The time this took is stored in ``startup_time``."""
+        t0 = time.monotonic()
+        await self._create_process(log_level, announce_ready=True)
+        await self.io_lock.acquire()
+        try:
+            obj = await self._recv(timeout)
+        finally:
+            self.io_lock.release()
+        if obj.get("action") != "ready":
+            raise WorkerError("Worker sent unexpected data during start-up")
+        self.startup_time = time.monotonic() - t0
+        self.timings["spawn"] = self.startup_time
+
     async def close(self, term_timeout=2.0):
         """Interrupts any I/O with the worker process and terminates the
         worker process.
@@ -109,6 +166,7 @@ class Worker:
         self.closed.set()
         await self.io_lock.acquire()
         try:
+            self._close_pause_flags()
             if self.ipc is None:
                 # Note the %s - self.rid can be None or a user string
                 logger.debug("worker was not created (RID %s)", self.rid)
@@ -157,8 +215,8 @@ class Worker:
 
     async def _send(self, obj, cancellable=True):
         assert self.io_lock.locked()
-        line = pyon.encode(obj)
-        self.ipc.write((line + "\n").encode())
+        for data in worker_ipc.encode_message(obj, self.framing):
+            self.ipc.write(data)
         ifs = [self.ipc.drain()]
         if cancellable:
             ifs.append(self.closed.wait())
@@ -178,8 +236,12 @@ class Worker:
 
     async def _recv(self, timeout):
         assert self.io_lock.locked()
+        if self.framing == worker_ipc.TEXT:
+            read = self.ipc.readline()
+        else:
+            read = worker_ipc.read_message_async(self.ipc.read)
         fs = await asyncio_wait_or_cancel(
-            [self.ipc.readline(), self.closed.wait()],
+            [read, self.closed.wait()],
             timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
         if all(f.cancelled() for f in fs):
             raise WorkerTimeout(
@@ -188,16 +250,27 @@ class Worker:
             raise WorkerError(
                 "Receiving data from worker cancelled (RID {})".format(
                     self.rid))
-        line = fs[0].result()
-        if not line:
-            raise WorkerError(
-                "Worker ended while attempting to receive data (RID {})".
-                format(self.rid))
-        try:
-            obj = pyon.decode(line.decode())
-        except:
-            raise WorkerError("Worker sent invalid PYON data (RID {})".format(
-                self.rid))
+        if self.framing == worker_ipc.TEXT:
+            line = fs[0].result()
+            if not line:
+                raise WorkerError(
+                    "Worker ended while attempting to receive data (RID {})".
+                    format(self.rid))
+            try:
+                obj = pyon.decode(line.decode())
+            except:
+                raise WorkerError("Worker sent invalid PYON data (RID {})".format(
+                    self.rid))
+        else:
+            try:
+                obj = fs[0].result()
+            except EOFError:
+                raise WorkerError(
+                    "Worker ended while attempting to receive data (RID {})".
+                    format(self.rid))
+            except:
+                raise WorkerError("Worker sent invalid data (RID {})".format(
+                    self.rid))
         return obj
 
     async def _handle_worker_requests(self):
@@ -212,6 +285,9 @@ class Worker:
                 raise WorkerWatchdogTimeout
             action = obj["action"]
             if action == "completed":
+                # time spent by the worker writing results and waiting for
+                # our replies
+                self._add_timings(obj.get("timings", {}))
                 return True
             elif action == "pause":
                 return False
@@ -223,6 +299,8 @@ class Worker:
                 func = self.delete_watchdog
             elif action == "register_experiment":
                 func = self.register_experiment
+            elif action == "update_datasets":
+                func = self._update_datasets
             else:
                 func = self.handlers[action]
             try:
@@ -239,7 +317,13 @@ class Worker:
             finally:
                 self.io_lock.release()
 
-    async def _worker_action(self, obj, timeout=None):
+    def _update_datasets(self, mods):
+        update = self.handlers["update_dataset"]
+        for mod in mods:
+            update(mod)
+
+    async def _worker_action(self, obj, timeout=None, timing=None):
+        t0 = time.monotonic()
         if timeout is not None:
             self.watchdogs[-1] = time.monotonic() + timeout
         try:
@@ -255,6 +339,8 @@ class Worker:
         finally:
             if timeout is not None:
                 del self.watchdogs[-1]
+        if timing is not None:
+            self._add_timings({timing: time.monotonic() - t0})
         return completed
 
     async def build(self, rid, pipeline_name, wd, expid, priority,
@@ -262,21 +348,29 @@ class Worker:
         self.rid = rid
         if "file" in expid:
             self.filename = os.path.basename(expid["file"])
-        await self._create_process(expid["log_level"])
+        self.timings = dict()
+        if self.ipc is None:
+            # wait for the imports separately from the build
+            await self.start(timeout, expid["log_level"])
+        self.set_pause_flags(False, False)
+        if self._pause_flags is None:
+            raise WorkerError("Attempting to build after close")
         await self._worker_action(
             {"action": "build",
              "rid": rid,
              "pipeline_name": pipeline_name,
              "wd": wd,
              "expid": expid,
-             "priority": priority},
-            timeout)
+             "priority": priority,
+             "pause_flags": self._pause_flags.name},
+            timeout, "build")
 
     async def prepare(self):
-        await self._worker_action({"action": "prepare"})
+        await self._worker_action({"action": "prepare"}, timing="prepare")
 
     async def run(self):
-        completed = await self._worker_action({"action": "run"})
+        completed = await self._worker_action({"action": "run"},
+                                              timing="run")
         if not completed:
             self.yield_time = time.monotonic()
         return completed
@@ -286,13 +380,14 @@ class Worker:
         for wid, expiry in self.watchdogs:
             self.watchdogs[wid] += stop_duration
         completed = await self._worker_action({"status": "ok",
-                                               "data": request_termination})
+                                               "data": request_termination},
+                                              timing="run")
         if not completed:
             self.yield_time = time.monotonic()
         return completed
 
     async def analyze(self):
-        await self._worker_action({"action": "analyze"})
+        await self._worker_action({"action": "analyze"}, timing="analyze")
 
     async def examine(self, rid, file, timeout=20.0):
         self.rid = rid
@@ -7,6 +7,10 @@ standalone command line tools).
 from operator import setitem
 import importlib
 import logging
+import threading
+import time
+
+import numpy
 
 from sipyco.sync_struct import Notifier
 from sipyco.pc_rpc import AutoTarget, Client, BestEffortClient
@@ -116,17 +120,233 @@ class DeviceManager:
         self.active_devices.clear()
 
 
+# Assigning to a slice that starts past the end of a list extends it.
+_append_slice = slice(2**63 - 1, None)
+
+
+class _ModQueue:
+    """Dataset modifications waiting to be broadcast.
+
+    Appends to the same list are merged, and the modifications of a dataset
+    are dropped when it is replaced. Modifications of a dataset
+    whose replacement is pending are dropped too, since the replacement
+    value is the object being modified and is only encoded when the queue
+    is flushed.
+    """
+    def __init__(self):
+        self.mods = []
+        self.first_time = None
+        # dataset key -> indices in self.mods
+        self._dataset_mods = dict()
+        # dataset keys whose replacement is pending
+        self._replaced = set()
+
+    def __len__(self):
+        return len(self.mods)
+
+    def append(self, mod):
+        path = mod["path"]
+        if path:
+            key = path[0]
+            if key in self._replaced:
+                return
+        else:
+            key = mod["key"]
+            if mod["action"] == "setitem":
+                for index in self._dataset_mods.pop(key, []):
+                    self.mods[index] = None
+                self._replaced.add(key)
+            else:
+                self._replaced.discard(key)
+
+        if mod["action"] == "append":
+            last = self.mods[-1] if self.mods else None
+            if (last is not None and last["path"] == path
+                    and last["action"] == "setitem"
+                    and last["key"] is _append_slice):
+                last["value"].append(mod["x"])
+                return
+            mod = {"action": "setitem", "path": path,
+                   "key": _append_slice, "value": [mod["x"]]}
+
+        if self.first_time is None:
+            self.first_time = time.monotonic()
+        self._dataset_mods.setdefault(key, []).append(len(self.mods))
+        self.mods.append(mod)
+
+    def take(self):
+        mods = [mod for mod in self.mods if mod is not None]
+        self.__init__()
+        return mods
+
+
+class _StreamedDataset:
+    """Archived list or array dataset that is written to the results file
+    incrementally.
+
+    Appended elements and modified indices are recorded, and written to a
+    chunked HDF5 dataset (resizable for lists) by :meth:`flush`.
+    """
+    def __init__(self, group, key, value, metadata):
+        self.group = group
+        self.key = key
+        self.value = value
+        self.metadata = metadata
+        self.dataset = None
+        self.written = 0
+        self.mutated = []
+
+    def _create(self):
+        data = numpy.asarray(self.value)
+        maxshape = data.shape
+        if isinstance(self.value, list):
+            maxshape = (None,) + maxshape[1:]
+        try:
+            self.dataset = self.group.create_dataset(
+                self.key, data=data, maxshape=maxshape, chunks=True)
+            for key, val in self.metadata.items():
+                self.dataset.attrs[key] = val
+        except TypeError as e:
+            raise TypeError("Error writing dataset '{}' of type '{}': {}"
+                            .format(self.key, type(self.value), e))
+        self.written = len(data)
+
+    def _rewrite(self, index):
+        if isinstance(index, int) and index < 0:
+            index += len(self.value)
+        try:
+            self.dataset[index] = numpy.asarray(self.value[index])
+        except (TypeError, ValueError, IndexError):
+            # not a selection supported by h5py
+            self.dataset[:self.written] = \
+                numpy.asarray(self.value[:self.written])
+
+    def flush(self):
+        if self.dataset is None:
+            if len(self.value):
+                self._create()
+            self.mutated.clear()
+            return
+        if len(self.value) > self.written:
+            new = numpy.asarray(self.value[self.written:])
+            self.dataset.resize(len(self.value), axis=0)
+            self.dataset[self.written:] = new
+        for index in self.mutated:
+            self._rewrite(index)
+        self.written = len(self.value)
+        self.mutated.clear()
+
+    def remove(self):
+        if self.dataset is not None:
+            del self.group[self.key]
+
+
 class DatasetManager:
-    def __init__(self, ddb):
+    """Manages the datasets of an experiment.
+
+    :param broadcast_period: if nonzero, modifications of broadcast datasets
+        are queued and sent to ``ddb`` in batches, using its ``update_many``
+        method, at most every ``broadcast_period`` seconds. Queued
+        modifications are sent from a timer thread once ``broadcast_period``
+        has elapsed, even if no further modification follows.
+        :meth:`flush_broadcast` sends the queued modifications immediately.
+    :param results_file: function returning the open HDF5 results file, in
+        which datasets set with ``stream=True`` are written as they are
+        modified. If ``None``, those datasets are archived normally.
+    :param stream_flush_period: minimum interval in seconds between writes
+        of the modifications of streamed datasets to the results file.
+    """
+    def __init__(self, ddb, broadcast_period=0.0,
+                 results_file=None, stream_flush_period=1.0):
         self._broadcaster = Notifier(dict())
         self.local = dict()
         self.archive = dict()
         self.metadata = dict()
 
         self.ddb = ddb
-        self._broadcaster.publish = ddb.update
-
-    def set(self, key, value, metadata, broadcast, persist, archive):
+        self.broadcast_period = broadcast_period
+        self._mod_queue = _ModQueue()
+        self._broadcaster.publish = self._publish
+        # Held while modifying datasets and while flushing the queue from
+        # the timer thread, which must not encode values being modified.
+        self._lock = threading.RLock()
+        self._flush_timer = None
+
+        self.results_file = results_file
+        self.stream_flush_period = stream_flush_period
+        self._streams = dict()
+        self._stream_file = None
+        self._stream_flush_time = time.monotonic()
+
+    def _publish(self, mod):
+        if not self.broadcast_period:
+            self.ddb.update(mod)
+            return
+        with self._lock:
+            self._mod_queue.append(mod)
+            if self._mod_queue.first_time is None:
+                return
+            elapsed = time.monotonic() - self._mod_queue.first_time
+            if elapsed >= self.broadcast_period:
+                self.flush_broadcast()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(
+                    self.broadcast_period - elapsed, self._flush_from_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush_broadcast()
+        except Exception:
+            logger.warning("failed to broadcast dataset modifications",
+                           exc_info=True)
+
+    def flush_broadcast(self):
+        """Send the queued modifications of broadcast datasets."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if len(self._mod_queue):
+                mods = self._mod_queue.take()
+                if mods:
+                    self.ddb.update_many(mods)
+
+    def _stream(self, key, value, metadata):
+        if not (isinstance(value, list) or
+                (isinstance(value, numpy.ndarray) and value.ndim)):
+            raise TypeError("Cannot stream dataset '{}' of type '{}', only "
+                            "lists and arrays can be streamed"
+                            .format(key, type(value)))
+        if self._stream_file is None:
+            self._stream_file = self.results_file()
+        group = self._stream_file.require_group("datasets")
+        stream = _StreamedDataset(group, key, value, metadata)
+        stream.flush()
+        self._streams[key] = stream
+
+    def _stream_modified(self):
+        if (time.monotonic() - self._stream_flush_time
+                >= self.stream_flush_period):
+            self.flush_streams()
+
+    def flush_streams(self):
+        """Write the pending modifications of streamed datasets to the
+        results file."""
+        if self._streams:
+            for stream in self._streams.values():
+                stream.flush()
+            self._stream_file.flush()
+        self._stream_flush_time = time.monotonic()
+
+    def set(self, key, value, metadata, broadcast, persist, archive,
+            stream=False):
+        with self._lock:
+            self._set(key, value, metadata, broadcast, persist, archive,
+                      stream)
+
+    def _set(self, key, value, metadata, broadcast, persist, archive, stream):
         if persist:
             broadcast = True
 
@@ -138,8 +358,12 @@ class DatasetManager:
         elif key in self._broadcaster.raw_view:
             del self._broadcaster[key]
 
+        if key in self._streams:
+            self._streams.pop(key).remove()
         if archive:
             self.local[key] = value
+            if stream and self.results_file is not None:
+                self._stream(key, value, metadata)
         elif key in self.local:
             del self.local[key]
         
@@ -156,6 +380,10 @@ class DatasetManager:
         return target
 
     def mutate(self, key, index, value):
+        with self._lock:
+            self._mutate(key, index, value)
+
+    def _mutate(self, key, index, value):
         target = self._get_mutation_target(key)
         if isinstance(index, tuple):
             if isinstance(index[0], tuple):
@@ -163,9 +391,15 @@ class DatasetManager:
             else:
                 index = slice(*index)
         setitem(target, index, value)
+        if key in self._streams:
+            self._streams[key].mutated.append(index)
+            self._stream_modified()
 
     def append_to(self, key, value):
-        self._get_mutation_target(key).append(value)
+        with self._lock:
+            self._get_mutation_target(key).append(value)
+            if key in self._streams:
+                self._stream_modified()
 
     def get(self, key, archive=False):
         if key in self.local:
@@ -185,8 +419,17 @@ class DatasetManager:
         return self.ddb.get_metadata(key)
 
     def write_hdf5(self, f):
-        datasets_group = f.create_group("datasets")
+        if f is self._stream_file:
+            # streamed datasets are already in the file
+            for stream in self._streams.values():
+                stream.flush()
+            streamed = self._streams
+        else:
+            streamed = dict()
+        datasets_group = f.require_group("datasets")
         for k, v in self.local.items():
+            if k in streamed:
+                continue
             m = self.metadata.get(k, {})
             _write(datasets_group, k, v, m)
 
@@ -8,6 +8,7 @@ process via IPC.
 
 import sys
 import time
+import threading
 import os
 import inspect
 import logging
@@ -15,6 +16,7 @@ import traceback
 from collections import OrderedDict
 import importlib.util
 import linecache
+from multiprocessing import shared_memory, resource_tracker
 
 import h5py
 
@@ -31,28 +33,66 @@ from artiq.language.environment import (
 from artiq.language.core import set_watchdog_factory, TerminationRequested
 from artiq.language.types import TBool
 from artiq.compiler import import_cache
+from artiq.master import worker_ipc
+from artiq.master.worker import PAUSE_FLAG, TERMINATION_FLAG
 from artiq.coredevice.core import CompileError, host_only, _render_diagnostic
 from artiq import __version__ as artiq_version
 
 
 ipc = None
+ipc_framing = worker_ipc.TEXT
+dataset_mgr = None
+# Serializes the requests to the master, since the dataset manager may
+# flush dataset modifications from its timer thread.
+ipc_lock = threading.Lock()
+# Set when the master replies "terminate" to a request. In the timer thread,
+# the resulting SystemExit only ends that thread, so the main thread exits
+# at its next request or when completing its action.
+terminate_requested = False
+# durations reported to the master with the completion of each action
+timings = dict()
+
+
+def add_timing(name, duration):
+    timings[name] = timings.get(name, 0.0) + duration
 
 
 def get_object():
-    line = ipc.readline().decode()
-    return pyon.decode(line)
+    if ipc_framing == worker_ipc.TEXT:
+        line = ipc.readline().decode()
+        return pyon.decode(line)
+    else:
+        return worker_ipc.read_message(ipc.read)
 
 
 def put_object(obj):
-    ds = pyon.encode(obj)
-    ipc.write((ds + "\n").encode())
+    for data in worker_ipc.encode_message(obj, ipc_framing):
+        ipc.write(data)
+
+
+def flush_dataset_mods():
+    if dataset_mgr is not None:
+        dataset_mgr.flush_broadcast()
 
 
 def make_parent_action(action):
     def parent_action(*args, **kwargs):
+        global terminate_requested
+        # Keep the master's view of the datasets consistent with the
+        # requests of the experiment.
+        if action != "update_datasets":
+            flush_dataset_mods()
         request = {"action": action, "args": args, "kwargs": kwargs}
-        put_object(request)
-        reply = get_object()
+        t0 = time.monotonic()
+        with ipc_lock:
+            if terminate_requested:
+                sys.exit()
+            put_object(request)
+            reply = get_object()
+            if reply.get("action") == "terminate":
+                terminate_requested = True
+        if action != "pause":
+            add_timing("ipc", time.monotonic() - t0)
         if "action" in reply:
             if reply["action"] == "terminate":
                 sys.exit()
@@ -73,6 +113,7 @@ class ParentDeviceDB:
 class ParentDatasetDB:
     get = make_parent_action("get_dataset")
     update = make_parent_action("update_dataset")
+    update_many = make_parent_action("update_datasets")
 
 
 class Watchdog:
@@ -92,12 +133,37 @@ class Watchdog:
 set_watchdog_factory(Watchdog)
 
 
+def attach_pause_flags(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13 registers the block with the resource tracker of
+        # this process, which would destroy it when the worker exits. It
+        # belongs to the master.
+        flags = shared_memory.SharedMemory(name)
+        if os.name != "nt":
+            resource_tracker.unregister(flags._name, "shared_memory")
+        return flags
+
+
 class Scheduler:
-    def set_run_info(self, rid, pipeline_name, expid, priority):
+    def __init__(self):
+        # Flags kept up to date by the master for the current run, see
+        # artiq.master.worker.Worker.set_pause_flags.
+        self._pause_flags = None
+
+    def set_run_info(self, rid, pipeline_name, expid, priority,
+                     pause_flags=None):
         self.rid = rid
         self.pipeline_name = pipeline_name
         self.expid = expid
         self.priority = priority
+        if self._pause_flags is not None:
+            self._pause_flags.close()
+        if pause_flags is None:
+            self._pause_flags = None
+        else:
+            self._pause_flags = attach_pause_flags(pause_flags)
 
     pause_noexc = staticmethod(make_parent_action("pause"))
     @host_only
@@ -107,13 +173,17 @@ class Scheduler:
 
     _check_pause = staticmethod(make_parent_action("scheduler_check_pause"))
     def check_pause(self, rid=None) -> TBool:
-        if rid is None:
+        if rid is None or rid == self.rid:
+            if self._pause_flags is not None:
+                return bool(self._pause_flags.buf[PAUSE_FLAG])
             rid = self.rid
         return self._check_pause(rid)
 
     _check_termination = staticmethod(make_parent_action("scheduler_check_termination"))
     def check_termination(self, rid=None) -> TBool:
-        if rid is None:
+        if rid is None or rid == self.rid:
+            if self._pause_flags is not None:
+                return bool(self._pause_flags.buf[TERMINATION_FLAG])
             rid = self.rid
         return self._check_termination(rid)
 
@@ -244,7 +314,11 @@ def setup_diagnostics(experiment_file, repository_path):
 
 
 def put_completed():
-    put_object({"action": "completed"})
+    flush_dataset_mods()
+    if terminate_requested:
+        sys.exit()
+    put_object({"action": "completed", "timings": timings})
+    timings.clear()
 
 
 def put_exception_report():
@@ -264,14 +338,23 @@ def put_exception_report():
             lines += traceback.format_exception_only(type(exc), exc)
         logging.error("".join(lines).rstrip(),
                       exc_info=not hasattr(exc, "parent_traceback"))
+    try:
+        flush_dataset_mods()
+    except:
+        logging.error("failed to broadcast dataset modifications",
+                      exc_info=True)
     put_object({"action": "exception"})
 
 
 def main():
-    global ipc
+    global ipc, ipc_framing, dataset_mgr
 
     multiline_log_config(level=int(sys.argv[2]))
     ipc = pipe_ipc.ChildComm(sys.argv[1])
+    if len(sys.argv) > 3:
+        ipc_framing = sys.argv[3]
+    announce_ready = len(sys.argv) > 4 and sys.argv[4] == "ready"
+    initial_cwd = os.getcwd()
 
     start_time = None
     run_time = None
@@ -281,28 +364,60 @@ def main():
     exp_inst = None
     repository_path = None
 
+    results_file = None
+
+    def get_results_file():
+        nonlocal results_file
+        if results_file is None:
+            filename = "{:09}-{}.h5".format(rid, exp.__name__)
+            results_file = h5py.File(filename, "w")
+        return results_file
+
     def write_results():
-        filename = "{:09}-{}.h5".format(rid, exp.__name__)
-        with h5py.File(filename, "w") as f:
+        nonlocal results_file
+        t0 = time.monotonic()
+        with get_results_file() as f:
+            results_file = None
             dataset_mgr.write_hdf5(f)
             f["artiq_version"] = artiq_version
             f["rid"] = rid
             f["start_time"] = start_time
             f["run_time"] = run_time
             f["expid"] = pyon.encode(expid)
+        add_timing("write_results", time.monotonic() - t0)
 
     device_mgr = DeviceManager(ParentDeviceDB,
                                virtual_devices={"scheduler": Scheduler(),
                                                 "ccb": CCB()})
-    dataset_mgr = DatasetManager(ParentDatasetDB)
+    def create_dataset_mgr():
+        return DatasetManager(
+            ParentDatasetDB,
+            broadcast_period=float(os.getenv("ARTIQ_DATASET_BROADCAST_PERIOD",
+                                             "0.1")),
+            results_file=get_results_file,
+            stream_flush_period=float(os.getenv("ARTIQ_RESULTS_FLUSH_PERIOD",
+                                                "1.0")))
+    dataset_mgr = create_dataset_mgr()
 
     import_cache.install_hook()
 
+    if announce_ready:
+        # started in advance by the master's worker pool
+        put_object({"action": "ready"})
+
     try:
         while True:
             obj = get_object()
             action = obj["action"]
             if action == "build":
+                if rid is not None:
+                    # reused by the master for another run
+                    os.chdir(initial_cwd)
+                    device_mgr.devarg_override = {}
+                    dataset_mgr = create_dataset_mgr()
+                    results_file = None
+                    timings.clear()
+                logging.getLogger().setLevel(obj["expid"]["log_level"])
                 start_time = time.time()
                 rid = obj["rid"]
                 expid = obj["expid"]
@@ -322,7 +437,8 @@ def main():
                     setup_diagnostics("<none>", None)
                     exp = get_experiment_from_content(expid["content"], expid["class_name"])
                 device_mgr.virtual_devices["scheduler"].set_run_info(
-                    rid, obj["pipeline_name"], expid, obj["priority"])
+                    rid, obj["pipeline_name"], expid, obj["priority"],
+                    obj.get("pause_flags"))
                 start_local_time = time.localtime(start_time)
                 dirname = os.path.join("results",
                                    time.strftime("%Y-%m-%d", start_local_time),
@@ -356,6 +472,8 @@ def main():
                     # since it doesn't run the experiment and cannot have rid
                     if rid is not None:
                         write_results()
+                    # do not keep devices open if the worker is reused
+                    device_mgr.close_devices()
 
                 put_completed()
             elif action == "examine":
@@ -0,0 +1,129 @@
+"""Binary framing of the messages exchanged between the master and
+worker processes.
+
+By default, messages are PYON strings terminated by a newline. With binary
+framing, each message is sent as a header with the lengths of its parts,
+followed by the PYON encoding of the message in which NumPy arrays of
+numerical types are replaced by references to raw buffers, and the
+buffers themselves. This avoids the base64 and text parsing overhead of
+PYON for large arrays, e.g. in dataset modifications.
+
+The framing used by a worker is selected by the master on the command line
+of the worker process.
+"""
+
+import struct
+
+import numpy
+
+from sipyco import pyon
+
+
+__all__ = ["TEXT", "BINARY", "encode_message",
+           "read_message", "read_message_async"]
+
+
+TEXT = "text"
+BINARY = "binary"
+
+# PYON length, number of buffers
+_header = struct.Struct("<QI")
+_length = struct.Struct("<Q")
+
+_buffer_key = "__worker_ipc_buffer__"
+_buffer_kinds = frozenset("biufc")
+
+
+def _extract_buffers(obj, buffers):
+    t = type(obj)
+    if t is dict:
+        return {k: _extract_buffers(v, buffers) for k, v in obj.items()}
+    elif t is list:
+        return [_extract_buffers(v, buffers) for v in obj]
+    elif t is tuple:
+        return tuple(_extract_buffers(v, buffers) for v in obj)
+    elif t is numpy.ndarray and obj.dtype.kind in _buffer_kinds:
+        buffers.append(numpy.ascontiguousarray(obj).tobytes())
+        return {_buffer_key: (len(buffers) - 1, obj.dtype.str,
+                              list(obj.shape))}
+    else:
+        return obj
+
+
+def _insert_buffers(obj, buffers):
+    t = type(obj)
+    if t is dict:
+        if _buffer_key in obj:
+            index, dtype, shape = obj[_buffer_key]
+            return numpy.frombuffer(buffers[index], dtype).reshape(shape)
+        return {k: _insert_buffers(v, buffers) for k, v in obj.items()}
+    elif t is list:
+        return [_insert_buffers(v, buffers) for v in obj]
+    elif t is tuple:
+        return tuple(_insert_buffers(v, buffers) for v in obj)
+    else:
+        return obj
+
+
+def encode_message(obj, framing):
+    """Return the list of ``bytes`` to be written to the pipe to send
+    ``obj``."""
+    if framing == TEXT:
+        return [(pyon.encode(obj) + "\n").encode()]
+    buffers = []
+    text = pyon.encode(_extract_buffers(obj, buffers)).encode()
+    lengths = b"".join(_length.pack(len(buffer)) for buffer in buffers)
+    return [_header.pack(len(text), len(buffers)) + lengths + text] + buffers
+
+
+def _decode(text, buffers):
+    obj = pyon.decode(text.decode())
+    if buffers:
+        obj = _insert_buffers(obj, buffers)
+    return obj
+
+
+def _read_exactly(read, n):
+    # bytearray, so that arrays decoded from the buffer are writable
+    data = bytearray()
+    while len(data) < n:
+        chunk = read(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+async def _read_exactly_async(read, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = await read(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def read_message(read):
+    """Read a binary framed message using the blocking ``read(n)`` function.
+    Raises ``EOFError`` if the pipe is closed."""
+    text_length, buffer_count = _header.unpack(
+        _read_exactly(read, _header.size))
+    lengths = _read_exactly(read, _length.size*buffer_count)
+    text = _read_exactly(read, text_length)
+    buffers = [_read_exactly(read, _length.unpack_from(lengths, i*_length.size)[0])
+               for i in range(buffer_count)]
+    return _decode(text, buffers)
+
+
+async def read_message_async(read):
+    """Coroutine version of :func:`read_message`."""
+    text_length, buffer_count = _header.unpack(
+        await _read_exactly_async(read, _header.size))
+    lengths = await _read_exactly_async(read, _length.size*buffer_count)
+    text = await _read_exactly_async(read, text_length)
+    buffers = []
+    for i in range(buffer_count):
+        length, = _length.unpack_from(lengths, i*_length.size)
+        buffers.append(await _read_exactly_async(read, length))
+    return _decode(text, buffers)
@@ -1,6 +1,17 @@
+import io
+import struct
+import unittest
+
+import numpy
+import h5py
+
 from artiq.experiment import *
-from artiq.coredevice.comm_analyzer import (decode_dump, StoppedMessage,
+from artiq.coredevice.comm_analyzer import (decode_dump, decode_message,
+                                            decoded_dump_to_vcd, dump_to_vcd,
+                                            dump_to_hdf5,
+                                            StoppedMessage, ExceptionMessage,
                                             OutputMessage, InputMessage,
+                                            ExceptionType, MessageType,
                                            _extract_log_chars, get_analyzer_dump)
 from artiq.test.hardware_testbench import ExperimentCase
 
@@ -77,3 +88,126 @@ class AnalyzerTest(ExperimentCase):
                         for msg in dump.messages
                         if isinstance(msg, OutputMessage) and msg.channel == dump.log_channel])
         self.assertEqual(log, "foo\x1E32\x1D")
+
+
+def _synthetic_dump(records, log_channel=31):
+    data = b"".join(records)
+    return (b"e" + struct.pack("<IQbbb", len(data), len(data), 0, log_channel, 0) +
+            data)
+
+
+def _record(message_type, channel=0, timestamp=0, rtio_counter=0,
+            address=0, data=0):
+    return struct.pack(">QIQQI", data, address, rtio_counter, timestamp,
+                       (channel << 2) | message_type.value)
+
+
+class DecodeDumpTest(unittest.TestCase):
+    devices = {
+        "core": {
+            "type": "local",
+            "module": "artiq.coredevice.core",
+            "class": "Core",
+            "arguments": {"host": None, "ref_period": 1e-9}
+        },
+        "ttl0": {
+            "type": "local",
+            "module": "artiq.coredevice.ttl",
+            "class": "TTLOut",
+            "arguments": {"channel": 0}
+        }
+    }
+
+    def test_decode(self):
+        records = [
+            _record(MessageType.output, 0, 1000, 900, 0, 1),
+            _record(MessageType.input, 1, 1100, 1050, 0, 3),
+            _record(MessageType.exception, 2, 0, 1200,
+                    ExceptionType.o_underflow.value),
+            _record(MessageType.stopped, 0, 0, 1300)
+        ]
+        dump = decode_dump(_synthetic_dump(records))
+        self.assertEqual(list(dump.messages),
+                         [decode_message(record) for record in records])
+        self.assertIsInstance(dump.messages[0], OutputMessage)
+        self.assertIsInstance(dump.messages[1], InputMessage)
+        self.assertIsInstance(dump.messages[2], ExceptionMessage)
+        self.assertIsInstance(dump.messages[-1], StoppedMessage)
+        self.assertEqual(dump.messages[0].timestamp, 1000)
+
+    def test_dump_to_vcd(self):
+        records = []
+        for i in range(1000):
+            # outputs are logged slightly out of timestamp order
+            timestamp = 1000 + 10*i + (i % 3)*7
+            records.append(_record(MessageType.output, 0, timestamp,
+                                   timestamp - 100, 0, i % 2))
+            if i % 10 == 0:
+                records.append(_record(MessageType.input, 0, timestamp + 3,
+                                       timestamp + 5, 0, 1))
+        records.append(_record(MessageType.stopped, 0, 0, 20000))
+        dump = _synthetic_dump(records)
+
+        for uniform_interval in False, True:
+            expected = io.StringIO()
+            decoded_dump_to_vcd(expected, self.devices, decode_dump(dump),
+                                uniform_interval=uniform_interval)
+            vcd = io.StringIO()
+            event_count = dump_to_vcd(vcd, self.devices, dump,
+                                      uniform_interval=uniform_interval,
+                                      chunk_size=64, window=16)
+            self.assertEqual(event_count, len(records) - 1)
+            self.assertEqual(vcd.getvalue(), expected.getvalue())
+
+    def test_dump_to_hdf5(self):
+        records = [
+            _record(MessageType.output, 0, 1000, 900, 0, 1),
+            _record(MessageType.output, 5, 1050, 1000, 2, 7),
+            _record(MessageType.input, 0, 1100, 1105, 0, 0),
+            _record(MessageType.exception, 0, 0, 1200,
+                    ExceptionType.o_underflow.value),
+            _record(MessageType.output, 0, 1300, 1250, 0, 0),
+            _record(MessageType.stopped, 0, 0, 1400)
+        ]
+        with h5py.File("analyzer.h5", "w", driver="core",
+                       backing_store=False) as f:
+            event_count = dump_to_hdf5(f, self.devices,
+                                       _synthetic_dump(records))
+            self.assertEqual(event_count, 5)
+            ttl0 = f["channels/ttl/ttl0"]
+            self.assertEqual(ttl0.attrs["channel"], 0)
+            self.assertEqual(list(ttl0["timestamp"]), [1000, 1100, 1300])
+            self.assertEqual(list(ttl0["type"]),
+                             [MessageType.output.value, MessageType.input.value,
+                              MessageType.output.value])
+            self.assertEqual(list(ttl0["data"]), [1, 0, 0])
+            self.assertEqual(list(ttl0["slack"]), [100, -5, 50])
+            self.assertEqual(list(f["channels/channel5/address"]), [2])
+            self.assertEqual(list(f["exceptions/exception_type"]),
+                             [ExceptionType.o_underflow.value])
+            self.assertEqual(list(f["exceptions/rtio_counter"]), [1200])
+
+    def test_decode_large(self):
+        # Throughput is measured by artiq.coredevice.testbench.analyzer.
+        count = 1 << 16
+        records = numpy.zeros(count, numpy.dtype([
+            ("data", ">u8"), ("address", ">u4"), ("rtio_counter", ">u8"),
+            ("timestamp", ">u8"), ("type_channel", ">u4")]))
+        records["timestamp"] = numpy.arange(count)*8 + 1000
+        records["rtio_counter"] = records["timestamp"] - 500
+        records["data"] = numpy.arange(count) % 2
+        records[-1]["type_channel"] = MessageType.stopped.value
+        dump = _synthetic_dump([records.tobytes()])
+
+        decoded_dump = decode_dump(dump)
+        self.assertEqual(len(decoded_dump.messages), count)
+        self.assertIsInstance(decoded_dump.messages[0], OutputMessage)
+        self.assertEqual(decoded_dump.messages[1].timestamp, 1008)
+        self.assertIsInstance(decoded_dump.messages[-1], StoppedMessage)
+
+        expected = io.StringIO()
+        decoded_dump_to_vcd(expected, self.devices, decoded_dump)
+        self.assertIn("ttl/ttl0", expected.getvalue())
+        vcd = io.StringIO()
+        self.assertEqual(dump_to_vcd(vcd, self.devices, dump), count - 1)
+        self.assertEqual(vcd.getvalue(), expected.getvalue())
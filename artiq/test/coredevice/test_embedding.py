@@ -573,3 +573,34 @@ class NumpyQuotingTest(ExperimentCase):
     def test_issue_1871(self):
         """Ensure numpy.array() does not break NumPy math functions"""
         self.create(_NumpyQuoting).run()
+
+
+class _Writeback(EnvExperiment):
+    def build(self):
+        self.setattr_device("core")
+        self.written = 0
+        self.read_only = 0
+        self.mutated = [0, 0]
+
+    def set_read_only(self, value):
+        self.read_only = value
+
+    @kernel
+    def run(self) -> TInt32:
+        self.written = 1
+        self.mutated[1] = 2
+        self.set_read_only(3)
+        return self.read_only
+
+
+class WritebackTest(ExperimentCase):
+    def test_writeback(self):
+        exp = self.create(_Writeback)
+        comm = exp.core.comm
+        writeback_bytes = comm.writeback_bytes
+        self.assertEqual(exp.run(), 0)
+        self.assertEqual(exp.written, 1)
+        self.assertEqual(exp.mutated, [0, 2])
+        # not written by the kernel, so not overwritten at kernel exit
+        self.assertEqual(exp.read_only, 3)
+        self.assertGreater(comm.writeback_bytes, writeback_bytes)
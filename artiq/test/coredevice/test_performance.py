@@ -1,9 +1,13 @@
 import os
 import time
+import socket
+import struct
+import threading
 import unittest
 import numpy
 
 from artiq.experiment import *
+from artiq.coredevice.comm_kernel import CommKernel
 from artiq.test.hardware_testbench import ExperimentCase
 
 # large: 1MB payload
@@ -293,3 +297,75 @@ class KernelOverheadTest(ExperimentCase):
         print(kernel_overhead, "s")
         self.assertGreater(kernel_overhead, 0.001)
         self.assertLess(kernel_overhead, 0.5)
+
+
+class _LoopbackCommKernel(CommKernel):
+    def __init__(self, sock):
+        CommKernel.__init__(self, None)
+        self.socket = sock
+        self._set_endian("<")
+
+
+class RPCReceiveThroughputTest(unittest.TestCase):
+    """Host-only benchmark of the RPC value receive path, with a local socket
+    pair standing in for the core device connection."""
+    @classmethod
+    def setUpClass(self):
+        self.results = []
+
+    @classmethod
+    def tearDownClass(self):
+        if len(self.results) == 0:
+            return
+        print()
+        print("| {:<24} | Throughput (MiB/s) |".format("Test"))
+        print("| {} | ------------------ |".format("-" * 24))
+        for name, throughput in self.results:
+            print("| {:<24} | {:>18.2f} |".format(name, throughput))
+
+    def receive(self, name, message, count):
+        host, device = socket.socketpair()
+        kernel = _LoopbackCommKernel(host)
+        sender = threading.Thread(target=lambda: device.sendall(message * count))
+        try:
+            t0 = time.monotonic()
+            sender.start()
+            for _ in range(count):
+                value = kernel._receive_rpc_value(None)
+            t1 = time.monotonic()
+        finally:
+            sender.join()
+            host.close()
+            device.close()
+        self.results.append([name, len(message) * count / (t1 - t0) / (1 << 20)])
+        return value
+
+    def test_array_large(self):
+        array = numpy.arange(1 << 20, dtype=numpy.int32)
+        message = b"a" + struct.pack("<BlB", 1, len(array), ord("i")) + array.tobytes()
+        value = self.receive("I32 Array (4MB)", message, 16)
+        numpy.testing.assert_array_equal(value, array)
+        # Received arrays must remain writable.
+        value[0] = 1
+
+    def test_array_small(self):
+        array = numpy.arange(1 << 8, dtype=numpy.float64)
+        message = b"a" + struct.pack("<BlB", 1, len(array), ord("f")) + array.tobytes()
+        value = self.receive("Float Array (2KB)", message, 4096)
+        numpy.testing.assert_array_equal(value, array)
+
+    def test_bytes_large(self):
+        message = b"B" + struct.pack("<l", len(bytes_large)) + bytes_large
+        value = self.receive("Bytes (1MB)", message, 64)
+        self.assertEqual(value, bytes_large)
+
+    def test_list_large(self):
+        message = (b"l" + struct.pack("<lB", len(list_large), ord("i")) +
+                   struct.pack("<%dl" % len(list_large), *list_large))
+        value = self.receive("I32 List (1MB)", message, 16)
+        self.assertEqual(value, list_large)
+
+    def test_ints(self):
+        message = b"i" + struct.pack("<l", 123)
+        value = self.receive("I32 scalars", message, 1 << 18)
+        self.assertEqual(value, 123)
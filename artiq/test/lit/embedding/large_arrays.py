@@ -0,0 +1,28 @@
+# RUN: env ARTIQ_DUMP_UNOPT_LLVM=%t %python -m artiq.compiler.testbench.embedding +compile %s
+# RUN: OutputCheck %s --file-to-check=%t_unopt.ll
+
+from artiq.language.core import *
+from artiq.language.types import *
+import numpy
+
+# CHECK-L: @quoted.array = private global [800 x i8] c"\00\00\00\00\00\00\00\00\00\00\00\00\00\00\F0?
+# CHECK-L: , align 8
+float_vec = numpy.arange(100, dtype=numpy.float64)
+
+# CHECK-L: @quoted.array.1 = private global [800 x i8] c"\00\00\00\00\01\00\00\00\02\00\00\00
+# CHECK-L: , align 4
+int_mat = numpy.arange(200, dtype=numpy.int32).reshape((20, 10))
+
+# CHECK-L: @quoted.list = private global [400 x i8] c"\00\00\00\00\01\00\00\00\02\00\00\00
+# CHECK-L: @quoted.list.1 = private global { i32*, i32 } { i32* bitcast ([400 x i8]* @quoted.list to i32*), i32 100 }
+# CHECK-NOT-L: @quoted.list.2
+int_list = list(range(100))
+
+@kernel
+def entrypoint():
+    assert float_vec.shape == (100, )
+    assert float_vec[1] == 1.0
+    assert int_mat.shape == (20, 10)
+    assert int_mat[1][2] == 12
+    assert len(int_list) == 100
+    assert int_list[99] == 99
@@ -0,0 +1,41 @@
+# RUN: env ARTIQ_DUMP_IR=%t ARTIQ_IR_NO_LOC=1 %python -m artiq.compiler.testbench.embedding +compile %s
+# RUN: OutputCheck %s --file-to-check=%t.txt
+
+from artiq.language.core import *
+from artiq.language.types import *
+import numpy
+
+# Every reference to a host list or array gives a fresh copy, whether it is
+# quoted element by element or, from QUOTE_BLOB_THRESHOLD elements, as a
+# single constant. Modifying the copy does not affect other references.
+
+small = list(range(63))
+large = list(range(64))
+large_array = numpy.arange(64, dtype=numpy.int32)
+
+@kernel
+def entrypoint():
+    # CHECK-L: = list(elt=numpy.int32) alloc numpy.int32 63
+    # CHECK: setelem list\(elt=numpy\.int32\) %UNN\.\d+, numpy\.int32 %UNN\.\d+, numpy\.int32 10
+    # CHECK-L: = list(elt=numpy.int32) alloc numpy.int32 63
+    s = small
+    s[0] = 10
+    assert small[0] == 0
+
+    # CHECK-L: = list(elt=numpy.int32) quote([0, 1, 2,
+    # CHECK-L: = list(elt=numpy.int32) alloc numpy.int32 %
+    # CHECK: setelem list\(elt=numpy\.int32\) %UNN\.\d+, numpy\.int32 %UNN\.\d+, numpy\.int32 10
+    # CHECK-L: = list(elt=numpy.int32) quote([0, 1, 2,
+    # CHECK-L: = list(elt=numpy.int32) alloc numpy.int32 %
+    l = large
+    l[0] = 10
+    assert large[0] == 0
+
+    # CHECK-L: = numpy.array(elt=numpy.int32, num_dims=1) quote(array(
+    # CHECK-L: = numpy.array(elt=numpy.int32, num_dims=1) alloc pointer(elt=numpy.int32)
+    # CHECK: setelem numpy\.array\(elt=numpy\.int32, num_dims=1\) %UNN\.\d+, numpy\.int32 %UNN\.\d+, numpy\.int32 10
+    # CHECK-L: = numpy.array(elt=numpy.int32, num_dims=1) quote(array(
+    # CHECK-L: = numpy.array(elt=numpy.int32, num_dims=1) alloc pointer(elt=numpy.int32)
+    a = large_array
+    a[0] = 10
+    assert large_array[0] == 0
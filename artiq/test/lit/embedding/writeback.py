@@ -0,0 +1,42 @@
+# RUN: env ARTIQ_DUMP_LLVM=%t %python -m artiq.compiler.testbench.embedding +compile %s
+# RUN: OutputCheck %s --file-to-check=%t.ll
+
+from artiq.language.core import *
+from artiq.language.types import *
+import numpy
+
+# Attributes that are only read, and kernel invariants, are not written back.
+# CHECK-NOT-L: @A.read_only =
+# CHECK-NOT-L: @A.invariant_list =
+
+# counter is assigned to; samples and read_only_list can be mutated in place.
+# CHECK-L: @A.counter =
+# CHECK-L: @A.samples =
+# CHECK-L: @A.read_only_list =
+# CHECK-L: @writeback =
+# CHECK-L: c"OsiOsa\01iOsli:n"
+
+# The same attributes are described for older runtimes, one RPC each.
+# CHECK-L: @Ax.I.testbench.Holder = private unnamed_addr constant [4 x %A*] [%A* @A.I.testbench.Holder.counter, %A* @A.I.testbench.Holder.samples, %A* @A.I.testbench.Holder.read_only_list, %A* null]
+# CHECK-L: @typeinfo =
+
+class Holder:
+    kernel_invariants = {"invariant_list"}
+
+    def __init__(self):
+        self.counter = 0
+        self.read_only = 1
+        self.read_only_list = [1, 2]
+        self.invariant_list = [3, 4]
+        self.samples = numpy.zeros(4, dtype=numpy.int32)
+
+    @kernel
+    def run(self):
+        self.counter += self.read_only
+        self.samples[0] = self.invariant_list[0] + self.read_only_list[0]
+
+holder = Holder()
+
+@kernel
+def entrypoint():
+    holder.run()
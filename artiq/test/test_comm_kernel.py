@@ -0,0 +1,126 @@
+import socket
+import struct
+import unittest
+
+import numpy
+
+from artiq.coredevice.comm_kernel import CommKernel, RPCReturnValueError
+
+
+def _returns(value):
+    return value
+
+
+class _ObjectMap:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def retrieve_object(self, obj_id):
+        return self.objects[obj_id]
+
+
+class _Holder:
+    pass
+
+
+def _string(value):
+    return struct.pack("<l", len(value)) + value
+
+
+def _rpc(service_id, args):
+    # Asynchronous RPC, as sent by the runtime: the arguments are followed by
+    # the end-of-arguments tag, then by the return tags.
+    return (b"\x01" + struct.pack("<l", service_id) + b"".join(args) +
+            b"\x00" + _string(b"n"))
+
+
+class RPCValueCase(unittest.TestCase):
+    def setUp(self):
+        self.comm = CommKernel(None)
+        self.comm._set_endian("<")
+
+    def send(self, tags, value):
+        self.comm.write_buffer.clear()
+        self.comm._send_rpc_value(tags, 0, value, value, _returns)
+        return bytes(self.comm.write_buffer)
+
+    def test_lists(self):
+        self.assertEqual(self.send(b"li", [1, -2, 3]),
+                         struct.pack("<llll", 3, 1, -2, 3))
+        self.assertEqual(self.send(b"lI", [1, -2**40]),
+                         struct.pack("<lqq", 2, 1, -2**40))
+        self.assertEqual(self.send(b"lf", [1.5, 2]),
+                         struct.pack("<ldd", 2, 1.5, 2.0))
+        self.assertEqual(self.send(b"lf", numpy.arange(3.).tolist()),
+                         struct.pack("<lddd", 3, 0., 1., 2.))
+        self.assertEqual(self.send(b"li", []), struct.pack("<l", 0))
+        self.assertEqual(self.send(b"lf", []), struct.pack("<l", 0))
+
+    def test_out_of_range(self):
+        with self.assertRaises(RPCReturnValueError):
+            self.send(b"li", [2**31])
+
+    def test_nested_list(self):
+        for tags in b"li", b"lI", b"lf":
+            with self.subTest(tags=tags):
+                with self.assertRaises(RPCReturnValueError):
+                    self.send(tags, [[1.0, 2.0], [3.0, 4.0]])
+                with self.assertRaises(RPCReturnValueError):
+                    self.send(tags, [[1], [2, 3]])
+
+    def test_mixed_types(self):
+        with self.assertRaises(RPCReturnValueError):
+            self.send(b"li", [1, 2.5])
+        with self.assertRaises(RPCReturnValueError):
+            self.send(b"lI", [1, "2"])
+        with self.assertRaises(RPCReturnValueError):
+            self.send(b"lf", [1.0, "2"])
+
+
+class WritebackCase(unittest.TestCase):
+    def setUp(self):
+        self.comm = CommKernel(None)
+        self.comm._set_endian("<")
+        self.comm.socket, self.device = socket.socketpair()
+
+    def tearDown(self):
+        self.comm.close()
+        self.device.close()
+
+    def serve(self, message, objects):
+        self.device.sendall(message)
+        self.comm._serve_rpc(_ObjectMap(objects))
+        self.assertEqual(self.comm.read_start, self.comm.read_end)
+
+    def test_writeback(self):
+        first, second = _Holder(), _Holder()
+        message = _rpc(0, [
+            b"O" + struct.pack("<l", 1), b"s" + _string(b"counter"),
+            b"i" + struct.pack("<l", 42),
+            b"O" + struct.pack("<l", 1), b"s" + _string(b"values"),
+            b"l" + struct.pack("<l", 2) + b"f" + struct.pack("<dd", 1.5, 2.5),
+            b"O" + struct.pack("<l", 2), b"s" + _string(b"samples"),
+            b"a\x01" + struct.pack("<l", 3) + b"i" + struct.pack("<lll", 1, 2, 3),
+        ])
+        self.serve(message, {1: first, 2: second})
+        self.assertEqual(first.counter, 42)
+        self.assertEqual(first.values, [1.5, 2.5])
+        self.assertEqual(second.samples.tolist(), [1, 2, 3])
+        self.assertFalse(hasattr(second, "counter"))
+        self.assertEqual(self.comm.writeback_bytes, len(message))
+
+        # other RPCs are not counted
+        calls = []
+        self.serve(_rpc(3, [b"i" + struct.pack("<l", 7)]), {3: calls.append})
+        self.assertEqual(calls, [7])
+        self.assertEqual(self.comm.writeback_bytes, len(message))
+
+    def test_single_attribute(self):
+        # runtimes that write back each attribute separately
+        holder = _Holder()
+        message = _rpc(0, [b"O" + struct.pack("<l", 1), b"s" + _string(b"x"),
+                           b"f" + struct.pack("<d", 0.5)])
+        for i in range(2):
+            self.serve(message, {1: holder})
+        self.assertEqual(holder.x, 0.5)
+        self.assertEqual(self.comm.writeback_bytes, 2*len(message))
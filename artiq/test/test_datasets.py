@@ -1,12 +1,23 @@
 """Tests for the (Env)Experiment-facing dataset interface."""
 
+import asyncio
 import copy
+import os
+import time
+import tempfile
 import unittest
 
-from sipyco.sync_struct import process_mod
+import h5py
+import lmdb
+import numpy as np
+
+from sipyco.sync_struct import Notifier, process_mod
+from sipyco import pyon
 
 from artiq.experiment import EnvExperiment
+from artiq.master.databases import DatasetDB, DatasetPublisher
 from artiq.master.worker_db import DatasetManager
+from artiq.master import worker_impl
 
 
 class MockDatasetDB:
@@ -132,3 +143,364 @@ class ExperimentDatasetCase(unittest.TestCase):
         self.assertEqual(self.dataset_db.get_metadata(KEY), {})
 
 
+
+
+class BatchedDatasetDB(MockDatasetDB):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def update_many(self, mods):
+        self.batches.append(mods)
+        for mod in mods:
+            self.update(mod)
+
+
+class BatchedBroadcastCase(unittest.TestCase):
+    def setUp(self):
+        self.dataset_db = BatchedDatasetDB()
+        self.dataset_mgr = DatasetManager(self.dataset_db,
+                                          broadcast_period=1000.0)
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+
+    def test_merge_appends(self):
+        self.exp.set(KEY, [], broadcast=True)
+        self.dataset_mgr.flush_broadcast()
+        for i in range(100):
+            self.exp.append(KEY, i)
+        self.exp.mutate_dataset(KEY, 0, -1)
+        self.exp.append(KEY, 100)
+        with self.assertRaises(KeyError):
+            self.dataset_db.get("bar")
+        self.assertEqual(self.dataset_db.get(KEY), [])
+
+        self.dataset_mgr.flush_broadcast()
+        self.assertEqual(self.dataset_db.get(KEY), [-1] + list(range(1, 101)))
+        self.assertEqual(len(self.dataset_db.batches), 2)
+        self.assertEqual(len(self.dataset_db.batches[1]), 3)
+
+    def test_replace(self):
+        self.exp.set(KEY, [0], broadcast=True)
+        self.exp.append(KEY, 1)
+        self.exp.mutate_dataset(KEY, 0, 2)
+        self.exp.set(KEY, [3], broadcast=True)
+        self.exp.append(KEY, 4)
+        self.exp.set("bar", 5, broadcast=True)
+        self.dataset_mgr.flush_broadcast()
+        self.assertEqual(self.dataset_db.get(KEY), [3, 4])
+        self.assertEqual(self.dataset_db.get("bar"), 5)
+        self.assertEqual(len(self.dataset_db.batches[0]), 2)
+
+    def test_period(self):
+        self.dataset_mgr.broadcast_period = 1e-9
+        self.exp.set(KEY, [], broadcast=True)
+        self.exp.append(KEY, 0)
+        self.assertEqual(self.dataset_db.get(KEY), [0])
+
+    def test_timer(self):
+        # The last modification is sent even if no other one follows.
+        self.dataset_mgr.broadcast_period = 0.05
+        self.exp.set(KEY, [], broadcast=True)
+        self.exp.append(KEY, 0)
+        deadline = time.monotonic() + 10.0
+        while not self.dataset_db.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.dataset_db.batches, [[
+            {"action": "setitem", "path": [], "key": KEY,
+             "value": (False, [0], {})}]])
+        self.assertEqual(self.dataset_db.get(KEY), [0])
+        self.assertIsNone(self.dataset_mgr._flush_timer)
+
+        self.exp.append(KEY, 1)
+        self.dataset_mgr.flush_broadcast()
+        self.assertIsNone(self.dataset_mgr._flush_timer)
+        time.sleep(0.1)
+        self.assertEqual(len(self.dataset_db.batches), 2)
+
+    def test_terminate_in_timer(self):
+        # The master may reply to the flush of the timer thread with a
+        # request to terminate, which must make the main thread exit.
+        ipc = _TerminateIPC()
+        worker_impl.ipc = ipc
+        try:
+            dataset_mgr = DatasetManager(worker_impl.ParentDatasetDB,
+                                         broadcast_period=0.05)
+            exp = TestExperiment((None, dataset_mgr, None, None))
+            exp.set(KEY, [], broadcast=True)
+            exp.append(KEY, 0)
+            deadline = time.monotonic() + 10.0
+            while not ipc.requests and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(ipc.requests, 1)
+
+            # The main thread exits at its next request, without sending it,
+            # or when completing its action.
+            exp.append(KEY, 1)
+            with self.assertRaises(SystemExit):
+                dataset_mgr.flush_broadcast()
+            with self.assertRaises(SystemExit):
+                worker_impl.put_completed()
+            self.assertEqual(ipc.requests, 1)
+        finally:
+            worker_impl.ipc = None
+            worker_impl.terminate_requested = False
+
+
+class _TerminateIPC:
+    # Replies to every request of the worker with a request to terminate.
+    def __init__(self):
+        self.requests = 0
+
+    def write(self, data):
+        self.requests += 1
+
+    def readline(self):
+        return (pyon.encode({"action": "terminate"}) + "\n").encode()
+
+
+class DatasetPublisherCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        store = {
+            "list": (False, [0], {}),
+            "array": (False, np.zeros(100), {}),
+        }
+        self.data = Notifier(store)
+        self.publisher = DatasetPublisher(store, period=1000.0)
+        self.data.publish = self.publisher.process_mod
+        self.mods = []
+        self.publisher.notifier.publish = self.mods.append
+        self.subscriber = copy.deepcopy(store)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, f):
+        async def wrapper():
+            f()
+        self.loop.run_until_complete(wrapper())
+
+    def _sync(self):
+        for mod in self.mods:
+            process_mod(self.subscriber, copy.deepcopy(mod))
+        self.mods.clear()
+        self.assertEqual(self.subscriber.keys(), self.data.raw_view.keys())
+        for key, (persist, value, metadata) in self.data.raw_view.items():
+            np.testing.assert_equal(self.subscriber[key][1], value)
+
+    def test_slices(self):
+        def modify():
+            for i in range(100):
+                self.data["list"][1].append(i)
+            self.data["list"][1][0] = -1
+            self.data["array"][1][10] = 1
+            self.data["array"][1][20:30] = 2
+            self.data["array"][1][5, ...] = 3
+            self.assertEqual(self.mods, [])
+        self._run(modify)
+        self.publisher.flush()
+        self.assertEqual(len(self.mods), 2)
+        array_mod = self.mods[1]
+        self.assertEqual(array_mod["path"], ["array", 1])
+        self.assertEqual(array_mod["key"], slice(5, 30))
+        self._sync()
+
+    def test_replace(self):
+        def modify():
+            for i in range(10):
+                self.data["array"] = (False, np.full(100, i), {})
+            self.data["array"][1][0] = -1
+            self.assertEqual(self.mods, [])
+        self._run(modify)
+        self.publisher.flush()
+        self.assertEqual(len(self.mods), 1)
+        self.assertEqual(self.mods[0]["path"], [])
+        self._sync()
+
+    def test_create_delete(self):
+        def modify():
+            self.data["new"] = (False, [], {})
+            self.assertEqual(len(self.mods), 1)
+            self.data["new"][1].append(1)
+            del self.data["list"]
+            self.assertEqual(len(self.mods), 2)
+            self._sync()
+            del self.data["new"]
+            self.assertEqual(len(self.mods), 1)
+        self._run(modify)
+        self.publisher.flush()
+        self.assertEqual(len(self.mods), 1)
+        self._sync()
+
+    def test_period(self):
+        self.publisher.period = 0.0
+        async def modify():
+            self.data["list"][1].append(1)
+            self.data["list"][1].append(2)
+            self.assertEqual(self.mods, [])
+            await asyncio.sleep(0)
+            self.assertEqual(len(self.mods), 1)
+        self.loop.run_until_complete(modify())
+        self._sync()
+
+
+class DatasetDBPersistCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.persist_file = os.path.join(self.tempdir.name, "dataset_db.mdb")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _records(self):
+        env = lmdb.open(self.persist_file, subdir=False)
+        try:
+            with env.begin() as txn:
+                return {key.decode(): record for key, record in txn.cursor()}
+        finally:
+            env.close()
+
+    def test_migrate(self):
+        env = lmdb.open(self.persist_file, subdir=False)
+        with env.begin(write=True) as txn:
+            txn.put(b"legacy", pyon.encode(([1, 2], {"unit": "s"})).encode())
+        env.close()
+
+        dataset_db = DatasetDB(self.persist_file, compression="zlib")
+        self.assertEqual(dataset_db.get("legacy"), [1, 2])
+        self.assertEqual(dataset_db.get_metadata("legacy"), {"unit": "s"})
+        dataset_db.save()
+        dataset_db.close_db()
+        self.assertEqual(self._records()["legacy"][0], 1)
+
+        dataset_db = DatasetDB(self.persist_file)
+        self.assertEqual(dataset_db.get("legacy"), [1, 2])
+        self.assertEqual(dataset_db.get_metadata("legacy"), {"unit": "s"})
+        dataset_db.close_db()
+
+    def test_modify_while_saving(self):
+        dataset_db = DatasetDB(self.persist_file)
+        dataset_db.set("list", [0, 1], persist=True)
+        # as done by save_async() before the executor encodes the records
+        records = dataset_db._take_pending()
+        dataset_db.update({"action": "append", "path": ["list", 1], "x": 2})
+        dataset_db.update({"action": "append", "path": ["list", 1], "x": 3})
+        dataset_db._write(records)
+        dataset_db._release(records)
+        self.assertEqual(dataset_db._saving, dict())
+        self.assertEqual(dataset_db.get("list"), [0, 1, 2, 3])
+        dataset_db.close_db()
+
+        dataset_db = DatasetDB(self.persist_file)
+        self.assertEqual(dataset_db.get("list"), [0, 1])
+        dataset_db.close_db()
+
+    def test_arrays(self):
+        array = np.arange(10000, dtype=np.int32).reshape(100, 100)
+        dataset_db = DatasetDB(self.persist_file)
+        dataset_db.set("array", array, persist=True)
+        dataset_db.set("volatile", 1)
+        dataset_db.save()
+        dataset_db.update({"action": "setitem", "path": ["array", 1],
+                           "key": 0, "value": -1})
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(dataset_db.save_async())
+        finally:
+            loop.close()
+        dataset_db.close_db()
+
+        self.assertEqual(set(self._records()), {"array"})
+        self.assertLess(len(self._records()["array"]), array.nbytes + 1000)
+        dataset_db = DatasetDB(self.persist_file)
+        array[0] = -1
+        np.testing.assert_equal(dataset_db.get("array"), array)
+        dataset_db.get("array")[1] = 0
+        dataset_db.close_db()
+
+    def test_lazy(self):
+        arrays = {"array{}".format(i): np.full(1000, i) for i in range(10)}
+        dataset_db = DatasetDB(self.persist_file)
+        for key, array in arrays.items():
+            dataset_db.set(key, array, persist=True, metadata={"i": key})
+        dataset_db.save()
+        dataset_db.close_db()
+
+        dataset_db = DatasetDB(self.persist_file, lazy=True,
+                               cache_size=3.5*arrays["array0"].nbytes)
+        self.assertEqual(dataset_db.get_metadata("array5"), {"i": "array5"})
+        for key, array in arrays.items():
+            np.testing.assert_equal(dataset_db.get(key), array)
+        self.assertEqual(len(dataset_db._cache), 3)
+
+        dataset_db.update({"action": "setitem", "path": ["array0", 1],
+                           "key": 0, "value": -1})
+        arrays["array0"][0] = -1
+        dataset_db.set("array1", np.zeros(3))
+        arrays["array1"] = np.zeros(3)
+        dataset_db.delete("array2")
+        del arrays["array2"]
+        snapshot = dataset_db.get_notifiers()["datasets"].raw_view
+        self.assertEqual(set(snapshot), set(arrays))
+        for key, array in arrays.items():
+            np.testing.assert_equal(snapshot[key][1], array)
+        self.assertEqual(len(dataset_db._cache), 3)
+        dataset_db.save()
+        dataset_db.close_db()
+
+        dataset_db = DatasetDB(self.persist_file)
+        for key, array in arrays.items():
+            np.testing.assert_equal(dataset_db.get(key), array)
+        dataset_db.close_db()
+
+
+class StreamedDatasetCase(unittest.TestCase):
+    def setUp(self):
+        self.file = h5py.File("results.h5", "w", driver="core",
+                              backing_store=False)
+        self.dataset_mgr = DatasetManager(MockDatasetDB(),
+                                          results_file=lambda: self.file,
+                                          stream_flush_period=1000.0)
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_list(self):
+        self.exp.set(KEY, [], stream=True, unit="s")
+        for i in range(10):
+            self.exp.append(KEY, [i, i])
+        self.assertNotIn(KEY, self.file["datasets"])
+        self.dataset_mgr.flush_streams()
+        np.testing.assert_equal(self.file["datasets"][KEY][()], self.exp.get(KEY))
+        self.assertEqual(self.file["datasets"][KEY].attrs["unit"], "s")
+
+        for i in range(10, 20):
+            self.exp.append(KEY, [i, i])
+        self.exp.mutate_dataset(KEY, 0, [-1, -1])
+        self.exp.mutate_dataset(KEY, (12, 14), [[-2, -2], [-3, -3]])
+        self.dataset_mgr.flush_streams()
+        np.testing.assert_equal(self.file["datasets"][KEY][()], self.exp.get(KEY))
+
+    def test_array(self):
+        self.exp.set(KEY, np.zeros((4, 4)), stream=True)
+        np.testing.assert_equal(self.file["datasets"][KEY][()], np.zeros((4, 4)))
+        self.exp.mutate_dataset(KEY, ((1, 3), (0, 2)), 1)
+        self.exp.mutate_dataset(KEY, -1, 2)
+        self.dataset_mgr.flush_streams()
+        np.testing.assert_equal(self.file["datasets"][KEY][()], self.exp.get(KEY))
+
+    def test_write_hdf5(self):
+        self.exp.set(KEY, [1], stream=True)
+        self.exp.set("bar", 2)
+        self.exp.append(KEY, 2)
+        self.dataset_mgr.write_hdf5(self.file)
+        np.testing.assert_equal(self.file["datasets"][KEY][()], [1, 2])
+        self.assertEqual(self.file["datasets"]["bar"][()], 2)
+
+        self.exp.set(KEY, np.arange(3), stream=True)
+        np.testing.assert_equal(self.file["datasets"][KEY][()], np.arange(3))
+
+    def test_not_streamable(self):
+        with self.assertRaises(TypeError):
+            self.exp.set(KEY, 1, stream=True)
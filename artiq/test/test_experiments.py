@@ -0,0 +1,144 @@
+import os
+import asyncio
+import logging
+import tempfile
+import unittest
+
+from artiq.master.experiments import _ScanCache, _RepoScanner
+
+
+_experiment_source = """
+from artiq.experiment import *
+
+
+class {class_name}(EnvExperiment):
+    \"\"\"{name}\"\"\"
+    def build(self):
+        self.setattr_argument("n", NumberValue(1))
+
+    def run(self):
+        pass
+"""
+
+
+class ScanCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.persist_file = os.path.join(self.tmpdir.name, "scan_cache.pyon")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hit_miss(self):
+        cache = _ScanCache()
+        cache.start_scan("ddb", "repo")
+        self.assertIsNone(cache.get("exp.py", "a"))
+        cache.put("exp.py", "a", {"Exp": {"name": "Exp"}})
+        cache.finish_scan("")
+
+        cache.start_scan("ddb", "repo")
+        self.assertEqual(cache.get("exp.py", "a"), {"Exp": {"name": "Exp"}})
+        self.assertIsNone(cache.get("exp.py", "b"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.start_scan("other_ddb", "repo")
+        self.assertIsNone(cache.get("exp.py", "a"))
+        cache.start_scan("ddb", "other_repo")
+        self.assertIsNone(cache.get("exp.py", "a"))
+
+    def test_persist(self):
+        cache = _ScanCache(self.persist_file)
+        cache.start_scan("ddb", "repo")
+        cache.get("exp.py", "a")
+        cache.put("exp.py", "a", {"Exp": {"name": "Exp"}})
+        cache.get("sub/exp.py", "b")
+        cache.put("sub/exp.py", "b", {})
+        cache.finish_scan("")
+
+        cache = _ScanCache(self.persist_file)
+        cache.start_scan("ddb", "repo")
+        self.assertEqual(cache.get("exp.py", "a"), {"Exp": {"name": "Exp"}})
+        # sub/exp.py has been deleted
+        cache.finish_scan("")
+
+        cache = _ScanCache(self.persist_file)
+        self.assertEqual(list(cache.entries.keys()), ["exp.py"])
+
+    def test_corrupted(self):
+        with open(self.persist_file, "w") as f:
+            f.write("garbage{")
+        cache = _ScanCache(self.persist_file)
+        self.assertEqual(cache.entries, dict())
+
+
+class RepoScannerCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.mkdir(os.path.join(self.root, "sub"))
+        for filename, class_name, name in [
+                ("a.py", "A", "Alpha"),
+                ("b.py", "B", "Alpha"),
+                ("c.py", "C", "Gamma"),
+                ("d.py", "D", "Delta"),
+                ("sub/e.py", "E", "Alpha"),
+                ("sub/f.py", "F", "Zeta")]:
+            self.write(filename, _experiment_source.format(
+                class_name=class_name, name=name))
+        self.write("broken.py", "import nonexistent_module\n")
+        self.write("sub/broken.py", "class (\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        self.loop.close()
+
+    def write(self, filename, source):
+        with open(os.path.join(self.root, filename), "w") as f:
+            f.write(source)
+
+    def scan(self, workers, cache=None):
+        scanner = _RepoScanner({"get_device_db": lambda: {}}, cache,
+                               workers=workers)
+        # Broken files are logged and skipped.
+        logging.disable(logging.WARNING)
+        try:
+            return self.loop.run_until_complete(
+                asyncio.wait_for(scanner.scan(self.root), 60.0))
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_workers(self):
+        serial = self.scan(1)
+        self.assertEqual(sorted(serial.keys()),
+                         ["Alpha", "Alpha1", "Delta", "Gamma",
+                          "sub/Alpha", "sub/Zeta"])
+        # Duplicate names are renamed in directory order, independently
+        # of the order in which files are examined.
+        alpha = {serial["Alpha"]["file"], serial["Alpha1"]["file"]}
+        self.assertEqual(alpha, {"a.py", "b.py"})
+        self.assertEqual(serial["sub/Alpha"]["file"], os.path.join("sub", "e.py"))
+        self.assertEqual(serial["Gamma"]["arginfo"]["n"][0]["ty"], "NumberValue")
+        for workers in 3, 16:
+            self.assertEqual(self.scan(workers), serial)
+
+    def test_imported_module(self):
+        self.write("helper.py", "DEFAULT = 1\n")
+        self.write("g.py", _experiment_source.format(
+            class_name="G", name="Eta").replace(
+                "NumberValue(1)", "NumberValue(helper.DEFAULT)").replace(
+                "from artiq.experiment import *",
+                "from artiq.experiment import *\nimport helper"))
+        cache = _ScanCache()
+        entries = self.scan(1, cache)
+        self.assertEqual(entries["Eta"]["arginfo"]["n"][0]["default"], 1)
+
+        self.scan(1, cache)
+        self.assertEqual(cache.misses, 2)  # broken files
+
+        # Experiments are examined again when a module they may import changes.
+        self.write("helper.py", "DEFAULT = 2\n")
+        entries = self.scan(1, cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(entries["Eta"]["arginfo"]["n"][0]["default"], 2)
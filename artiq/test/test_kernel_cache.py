@@ -0,0 +1,275 @@
+import os
+import linecache
+import struct
+import tempfile
+import unittest
+import importlib.util
+
+from artiq.coredevice.core import Core, _compile_llvm_ir
+from artiq.master.worker_db import DeviceManager
+from artiq.compiler import embedding
+from artiq.compiler.embedding import Stitcher
+from artiq.compiler.module import Module
+from artiq.compiler.kernel_cache import (CompilationCache, CacheEntry,
+                                         mark_embedding_map)
+from artiq.language.core import kernel
+
+
+def _entry(size):
+    return CacheEntry([b"O" * size, b"P"], b"S" * size, ["0:foo.Bar"], [(1, 0), (2, 3)])
+
+
+class CompilationCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_entry_roundtrip(self):
+        entry = _entry(10)
+        decoded = CacheEntry.from_bytes(entry.to_bytes())
+        self.assertEqual(decoded.objects, entry.objects)
+        self.assertEqual(decoded.object_keys, entry.object_keys)
+        self.assertEqual(decoded.stripped_library, entry.stripped_library)
+        self.assertEqual(decoded.strings, entry.strings)
+
+        data = entry.to_bytes()
+        with self.assertRaises(ValueError):
+            CacheEntry.from_bytes(data[:-1])
+        with self.assertRaises(ValueError):
+            CacheEntry.from_bytes(data + b"\x00")
+        with self.assertRaises(ValueError):
+            CacheEntry.from_bytes(b"XXXX" + data[4:])
+        with self.assertRaises(struct.error):
+            CacheEntry.from_bytes(data[:8])
+
+    def test_key(self):
+        key = CompilationCache.key("digest", "rv32g", 1e-9)
+        self.assertEqual(key, CompilationCache.key("digest", "rv32g", 1e-9))
+        self.assertNotEqual(key, CompilationCache.key("digest", "rv32ima", 1e-9))
+
+    def test_memory_lru(self):
+        cache = CompilationCache(max_memory_entries=2)
+        for key in "abc":
+            cache.put(key, _entry(1))
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_disk(self):
+        cache = CompilationCache(self.tmpdir.name)
+        cache.put("a", _entry(100))
+
+        cache = CompilationCache(self.tmpdir.name)
+        entry = cache.get("a")
+        self.assertEqual(entry.objects, [b"O" * 100, b"P"])
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_disk_eviction(self):
+        entry_size = len(_entry(100).to_bytes())
+        cache = CompilationCache(self.tmpdir.name, max_memory_entries=0,
+                                 max_disk_size=2*entry_size)
+        cache.put("a", _entry(100))
+        os.utime(os.path.join(self.tmpdir.name, "a.kcache"), (0, 0))
+        cache.put("b", _entry(100))
+        cache.put("c", _entry(100))
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_corrupted(self):
+        cache = CompilationCache(self.tmpdir.name)
+        for key, data in [("a", b"garbage"), ("b", _entry(100).to_bytes()[:-10])]:
+            path = os.path.join(self.tmpdir.name, key + ".kcache")
+            with open(path, "wb") as f:
+                f.write(data)
+            self.assertIsNone(cache.get(key))
+            self.assertFalse(os.path.exists(path))
+
+
+class _Holder:
+    def __init__(self, core):
+        self.core = core
+        self.x = 1
+        self.y = 2.0
+        self.kernel_invariants = {"x"}
+
+    def notify(self, value):
+        pass
+
+    @kernel
+    def run(self):
+        self.notify(self.x)
+        if self.y < 0.0:
+            raise ValueError("negative")
+
+
+class StitcherCacheCase(unittest.TestCase):
+    def setUp(self):
+        devices = dict()
+        self.dmgr = DeviceManager(None, devices)
+        self.core = devices["core"] = Core(self.dmgr, host=None, ref_period=1e-9,
+                                           compilation_cache=False)
+        self.holder = _Holder(self.core)
+
+    def stitch(self, holder=None):
+        stitcher = Stitcher(core=self.core, dmgr=self.dmgr)
+        stitcher.stitch_call(_Holder.run, (holder or self.holder,), {})
+        stitcher.finalize()
+        return stitcher
+
+    def test_digest(self):
+        digest = self.stitch().digest()
+        self.assertEqual(self.stitch().digest(), digest)
+
+        self.holder.x = 3
+        self.assertNotEqual(self.stitch().digest(), digest)
+        self.holder.x = 1
+        self.assertEqual(self.stitch().digest(), digest)
+
+        self.holder.y = -1.0
+        self.assertNotEqual(self.stitch().digest(), digest)
+        self.holder.y = 2.0
+
+        self.holder.kernel_invariants = {"x", "y"}
+        self.assertNotEqual(self.stitch().digest(), digest)
+
+    def test_replay(self):
+        self.core.compilation_cache = CompilationCache()
+
+        # Record an entry the way the backend of a compilation does, without
+        # linking a library.
+        stitcher = self.stitch()
+        target = self.core.target_cls()
+        key = self.core._compilation_cache_key(stitcher, target, True)
+        host_values = stitcher.host_values()
+        mark = mark_embedding_map(stitcher.embedding_map)
+        target.generate_llvm_ir(Module(stitcher, ref_period=self.core.ref_period))
+        entry = CacheEntry.record([b"object"], b"library", stitcher.embedding_map,
+                                  mark, host_values)
+        self.assertIsNotNone(entry)
+        self.assertIn("0:ValueError", entry.strings)
+        self.core.compilation_cache.put(key, entry)
+
+        holder = _Holder(self.core)
+        embedding_map, llvm_job, backend, _ = self.core._compile_frontend(
+            _Holder.run, (holder,), {}, None, True, True, None, 0, [], {})
+        self.assertEqual(self.core.compilation_cache.stats()["hits"], 1)
+        self.assertIsNone(llvm_job)
+        self.assertEqual(backend(None)[0], b"library")
+        self.assertEqual(embedding_map.str_forward_map,
+                         stitcher.embedding_map.str_forward_map)
+        # Object IDs refer to the objects of the new compilation.
+        replayed = {key: type(obj) for key, obj in
+                    embedding_map.object_forward_map.items()}
+        recorded = {key: type(obj) for key, obj in
+                    stitcher.embedding_map.object_forward_map.items()}
+        self.assertEqual(replayed, recorded)
+        self.assertIn(holder, embedding_map.object_forward_map.values())
+        self.assertNotIn(self.holder, embedding_map.object_forward_map.values())
+
+        holder.y = 3.0
+        self.core._compile_frontend(
+            _Holder.run, (holder,), {}, None, True, True, None, 0, [], {})
+        self.assertEqual(self.core.compilation_cache.stats()["misses"], 1)
+
+    def test_replay_mismatch(self):
+        self.core.compilation_cache = CompilationCache()
+        target_cls = self.core.target_cls
+
+        class UnlinkedTarget(target_cls):
+            def link(self, objects, strip=False):
+                return b"library"
+        self.core.target_cls = UnlinkedTarget
+
+        # A first compilation records a good entry.
+        _, llvm_job, backend, _ = self.core._compile_frontend(
+            _Holder.run, (self.holder,), {}, None, True, True, None, 0, [], {})
+        backend(_compile_llvm_ir(*llvm_job))
+        stitcher = self.stitch()
+        key = self.core._compilation_cache_key(stitcher, UnlinkedTarget(), True)
+        entry = self.core.compilation_cache.get(key)
+        self.assertIn("0:ValueError", entry.strings)
+        self.assertTrue(entry.object_keys)
+
+        # The strings of this entry can be replayed, but not its objects.
+        bad_entry = CacheEntry(entry.objects, entry.stripped_library, entry.strings,
+                               [(obj_key + 100, index)
+                                for obj_key, index in entry.object_keys])
+        embedding_map = stitcher.embedding_map
+        strings = dict(embedding_map.str_forward_map)
+        objects = dict(embedding_map.object_forward_map)
+        self.assertFalse(bad_entry.replay(embedding_map, stitcher.host_values()))
+        self.assertEqual(embedding_map.str_forward_map, strings)
+        self.assertEqual(embedding_map.object_forward_map, objects)
+
+        # After a failed replay, the compilation records a complete entry.
+        self.core.compilation_cache.put(key, bad_entry)
+        _, llvm_job, backend, _ = self.core._compile_frontend(
+            _Holder.run, (self.holder,), {}, None, True, True, None, 0, [], {})
+        backend(_compile_llvm_ir(*llvm_job))
+        self.assertEqual(self.core.compilation_cache.get(key).strings, entry.strings)
+        self.assertEqual(self.core.compilation_cache.get(key).object_keys,
+                         entry.object_keys)
+
+
+_library_source = """
+from artiq.language.core import kernel
+
+@kernel
+def factor():
+    return {}
+"""
+
+
+class FunctionSyntaxCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "library.py")
+        self.write_library(2)
+        spec = importlib.util.spec_from_file_location("library", self.filename)
+        self.library = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.library)
+        devices = dict()
+        self.dmgr = DeviceManager(None, devices)
+        devices["core"] = Core(self.dmgr, host=None, ref_period=1e-9,
+                               compilation_cache=False)
+
+    def tearDown(self):
+        linecache.checkcache(self.filename)
+        self.tmpdir.cleanup()
+
+    def write_library(self, factor):
+        with open(self.filename, "w") as f:
+            f.write(_library_source.format(factor))
+        linecache.checkcache(self.filename)
+
+    def stitch(self):
+        stitcher = Stitcher(core=self.dmgr.get("core"), dmgr=self.dmgr)
+        stitcher.stitch_call(self.library.factor, (), {})
+        stitcher.finalize()
+        function_node, = [node for node in stitcher.typedtree.body
+                          if "factor" in getattr(node, "name", "")]
+        return function_node
+
+    def cached(self):
+        return embedding._function_syntax_cache[(self.filename, 4)]
+
+    def test_reuse(self):
+        first = self.stitch()
+        cached = self.cached()
+        second = self.stitch()
+        self.assertIs(self.cached(), cached)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.name, second.name)
+        self.assertEqual(str(first.signature_type), str(second.signature_type))
+
+    def test_source_change(self):
+        self.stitch()
+        self.write_library(30)
+        function_node = self.stitch()
+        self.assertIn("return 30", self.cached()[0])
+        self.assertEqual(function_node.body[0].value.n, 30)
@@ -0,0 +1,57 @@
+import unittest
+
+from llvmlite import ir as ll
+
+from artiq.coredevice.core import get_opt_level
+from artiq.compiler.targets import RV32GTarget
+from artiq.language.core import kernel
+
+
+@kernel
+def default():
+    pass
+
+
+@kernel(flags={"fast-math", "O3"})
+def aggressive():
+    pass
+
+
+@kernel(flags={"O0", "O1"})
+def conflicting():
+    pass
+
+
+def _module():
+    llmodule = ll.Module()
+    llfunc = ll.Function(llmodule, ll.FunctionType(ll.IntType(32), []), "answer")
+    llbuilder = ll.IRBuilder(llfunc.append_basic_block("entry"))
+    llslot = llbuilder.alloca(ll.IntType(32))
+    llbuilder.store(ll.Constant(ll.IntType(32), 42), llslot)
+    llbuilder.ret(llbuilder.load(llslot))
+    return llmodule
+
+
+class OptLevelCase(unittest.TestCase):
+    def test_flags(self):
+        self.assertEqual(get_opt_level(default, 2), 2)
+        self.assertEqual(get_opt_level(aggressive, 2), 3)
+        with self.assertRaises(ValueError):
+            get_opt_level(conflicting, 2)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            RV32GTarget(opt_level=4)
+
+    def test_levels(self):
+        for opt_level in RV32GTarget.opt_levels:
+            target = RV32GTarget(opt_level=opt_level)
+            llfunc = target.optimize_llvm_ir(_module()).get_function("answer")
+            if opt_level == 0:
+                self.assertIn("alloca", str(llfunc))
+            else:
+                self.assertNotIn("alloca", str(llfunc))
+                self.assertIn("ret i32 42", str(llfunc))
+            self.assertEqual(set(target.timings), {"llvm_ir", "optimization"})
+            target.assemble(target.optimize_llvm_ir(_module()))
+            self.assertIn("assembly", target.timings)
@@ -3,9 +3,10 @@ import logging
 import asyncio
 import sys
 from time import time, sleep
+from unittest import mock
 
 from artiq.experiment import *
-from artiq.master.scheduler import Scheduler
+from artiq.master.scheduler import Scheduler, RunStatus
 
 
 class EmptyExperiment(EnvExperiment):
@@ -41,6 +42,19 @@ class CheckPauseBackgroundExperiment(EnvExperiment):
             self.scheduler.pause()
 
 
+class CheckTerminationBackgroundExperiment(EnvExperiment):
+    def build(self):
+        self.setattr_device("scheduler")
+
+    def run(self):
+        while not self.scheduler.check_termination():
+            if self.scheduler.check_pause():
+                self.scheduler.pause()
+            sleep(0.01)
+        self.set_dataset("termination_ok", True,
+                         broadcast=True, archive=False)
+
+
 def _get_expid(name):
     return {
         "log_level": logging.WARNING,
@@ -73,6 +87,18 @@ def _get_basic_steps(rid, expid, priority=0, flush=False):
     ]
 
 
+def _without_timestamps(mod):
+    """Removes the run timestamps from a schedule modification, whose
+    values vary. Returns ``None`` if only a timestamp is modified."""
+    if mod["path"][1:] == ["timestamps"]:
+        return None
+    if mod["action"] == "setitem" and mod["path"] == []:
+        value = dict(mod["value"])
+        del value["timestamps"]
+        mod = dict(mod, value=value)
+    return mod
+
+
 class _RIDCounter:
     def __init__(self, next_rid):
         self._next_rid = next_rid
@@ -98,6 +124,9 @@ class SchedulerCase(unittest.TestCase):
         expect_idx = 0
         def notify(mod):
             nonlocal expect_idx
+            mod = _without_timestamps(mod)
+            if mod is None:
+                return
             self.assertEqual(mod, expect[expect_idx])
             expect_idx += 1
             if expect_idx >= len(expect):
@@ -263,6 +292,9 @@ class SchedulerCase(unittest.TestCase):
         expect_idx = 0
         def notify(mod):
             nonlocal expect_idx
+            mod = _without_timestamps(mod)
+            if mod is None:
+                return
             self.assertEqual(mod, expect[expect_idx])
             expect_idx += 1
             if expect_idx >= len(expect):
@@ -306,6 +338,9 @@ class SchedulerCase(unittest.TestCase):
         expect_idx = 0
         def notify(mod):
             nonlocal expect_idx
+            mod = _without_timestamps(mod)
+            if mod is None:
+                return
             if mod == {"path": [0],
                        "value": "running",
                        "key": "status",
@@ -347,6 +382,51 @@ class SchedulerCase(unittest.TestCase):
 
         loop.run_until_complete(scheduler.stop())
 
+    def test_pause_flags(self):
+        """Check that the worker answers check_pause and check_termination
+        from the state pushed by the master, without requests."""
+        loop = self.loop
+
+        termination_ok = asyncio.Event()
+        def update_dataset(mod):
+            if mod["key"] == "termination_ok":
+                termination_ok.set()
+        # no scheduler_check_pause or scheduler_check_termination handlers
+        handlers = {
+            "update_dataset": update_dataset
+        }
+        scheduler = Scheduler(_RIDCounter(0), handlers, None, None)
+
+        expid_bg = _get_expid("CheckTerminationBackgroundExperiment")
+        expid = _get_expid("EmptyExperiment")
+
+        background_running = asyncio.Event()
+        empty_completed = asyncio.Event()
+        def notify(mod):
+            if mod == {"path": [0],
+                       "value": "running",
+                       "key": "status",
+                       "action": "setitem"}:
+                background_running.set()
+            if mod == {"path": [], "key": 1, "action": "delitem"}:
+                empty_completed.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start(loop=loop)
+        scheduler.submit("main", expid_bg, -99, None, False)
+        loop.run_until_complete(background_running.wait())
+
+        # The background run pauses for the higher priority run.
+        scheduler.submit("main", expid, 0, None, False)
+        loop.run_until_complete(
+            asyncio.wait_for(empty_completed.wait(), 10.0))
+
+        scheduler.request_termination(0)
+        loop.run_until_complete(
+            asyncio.wait_for(termination_ok.wait(), 10.0))
+
+        loop.run_until_complete(scheduler.stop())
+
     def test_close_with_active_runs(self):
         """Check scheduler exits with experiments still running"""
         loop = self.loop
@@ -405,6 +485,9 @@ class SchedulerCase(unittest.TestCase):
         expect_idx = 0
         def notify(mod):
             nonlocal expect_idx
+            mod = _without_timestamps(mod)
+            if mod is None:
+                return
             if mod == {"path": [0],
                        "value": "preparing",
                        "key": "status",
@@ -424,5 +507,121 @@ class SchedulerCase(unittest.TestCase):
         loop.run_until_complete(done.wait())
         loop.run_until_complete(scheduler.stop())
 
+    def test_worker_pool(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None, None,
+                              worker_pool_size=1, worker_max_runs=2)
+        expid = _get_expid("EmptyExperiment")
+
+        done = asyncio.Event()
+        deleted = 0
+        def notify(mod):
+            nonlocal deleted
+            if mod["action"] == "delitem":
+                deleted += 1
+                done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start(loop=loop)
+        pool = scheduler._worker_pool
+        async def wait_idle():
+            while not pool._idle:
+                await asyncio.sleep(0.1)
+        for i in range(3):
+            done.clear()
+            loop.run_until_complete(wait_idle())
+            scheduler.submit("main", expid, 0, None, False)
+            loop.run_until_complete(done.wait())
+        self.assertEqual(deleted, 3)
+        stats = scheduler.get_worker_pool_stats()
+        self.assertEqual(stats["handed_out"], 3)
+        self.assertEqual(stats["reused"], 1)
+        self.assertGreater(stats["startup_time_saved"], 0.0)
+
+        scheduler.notifier.publish = None
+        loop.run_until_complete(scheduler.stop())
+        self.assertEqual(pool._idle, [])
+
+    def test_run_stats(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None, None)
+        expid = _get_expid("EmptyExperiment")
+
+        timestamps = dict()
+        done = asyncio.Event()
+        def notify(mod):
+            if mod["path"] == [0, "timestamps"]:
+                timestamps[mod["key"]] = mod["value"]
+            elif mod["path"] == [] and mod["key"] == 0 \
+                    and mod["action"] == "setitem":
+                timestamps.update(mod["value"]["timestamps"])
+            elif mod["action"] == "delitem":
+                done.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start(loop=loop)
+        for i in range(2):
+            done.clear()
+            scheduler.submit("main", expid, 0, None, False)
+            loop.run_until_complete(done.wait())
+        self.assertEqual(list(timestamps.keys()),
+                         ["pending", "preparing", "prepare_done", "running",
+                          "run_done", "analyzing", "deleting"])
+        self.assertEqual(sorted(timestamps.values()),
+                         list(timestamps.values()))
+
+        stats = scheduler.get_run_stats()
+        for name in ("pending", "preparing", "running", "analyzing",
+                     "spawn", "build", "prepare", "run", "analyze",
+                     "write_results"):
+            self.assertEqual(stats[name]["count"], 2, name)
+            self.assertLessEqual(stats[name]["p50"], stats[name]["max"])
+        # not flushed, and no requests to the master
+        self.assertNotIn("flushing", stats)
+        self.assertNotIn("ipc", stats)
+        # spawning the worker process is part of the preparation
+        self.assertGreater(stats["preparing"]["mean"], stats["spawn"]["mean"])
+
+        loop.run_until_complete(scheduler.stop())
+
+    def test_many_runs(self):
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None, None)
+        scheduler.start(loop=loop)
+        expid = _get_expid("EmptyExperiment")
+
+        count = 10000
+        late = time() + 100000
+        for i in range(count):
+            scheduler.submit("main", expid, i % 10, late + i, False)
+
+        pool = scheduler._pipelines["main"].pool
+        prepare = scheduler._pipelines["main"]._prepare
+        pool.runs[0].status = RunStatus.running
+        pool.runs[5].status = RunStatus.prepare_done
+
+        def get_run(now):
+            with mock.patch("artiq.master.scheduler.time", return_value=now):
+                return prepare._get_run()
+
+        # Runs 1 to 4 are due earlier but do not take precedence over the
+        # prepared run 5: wait for the due date of run 6.
+        self.assertEqual(get_run(late), 6.0)
+        self.assertEqual(get_run(late + 3.5), 2.5)
+        self.assertIs(get_run(late + 6.5), pool.runs[6])
+        # only runs of priority 7 to 9 take precedence over run 6
+        pool.runs[6].status = RunStatus.prepare_done
+        self.assertEqual(get_run(late + 6.5), 0.5)
+
+        self.assertTrue(scheduler.check_pause(0))
+        self.assertFalse(scheduler.check_pause(5))
+        pool.runs[5].status = RunStatus.running
+        pool.runs[6].status = RunStatus.running
+        self.assertFalse(scheduler.check_pause(0))
+        # without prepared runs, the highest priority due run is picked
+        self.assertIs(get_run(late + 6.5), pool.runs[4])
+
+        loop.run_until_complete(scheduler.stop())
+
     def tearDown(self):
         self.loop.close()
@@ -1,11 +1,15 @@
 import unittest
 import logging
 import asyncio
+import os
 import sys
 from time import sleep
 
+import numpy as np
+
 from artiq.experiment import *
 from artiq.master.worker import *
+from artiq.master import worker_ipc
 
 
 class SimpleExperiment(EnvExperiment):
@@ -52,6 +56,16 @@ class WatchdogTimeoutInBuild(EnvExperiment):
         pass
 
 
+class BroadcastArray(EnvExperiment):
+    def build(self):
+        pass
+
+    def run(self):
+        self.set_dataset("array", np.arange(1000, dtype=np.int32).reshape(10, 100),
+                         broadcast=True)
+        self.set_dataset("text", ["a", "b"], broadcast=True)
+
+
 async def _call_worker(worker, expid):
     try:
         await worker.build(0, "main", None, expid, 0)
@@ -67,14 +81,15 @@ class WorkerCase(unittest.TestCase):
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
 
-    def _run_experiment(self, class_name):
+    def _run_experiment(self, class_name, handlers=dict(),
+                        framing=worker_ipc.BINARY):
         expid = {
             "log_level": logging.WARNING,
             "file": sys.modules[__name__].__file__,
             "class_name": class_name,
             "arguments": dict()
         }
-        worker = Worker({})
+        worker = Worker(handlers, framing=framing)
         self.loop.run_until_complete(_call_worker(worker, expid))
 
     def test_simple_run(self):
@@ -99,5 +114,37 @@ class WorkerCase(unittest.TestCase):
         with self.assertRaises(WorkerWatchdogTimeout):
             self._run_experiment("WatchdogTimeoutInBuild")
 
+    def test_framing(self):
+        for framing in worker_ipc.TEXT, worker_ipc.BINARY:
+            mods = []
+            self._run_experiment("BroadcastArray",
+                                 {"update_dataset": mods.append}, framing)
+            values = {mod["key"]: mod["value"][1] for mod in mods}
+            np.testing.assert_equal(
+                values["array"], np.arange(1000, dtype=np.int32).reshape(10, 100))
+            self.assertEqual(values["text"], ["a", "b"])
+
     def tearDown(self):
         self.loop.close()
+
+
+class FramingCase(unittest.TestCase):
+    def test_roundtrip(self):
+        obj = {
+            "action": "update_dataset",
+            "args": ({"key": "x", "value": (False, np.linspace(0, 1, 5), {}),
+                      "path": []}, ),
+            "kwargs": {"y": [np.zeros((2, 0)), np.array(3.0), np.array(["s"])]}
+        }
+        rfd, wfd = os.pipe()
+        with open(rfd, "rb", 0) as rf, open(wfd, "wb", 0) as wf:
+            for data in worker_ipc.encode_message(obj, worker_ipc.BINARY):
+                wf.write(data)
+            decoded = worker_ipc.read_message(rf.read)
+        np.testing.assert_equal(decoded["args"][0]["value"][1],
+                                np.linspace(0, 1, 5))
+        self.assertEqual(decoded["kwargs"]["y"][0].shape, (2, 0))
+        self.assertEqual(decoded["kwargs"]["y"][1], 3.0)
+        self.assertEqual(decoded["kwargs"]["y"][2][0], "s")
+        # arrays are writable
+        decoded["args"][0]["value"][1][0] = 1
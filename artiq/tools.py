@@ -13,7 +13,7 @@ import numpy as np
 from sipyco import pyon
 
 from artiq import __version__ as artiq_version
-from artiq.appdirs import user_config_dir
+from artiq.appdirs import user_config_dir, user_cache_dir
 from artiq.language.environment import is_public_experiment
 from artiq.language import units
 
@@ -24,7 +24,7 @@ __all__ = ["parse_arguments",
            "short_format", "file_import",
            "get_experiment",
            "exc_to_warning", "asyncio_wait_or_cancel",
-           "get_windows_drives", "get_user_config_dir"]
+           "get_windows_drives", "get_user_config_dir", "get_user_cache_dir"]
 
 
 logger = logging.getLogger(__name__)
@@ -198,3 +198,10 @@ def get_user_config_dir():
     dir = user_config_dir("artiq", "m-labs", major)
     os.makedirs(dir, exist_ok=True)
     return dir
+
+
+def get_user_cache_dir():
+    major = artiq_version.split(".")[0]
+    dir = user_cache_dir("artiq", "m-labs", major)
+    os.makedirs(dir, exist_ok=True)
+    return dir